@@ -0,0 +1,69 @@
+"""
+HyperLogLog accuracy versus sketch size, plus add() and merge costs.
+
+    python benchmarks/active_user_sketches.py [--max-users 1000000] [--trials 3]
+
+For each precision, reports the worst relative error over the trials at every cardinality up
+to --max-users (random uuid4 ids). ACTIVE_USERS_HLL_PRECISION is the one the server stores.
+"""
+from pathlib import Path
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+os.environ.setdefault('EMERGENT_LLM_KEY', 'benchmark-key')
+
+import server  # noqa: E402
+
+PRECISIONS = (10, 12, 14, 16)
+
+
+def main(max_users: int, trials: int):
+    checkpoints = [n for n in (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000) if n <= max_users]
+    worst = {p: {n: 0.0 for n in checkpoints} for p in PRECISIONS}
+
+    for _ in range(trials):
+        sketches = {p: server.HyperLogLog(p) for p in PRECISIONS}
+        added = 0
+        for n in checkpoints:
+            while added < n:
+                value = uuid.uuid4().hex
+                for sketch in sketches.values():
+                    sketch.add(value)
+                added += 1
+            for p, sketch in sketches.items():
+                worst[p][n] = max(worst[p][n], abs(sketch.count() - n) / n)
+
+    print(f"{'p':>3} {'bytes':>6}  " + "  ".join(f"{'n=' + str(n):>10}" for n in checkpoints))
+    for p in PRECISIONS:
+        marker = " <- server" if p == server.ACTIVE_USERS_HLL_PRECISION else ""
+        errors = "  ".join(f"{100 * worst[p][n]:>9.2f}%" for n in checkpoints)
+        print(f"{p:>3} {1 << p:>6}  {errors}{marker}")
+
+    sketch = server.HyperLogLog()
+    values = [uuid.uuid4().hex for _ in range(100_000)]
+    started = time.perf_counter()
+    for value in values:
+        sketch.add(value)
+    print(f"add: {(time.perf_counter() - started) / len(values) * 1e6:.2f} us")
+
+    days = [server.HyperLogLog(registers=sketch.to_bytes()) for _ in range(30)]
+    started = time.perf_counter()
+    total = server.HyperLogLog()
+    for day in days:
+        total.merge(day)
+    total.count()
+    print(f"merge + count of 30 daily sketches: {(time.perf_counter() - started) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--max-users", type=int, default=1_000_000)
+    parser.add_argument("--trials", type=int, default=3)
+    args = parser.parse_args()
+    main(args.max_users, args.trials)
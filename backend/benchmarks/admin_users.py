@@ -0,0 +1,122 @@
+"""
+Latency of GET /api/admin/users pages on a seeded user base (needs a reachable mongod).
+
+    python benchmarks/admin_users.py [--users 50000] [--pages 20]
+
+Seeds a scratch database (dropped afterwards) with users and their user_stats rows, creates the
+production indexes, then times the endpoint: the first page for every sort field (user fields and
+user_stats aggregates) in both directions, a walk of --pages pages through next_cursor, and
+search pages.
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+os.environ.setdefault('EMERGENT_LLM_KEY', 'benchmark-key')
+
+import server  # noqa: E402
+from db_indexes import ensure_indexes, ADMIN_USER_SORT_FIELDS, ADMIN_USER_STATS_SORT_FIELDS  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+
+async def seed(db, users: int) -> str:
+    rng = random.Random(1)
+    now = datetime.now(timezone.utc)
+    admin_id = str(uuid.uuid4())
+    await db.users.insert_one({
+        "id": admin_id, "sequence_id": 1, "name": "Admin", "email": "admin@example.com",
+        "is_admin": True, "omega_tokens_balance": 0, "created_at": now - timedelta(days=400),
+        "search_keys": server.user_search_keys("Admin", "admin@example.com")
+    })
+    await db.user_stats.insert_one({"user_id": admin_id, "agents_count": 0, "total_tokens_consumed": 0})
+    for offset in range(0, users, 5000):
+        batch, stats = [], []
+        for i in range(offset, min(users, offset + 5000)):
+            user_id = str(uuid.uuid4())
+            created_at = now - timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+            user = {
+                "id": user_id, "sequence_id": i + 2, "name": f"User {i}", "email": f"user{i}@example.com",
+                "is_admin": False, "omega_tokens_balance": rng.randint(0, 100_000), "created_at": created_at,
+                "search_keys": server.user_search_keys(f"User {i}", f"user{i}@example.com")
+            }
+            if rng.random() < 0.8:  # Some users never logged in
+                user["last_login_at"] = created_at + timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+            batch.append(user)
+            stats.append({
+                "user_id": user_id, "agents_count": rng.randint(0, 50),
+                "total_tokens_consumed": rng.randint(0, 500_000), "max_openai_tokens": rng.randint(0, 20_000)
+            })
+        await db.users.insert_many(batch)
+        await db.user_stats.insert_many(stats)
+    return server.create_jwt_token(admin_id, "admin@example.com", True)
+
+
+def admin_request(token: str) -> Request:
+    return Request({
+        "type": "http", "method": "GET", "path": "/api/admin/users", "query_string": b"",
+        "headers": [(b"authorization", f"Bearer {token}".encode())], "client": ("127.0.0.1", 0)
+    })
+
+
+async def timed(coro) -> tuple:
+    started = time.perf_counter()
+    result = await coro
+    return result, (time.perf_counter() - started) * 1000
+
+
+async def main(users: int, pages: int):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], serverSelectionTimeoutMS=2000)
+    try:
+        await client.admin.command("ping")
+    except PyMongoError as e:
+        sys.exit(f"No mongod reachable at {os.environ['MONGO_URL']}: {e}")
+
+    name = f"omega_benchmark_{uuid.uuid4().hex[:8]}"
+    server.db = client[name]
+    try:
+        started = time.perf_counter()
+        request = admin_request(await seed(server.db, users))
+        await ensure_indexes(server.db)
+        print(f"seeded {users} users in {time.perf_counter() - started:.1f} s")
+
+        for sort_by in ADMIN_USER_SORT_FIELDS + ADMIN_USER_STATS_SORT_FIELDS:
+            for sort_dir in ("asc", "desc"):
+                _, elapsed = await timed(server.get_admin_users(request, sort_by=sort_by, sort_dir=sort_dir))
+                print(f"first page  {sort_by:22s} {sort_dir:4s} {elapsed:8.1f} ms")
+
+        latencies, cursor = [], None
+        for _ in range(pages):
+            page, elapsed = await timed(server.get_admin_users(request, cursor=cursor))
+            latencies.append(elapsed)
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        latencies.sort()
+        print(f"walk {len(latencies)} pages: p50 {latencies[len(latencies) // 2]:.1f} ms, max {latencies[-1]:.1f} ms")
+
+        _, elapsed = await timed(server.get_admin_users(request, search="user123"))
+        print(f"search 'user123'                  {elapsed:8.1f} ms")
+        _, elapsed = await timed(server.get_admin_users(request, search="user123", sort_by="agents_count"))
+        print(f"search 'user123' by agents_count  {elapsed:8.1f} ms")
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--pages", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.pages))
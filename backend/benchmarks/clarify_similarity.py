@@ -0,0 +1,91 @@
+"""
+Near-duplicate clarify lookup: MinHashLSHIndex build time, query latency and recall.
+
+    python benchmarks/clarify_similarity.py [--entries 100000] [--queries 1000]
+
+Entries are random 15-60 word texts over a 5,000 word vocabulary. Near-duplicate queries
+replace one word in the middle of a stored text; recall is reported both over all of them and
+over the pairs whose true word 3-gram Jaccard similarity is >= the threshold. A last run fills
+a ClarifySimilarityIndex capped at a tenth of the entries to time adds that evict.
+"""
+from pathlib import Path
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+os.environ.setdefault('EMERGENT_LLM_KEY', 'benchmark-key')
+
+import server  # noqa: E402
+
+
+def shingles(text: str) -> set:
+    words = text.split()
+    return {" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def percentile(samples: list, q: float) -> float:
+    return sorted(samples)[int(len(samples) * q)] * 1e6
+
+
+def main(entries: int, queries: int):
+    rng = random.Random(1)
+    vocab = [f"w{i}" for i in range(5000)]
+    index = server.MinHashLSHIndex(threshold=server.CLARIFY_SIMILARITY_THRESHOLD)
+
+    texts = []
+    started = time.perf_counter()
+    for i in range(entries):
+        text = " ".join(rng.choices(vocab, k=rng.randint(15, 60)))
+        texts.append(text)
+        index.add(str(i), text, i)
+    print(f"build: {entries} entries in {time.perf_counter() - started:.1f} s")
+
+    near = []
+    for i in rng.sample(range(entries), queries):
+        words = texts[i].split()
+        words[len(words) // 2] = "changed"
+        near.append((i, " ".join(words)))
+
+    latencies, hits, eligible, eligible_hits = [], 0, 0, 0
+    for i, query in near:
+        started = time.perf_counter()
+        match = index.query(query)
+        latencies.append(time.perf_counter() - started)
+        found = bool(match and match[0] == i)
+        hits += found
+        a, b = shingles(texts[i]), shingles(query)
+        if len(a & b) / len(a | b) >= index.threshold:
+            eligible += 1
+            eligible_hits += found
+
+    unrelated = []
+    for _ in range(queries):
+        query = " ".join(rng.choices(vocab, k=30))
+        started = time.perf_counter()
+        index.query(query)
+        unrelated.append(time.perf_counter() - started)
+
+    print(f"near-duplicate lookup: p50 {percentile(latencies, 0.5):.0f} us, p99 {percentile(latencies, 0.99):.0f} us")
+    print(f"unrelated lookup:      p50 {percentile(unrelated, 0.5):.0f} us, p99 {percentile(unrelated, 0.99):.0f} us")
+    print(f"recall: {100 * hits / len(near):.1f}% of all near-duplicates, "
+          f"{100 * eligible_hits / max(1, eligible):.1f}% of {eligible} pairs with Jaccard >= {index.threshold}")
+
+    capped = server.ClarifySimilarityIndex(index.threshold, max(1, entries // 10), server.RESPONSE_CACHE_TTL_SECONDS)
+    started = time.perf_counter()
+    for i, text in enumerate(texts):
+        capped.add("scope", str(i), text, [], 0)
+    elapsed = time.perf_counter() - started
+    print(f"capped index ({capped.max_entries} entries): {elapsed / entries * 1e6:.0f} us/add, {capped.evicted} evicted")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+    main(args.entries, args.queries)
@@ -0,0 +1,85 @@
+"""
+Client setup cost per LLM call on the default route: LlmChat per call versus LlmClientPool.
+
+    python benchmarks/llm_client_pool.py [--iterations 200] [--requests 0]
+
+The route is the one production uses by default: the Emergent key (EMERGENT_LLM_KEY) sent to
+LLM_API_BASE, which defaults to the Emergent proxy. The first rows measure client construction
+only (no request is sent), so the TLS handshake a fresh client also pays on the wire comes on top
+of the "per call" numbers. With --requests N and a real key, N short completions are also sent
+both ways, which includes that handshake.
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+os.environ.setdefault('EMERGENT_LLM_KEY', 'benchmark-key')
+
+import server  # noqa: E402
+from emergentintegrations.llm.chat import UserMessage  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+
+
+async def construction(route: server.LlmRoute, iterations: int):
+    rows = []
+
+    started = time.perf_counter()
+    for i in range(iterations):
+        server.llm_pool.chat(route, f"session-{i}", "system")
+    rows.append(("LlmChat per call (baseline)", time.perf_counter() - started))
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        client = AsyncOpenAI(api_key=route.api_key, base_url=server.LLM_API_BASE)
+        await client.close()
+    rows.append(("AsyncOpenAI built and closed per call", time.perf_counter() - started))
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        server.llm_pool.client(route)
+    rows.append(("LlmClientPool.client (amortized)", time.perf_counter() - started))
+
+    for name, elapsed in rows:
+        print(f"{name:40s} {elapsed / iterations * 1000:8.3f} ms/call")
+
+
+async def requests(route: server.LlmRoute, count: int):
+    async def per_call(i: int):
+        await server.llm_pool.chat(route, f"benchmark-{i}", "Reply with one word.").send_message(UserMessage(text="ping"))
+
+    async def pooled(i: int):
+        await server.llm_pool.send(route, "Reply with one word.", "ping", f"benchmark-{i}")
+
+    for name, call in (("LlmChat per call (baseline)", per_call), ("LlmClientPool.send", pooled)):
+        latencies = []
+        for i in range(count):
+            started = time.perf_counter()
+            await call(i)
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        print(f"{name:40s} p50 {statistics.median(latencies):8.1f} ms, p95 {latencies[int(len(latencies) * 0.95)]:8.1f} ms")
+
+
+async def main(iterations: int, request_count: int):
+    # What resolve_llm_route returns with default platform settings (use_emergent_key)
+    route = server.LlmRoute(stage="final", api_key=server.EMERGENT_LLM_KEY)
+    print(f"route: {route.provider}/{route.model} via {server.LLM_API_BASE or 'LlmChat (LLM_API_BASE empty)'}")
+    await construction(route, iterations)
+    if request_count:
+        await requests(route, request_count)
+    await server.llm_pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main(args.iterations, args.requests))
@@ -0,0 +1,148 @@
+"""
+Latency of GET /api/prompts/search on a seeded prompt collection (needs a reachable mongod).
+
+    python benchmarks/prompt_search.py [--prompts 1000000] [--users 10000] [--searches 500]
+
+Seeds a scratch database (dropped afterwards) with prompts spread evenly over the users. A third
+of the bodies are shared templates (deduplicated in prompt_bodies); the rest are unique. Then it
+creates the production indexes and times searches by random users for one or two random
+vocabulary words, both for the first page and for the page after it (via next_cursor).
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+os.environ.setdefault('EMERGENT_LLM_KEY', 'benchmark-key')
+
+import server  # noqa: E402
+from db_indexes import ensure_indexes  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+VOCABULARY = [f"slovo{i}" for i in range(2000)] + [
+    "účetní", "faktura", "zákazník", "objednávka", "podpora", "reklamace", "termín", "dotaz"
+]
+TEMPLATES = 1000
+
+
+def body_document(text: str) -> dict:
+    raw = text.encode('utf-8')
+    compressed = zlib.compress(raw, server.PROMPT_BODY_COMPRESSION_LEVEL)
+    return {
+        "id": server.prompt_body_hash(text),
+        "body": compressed,
+        "size": len(text),
+        "raw_bytes": len(raw),
+        "stored_bytes": len(compressed),
+        "terms": server.master_prompt_terms(text),
+        "refcount": 0,
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
+    }
+
+
+async def seed(db, prompts: int, users: int, rng: random.Random) -> list:
+    user_ids = [str(uuid.uuid4()) for _ in range(users)]
+    templates = [" ".join(rng.choices(VOCABULARY, k=300)) for _ in range(TEMPLATES)]
+    await db.prompt_bodies.insert_many([body_document(text) for text in templates])
+    template_hashes = [server.prompt_body_hash(text) for text in templates]
+    now = datetime.now(timezone.utc)
+
+    for offset in range(0, prompts, 5000):
+        batch, bodies = [], []
+        for i in range(offset, min(prompts, offset + 5000)):
+            if rng.random() < 1 / 3:
+                body_hash = rng.choice(template_hashes)
+            else:
+                body = body_document(" ".join(rng.choices(VOCABULARY, k=300)) + f" unikat{i}")
+                bodies.append(body)
+                body_hash = body["id"]
+            batch.append({
+                "id": str(uuid.uuid4()),
+                "user_id": user_ids[i % users],
+                "name": " ".join(rng.choices(VOCABULARY, k=3)),
+                "description": {
+                    "general_function": " ".join(rng.choices(VOCABULARY, k=8)),
+                    "specialization": " ".join(rng.choices(VOCABULARY, k=8)),
+                    "output": " ".join(rng.choices(VOCABULARY, k=8))
+                },
+                "master_prompt_hash": body_hash,
+                "master_prompt_size": 2400,
+                "created_at": now - timedelta(minutes=i)
+            })
+        if bodies:
+            await db.prompt_bodies.insert_many(bodies)
+        await db.generated_prompts.insert_many(batch)
+    return user_ids
+
+
+def user_request(user_id: str) -> Request:
+    token = server.create_jwt_token(user_id, f"{user_id}@example.com", False)
+    return Request({
+        "type": "http", "method": "GET", "path": "/api/prompts/search", "query_string": b"",
+        "headers": [(b"authorization", f"Bearer {token}".encode())], "client": ("127.0.0.1", 0)
+    })
+
+
+def summary(name: str, latencies: list):
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+    print(f"{name:12s} p50 {pick(0.5):7.1f} ms  p95 {pick(0.95):7.1f} ms  p99 {pick(0.99):7.1f} ms  ({len(latencies)} searches)")
+
+
+async def main(prompts: int, users: int, searches: int):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], serverSelectionTimeoutMS=2000, tz_aware=True)
+    try:
+        await client.admin.command("ping")
+    except PyMongoError as e:
+        sys.exit(f"No mongod reachable at {os.environ['MONGO_URL']}: {e}")
+
+    rng = random.Random(1)
+    name = f"omega_benchmark_{uuid.uuid4().hex[:8]}"
+    server.db = client[name]
+    try:
+        started = time.perf_counter()
+        user_ids = await seed(server.db, prompts, users, rng)
+        await ensure_indexes(server.db)
+        print(f"seeded {prompts} prompts for {users} users in {time.perf_counter() - started:.0f} s")
+
+        # Profiles for require_auth
+        await server.db.users.insert_many([{"id": user_id, "email": f"{user_id}@example.com", "name": "User"} for user_id in user_ids])
+
+        first, second = [], []
+        for _ in range(searches):
+            request = user_request(rng.choice(user_ids))
+            query = " ".join(rng.choices(VOCABULARY, k=rng.randint(1, 2)))
+            started = time.perf_counter()
+            page = await server.search_generated_prompts(request, q=query, limit=server.PROMPT_SEARCH_PAGE_SIZE)
+            first.append((time.perf_counter() - started) * 1000)
+            if page["next_cursor"]:
+                started = time.perf_counter()
+                await server.search_generated_prompts(request, q=query, cursor=page["next_cursor"])
+                second.append((time.perf_counter() - started) * 1000)
+        summary("first page", first)
+        if second:
+            summary("next page", second)
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--prompts", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--searches", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.prompts, args.users, args.searches))
@@ -0,0 +1,76 @@
+"""
+Cost of highlighting one page of prompt search hits with ~20 KB master_prompts.
+
+    python benchmarks/prompt_search_highlight.py [--hits 20] [--size 20000] [--rounds 50]
+
+Times search_pattern plus highlight_text over every highlighted field, as the search endpoint
+does per page, with the matched word near the start of master_prompt and at its very end.
+The folded-copy row is the alternative the pattern avoids: folding each body before matching.
+Ranking itself runs in MongoDB's text index and is not measured here.
+"""
+from pathlib import Path
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'benchmark')
+os.environ.setdefault('EMERGENT_LLM_KEY', 'benchmark-key')
+
+import server  # noqa: E402
+
+WORDS = "agent zákazník odpověď dotaz faktura objednávka stav termín řešení kontakt e-mail telefon".split()
+
+
+def make_hit(rng: random.Random, size: int, at_end: bool) -> dict:
+    words = []
+    while sum(len(word) + 1 for word in words) < size:
+        words.append(rng.choice(WORDS))
+    words.insert(len(words) if at_end else 20, "Účetní")
+    return {
+        "name": "Asistent zákaznické podpory",
+        "master_prompt": " ".join(words),
+        "description": {"general_function": "Podpora", "specialization": "Odpovídá na dotazy", "output": "E-mail"}
+    }
+
+
+def highlight_page(hits: list, query: str):
+    pattern = server.search_pattern(server.search_terms(query))
+    for hit in hits:
+        texts = {"name": hit["name"], "master_prompt": hit["master_prompt"]}
+        for key, value in hit["description"].items():
+            texts[f"description.{key}"] = value
+        for field in server.PROMPT_HIGHLIGHT_FIELDS:
+            server.highlight_text(field, texts.get(field) or "", pattern)
+
+
+def time_page(function, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+def main(hits: int, size: int, rounds: int):
+    rng = random.Random(1)
+    query = "ucetni"
+    for label, at_end in (("match near the start", False), ("match at the end", True)):
+        page = [make_hit(rng, size, at_end) for _ in range(hits)]
+        elapsed = time_page(lambda: highlight_page(page, query), rounds)
+        print(f"{label:22s} {elapsed:7.2f} ms/page")
+
+    page = [make_hit(rng, size, True) for _ in range(hits)]
+    elapsed = time_page(lambda: [server.fold_text(hit["master_prompt"]).find(query) for hit in page], rounds)
+    print(f"{'folded copy per hit':22s} {elapsed:7.2f} ms/page (folding alone)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--hits", type=int, default=20)
+    parser.add_argument("--size", type=int, default=20_000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+    main(args.hits, args.size, args.rounds)
@@ -0,0 +1,363 @@
+"""
+MongoDB index definitions for the Omega-Aurora Codex backend.
+
+ensure_indexes() runs at API startup and is idempotent; it first creates missing time-series
+collections (TIME_SERIES_COLLECTIONS), whose type cannot be changed once the collection exists.
+The same module is a CLI:
+
+    python db_indexes.py             # create missing indexes
+    python db_indexes.py --report    # missing, unused (since mongod start) and unmanaged indexes
+    python db_indexes.py --explain   # read-only: check that the hot queries are answered by an IXSCAN
+    python db_indexes.py --convert-time-series   # replace existing plain collections (see below)
+
+tests/test_db_indexes.py runs the same hot-query check against a scratch database.
+"""
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import CollectionInvalid, OperationFailure
+from pathlib import Path
+from typing import Dict, List
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Fields the admin user listing may sort on; each gets a (field, id) keyset index
+ADMIN_USER_SORT_FIELDS = ("created_at", "last_login_at", "name", "email", "omega_tokens_balance", "sequence_id")
+# Usage aggregates it may also sort on, paged from user_stats on a (field, user_id) index
+ADMIN_USER_STATS_SORT_FIELDS = ("agents_count", "total_tokens_consumed")
+
+# Fields covered by the prompt search text index and their relative weights. Bodies live in
+# prompt_bodies; search matches their terms among the caller's bodies (weight 1, like
+# master_prompt here, which covers not yet migrated prompts).
+PROMPT_SEARCH_WEIGHTS = {
+    "name": 10,
+    "description.general_function": 5,
+    "description.specialization": 5,
+    "description.output": 5,
+    "master_prompt": 1,
+}
+
+# Cached clarify/optimize replies expire this long after they were stored
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+
+# Audit entries are removed by Mongo once their timestamp is older than this
+AUDIT_LOG_RETENTION_SECONDS = int(os.environ.get('AUDIT_LOG_RETENTION_SECONDS', str(365 * 24 * 3600)))
+
+# Collections stored as time-series collections. An existing plain collection under one of these
+# names is only replaced on an explicit conversion (--convert-time-series or the admin endpoint),
+# run once no worker of an older release can recreate it: it is renamed to <name>_legacy_<suffix>
+# and the API migrates the legacy documents.
+TIME_SERIES_COLLECTIONS = {
+    "audit_logs": {
+        # One bucket series per (user, action); per-user lookups read only that user's buckets
+        "timeseries": {"timeField": "timestamp", "metaField": "meta", "granularity": "hours"},
+        "expireAfterSeconds": AUDIT_LOG_RETENTION_SECONDS,
+    },
+}
+LEGACY_COLLECTION_INFIX = "_legacy_"
+
+INDEX_CONFLICT_CODES = (85, 86)  # IndexOptionsConflict, IndexKeySpecsConflict
+INDEX_NOT_FOUND_CODES = (26, 27)  # NamespaceNotFound, IndexNotFound
+
+# Only documents that actually carry a string value take part in partial unique indexes
+def _has_string(field: str) -> dict:
+    return {field: {"$type": "string"}}
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("referral_code", ASCENDING)], unique=True, partialFilterExpression=_has_string("referral_code")),
+        IndexModel([("phone_number", ASCENDING)], unique=True, partialFilterExpression=_has_string("phone_number")),
+        IndexModel([("referred_by", ASCENDING)], partialFilterExpression=_has_string("referred_by")),
+        IndexModel([("token_holds.expires_at", ASCENDING)], sparse=True),
+        *[IndexModel([(field, ASCENDING), ("id", ASCENDING)]) for field in ADMIN_USER_SORT_FIELDS],
+        # Admin search: anchored prefix regexes over folded name words and email (multikey)
+        IndexModel([("search_keys", ASCENDING)]),
+    ],
+    "token_transactions": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("transaction_type", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("transaction_type", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("created_at", ASCENDING)]),
+    ],
+    "generated_prompts": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        # Keyset pages of a user's history: (created_at, id) newest first
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),
+        # A user's distinct bodies (covered) and their prompts, for matching body terms in search
+        IndexModel([("user_id", ASCENDING), ("master_prompt_hash", ASCENDING)]),
+        # Per-user full-text search: the user_id prefix limits each query to that user's postings.
+        # Version 3 text indexes fold case and diacritics; "none" disables stemming (no Czech stemmer).
+        IndexModel(
+            [("user_id", ASCENDING)] + [(field, TEXT) for field in PROMPT_SEARCH_WEIGHTS],
+            name="prompt_search_v3",
+            weights=PROMPT_SEARCH_WEIGHTS,
+            default_language="none",
+            textIndexVersion=3,
+        ),
+    ],
+    "prompt_bodies": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "audit_logs": [
+        # Retention is the collection's expireAfterSeconds, so no TTL index on timestamp
+        IndexModel([("meta.user_id", ASCENDING), ("timestamp", DESCENDING)]),
+    ],
+    "gdpr_export_jobs": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("updated_at", ASCENDING)]),
+    ],
+    "gdpr_deletion_jobs": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("requested_at", ASCENDING)]),
+    ],
+    "retention_runs": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("started_at", DESCENDING)]),
+    ],
+    "phone_verifications": [
+        IndexModel([("phone_number", ASCENDING)], unique=True),
+        # Removed by Mongo once expires_at (a BSON date) has passed
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "settings": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "llm_response_cache": [
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=RESPONSE_CACHE_TTL_SECONDS),
+        IndexModel([("stage", ASCENDING), ("created_at", ASCENDING)]),
+    ],
+    "user_stats": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+        *[IndexModel([(field, ASCENDING), ("user_id", ASCENDING)]) for field in ADMIN_USER_STATS_SORT_FIELDS],
+    ],
+    "token_rollups": [
+        IndexModel([("period", ASCENDING), ("bucket", ASCENDING)], unique=True),
+    ],
+    "active_user_sketches": [
+        IndexModel([("day", ASCENDING)], unique=True),
+    ],
+    "admin_snapshots": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "migrations": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "leases": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+}
+
+# Indexes superseded by a definition above, dropped before it is created
+# (a collection can only have one text index, so older prompt_search versions must go first)
+RETIRED_INDEXES: Dict[str, List[str]] = {
+    "generated_prompts": ["user_id_1_created_at_-1", "prompt_search", "prompt_search_v2"],
+    # Global text index over shared bodies - a search scanned every user's postings
+    "prompt_bodies": ["prompt_body_search"],
+}
+
+# Hot queries (collection, filter, sort) that must be served by an index
+HOT_QUERIES = [
+    ("users", {"id": "x"}, None),
+    ("users", {"email": "x"}, None),
+    ("users", {"referral_code": "x"}, None),
+    ("users", {"phone_number": "x"}, None),
+    ("users", {"referred_by": "x"}, None),
+    ("users", {"token_holds.expires_at": {"$lt": "x"}}, None),
+    ("users", {"last_login_at": {"$lt": "x"}, "is_admin": False}, None),
+    ("users", {"search_keys": {"$regex": "^x"}}, None),
+    ("user_stats", {"agents_count": {"$lt": 1}}, {"agents_count": -1, "user_id": -1}),
+    ("user_stats", {"total_tokens_consumed": {"$lt": 1}}, {"total_tokens_consumed": -1, "user_id": -1}),
+    ("token_transactions", {"user_id": "x"}, None),
+    ("token_transactions", {"user_id": "x", "transaction_type": "usage"}, {"created_at": -1}),
+    ("token_transactions", {"created_at": {"$lt": "x"}}, None),
+    ("generated_prompts", {"id": "x"}, None),
+    ("generated_prompts", {"user_id": "x"}, {"created_at": -1, "id": -1}),
+    ("generated_prompts", {"id": "x", "user_id": "x"}, None),
+    ("generated_prompts", {"user_id": "x", "$text": {"$search": "x"}}, None),
+    ("prompt_bodies", {"id": "x"}, None),
+    ("prompt_bodies", {"id": {"$in": ["x"]}, "terms": {"$regex": "(?:^| )(?:x)(?: |$)"}}, None),
+    ("generated_prompts", {"user_id": "x", "master_prompt_hash": {"$in": ["x"]}}, None),
+    ("audit_logs", {"meta.user_id": "x"}, {"timestamp": -1}),
+    ("phone_verifications", {"phone_number": "x"}, None),
+    ("settings", {"id": "global"}, None),
+]
+
+
+async def legacy_collections(db, name: str) -> List[str]:
+    """Plain collections set aside when `name` became a time-series collection, not yet migrated"""
+    prefix = name + LEGACY_COLLECTION_INFIX
+    return sorted(c for c in await db.list_collection_names() if c.startswith(prefix))
+
+
+async def is_time_series(db, name: str) -> bool:
+    infos = await (await db.list_collections(filter={"name": name})).to_list(1)
+    return bool(infos) and infos[0].get("type") == "timeseries"
+
+
+async def ensure_time_series_collections(db, convert: bool = False):
+    """
+    Create missing time-series collections and keep expireAfterSeconds in sync. Plain collections
+    in their place are left alone unless convert is set.
+    """
+    for name, options in TIME_SERIES_COLLECTIONS.items():
+        for _ in range(5):
+            infos = await (await db.list_collections(filter={"name": name})).to_list(1)
+            if not infos:
+                try:
+                    await db.create_collection(name, **options)
+                    logger.info(f"Created time-series collection {name}")
+                except (CollectionInvalid, OperationFailure):
+                    pass  # Created by another worker (or an insert) in the meantime - check again
+                continue
+            if infos[0].get("type") != "timeseries":
+                if not convert:
+                    logger.warning(f"{name} is a plain collection; run the time-series conversion once all workers are updated")
+                    break
+                legacy = f"{name}{LEGACY_COLLECTION_INFIX}{uuid.uuid4().hex[:8]}"
+                try:
+                    await db[name].rename(legacy)
+                    logger.warning(f"Renamed plain collection {name} to {legacy} for migration")
+                except OperationFailure:
+                    pass  # Renamed by another worker
+                continue
+            if infos[0].get("options", {}).get("expireAfterSeconds") != options["expireAfterSeconds"]:
+                await db.command("collMod", name, expireAfterSeconds=options["expireAfterSeconds"])
+            break
+        else:
+            raise RuntimeError(f"Could not set up time-series collection {name}")
+
+
+async def ensure_indexes(db) -> dict:
+    """Create every defined index; failures are logged per index and do not stop the others"""
+    created, failed = 0, []
+    try:
+        await ensure_time_series_collections(db)
+    except Exception as e:
+        # Indexes are still created; a plain collection keeps working until this succeeds
+        logger.error(f"Failed to set up time-series collections: {str(e)}")
+        failed.append({"collection": ", ".join(TIME_SERIES_COLLECTIONS), "index": None, "error": str(e)})
+    for collection, names in RETIRED_INDEXES.items():
+        for name in names:
+            try:
+                await db[collection].drop_index(name)
+                logger.info(f"Dropped retired index {collection}.{name}")
+            except OperationFailure as e:
+                if e.code not in INDEX_NOT_FOUND_CODES:
+                    logger.error(f"Failed to drop retired index {collection}.{name}: {str(e)}")
+    for collection, models in INDEXES.items():
+        for model in models:
+            name = model.document["name"]
+            try:
+                await db[collection].create_indexes([model])
+                created += 1
+            except OperationFailure as e:
+                ttl = model.document.get("expireAfterSeconds")
+                if e.code in INDEX_CONFLICT_CODES and ttl is not None:
+                    # Same keys with a different TTL - adjust it in place instead of rebuilding
+                    await db.command("collMod", collection, index={"keyPattern": model.document["key"], "expireAfterSeconds": ttl})
+                    created += 1
+                    continue
+                logger.error(f"Failed to create index {collection}.{name}: {str(e)}")
+                failed.append({"collection": collection, "index": name, "error": str(e)})
+    return {"ensured": created, "failed": failed}
+
+
+async def index_report(db) -> dict:
+    """Compare defined indexes with the live ones and report missing, unused and unmanaged indexes"""
+    report = {}
+    for collection, models in INDEXES.items():
+        defined = {model.document["name"] for model in models}
+        existing = await db[collection].index_information()
+        usage = {}
+        try:
+            async for stat in db[collection].aggregate([{"$indexStats": {}}]):
+                usage[stat["name"]] = stat["accesses"]["ops"]
+        except OperationFailure:
+            pass  # $indexStats needs a real mongod (and clusterMonitor on Atlas)
+
+        report[collection] = {
+            "missing": sorted(defined - set(existing)),
+            "unused": sorted(name for name, ops in usage.items() if ops == 0 and name != "_id_"),
+            "unmanaged": sorted(set(existing) - defined - {"_id_"}),
+        }
+    return report
+
+
+def _plan_stages(plan: dict) -> List[str]:
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "outerStage", "innerStage"):
+        if key in plan:
+            stages += _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
+
+
+async def explain_hot_queries(db) -> List[dict]:
+    """Explain each hot query and report whether the winning plan uses an IXSCAN without a COLLSCAN"""
+    results = []
+    for collection, query, sort in HOT_QUERIES:
+        command = {"find": collection, "filter": query}
+        if sort:
+            command["sort"] = sort
+        explained = await db.command("explain", command, verbosity="queryPlanner")
+        # Time-series queries explain as a pipeline whose first stage queries the buckets
+        planner = explained.get("queryPlanner") or explained["stages"][0]["$cursor"]["queryPlanner"]
+        stages = _plan_stages(planner["winningPlan"])
+        results.append({
+            "collection": collection,
+            "filter": query,
+            "sort": sort,
+            "stages": stages,
+            "ixscan": "IXSCAN" in stages and "COLLSCAN" not in stages,
+        })
+    return results
+
+
+async def _main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Manage MongoDB indexes")
+    parser.add_argument("--report", action="store_true", help="report missing, unused and unmanaged indexes")
+    parser.add_argument("--explain", action="store_true", help="fail if a hot query does not use an index (read-only)")
+    parser.add_argument("--convert-time-series", action="store_true", help="replace plain collections that should be time-series")
+    args = parser.parse_args(argv)
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+    try:
+        if args.report:
+            print(json.dumps(await index_report(db), indent=2))
+            return 0
+        if args.explain:
+            # Explains against the indexes as they are; nothing is created
+            results = await explain_hot_queries(db)
+            for row in results:
+                status = "ok  " if row["ixscan"] else "FAIL"
+                print(f"{status} {row['collection']} {json.dumps(row['filter'])} -> {' > '.join(filter(None, row['stages']))}")
+            return 0 if all(row["ixscan"] for row in results) else 1
+
+        if args.convert_time_series:
+            await ensure_time_series_collections(db, convert=True)
+        result = await ensure_indexes(db)
+        print(json.dumps(result, indent=2))
+        return 1 if result["failed"] else 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
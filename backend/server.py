@@ -1,21 +1,39 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import StreamingResponse, FileResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
+import json
+import hashlib
+import re
+import unicodedata
+import zlib
+import zipfile
+import io
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Literal
+from typing import Dict, List, Optional, Literal
 from enum import Enum
+from types import MappingProxyType
+from collections import OrderedDict
 import uuid
 from datetime import datetime, timezone, timedelta
 import asyncio
+import base64
+import time
+from bson import json_util
 from emergentintegrations.llm.chat import LlmChat, UserMessage
+from db_indexes import ensure_indexes, ensure_time_series_collections, is_time_series, legacy_collections, ADMIN_USER_SORT_FIELDS, ADMIN_USER_STATS_SORT_FIELDS, AUDIT_LOG_RETENTION_SECONDS, RESPONSE_CACHE_TTL_SECONDS
 import jwt
 import bcrypt
 import httpx
+from cachetools import TTLCache
+import numpy as np
 
 
 ROOT_DIR = Path(__file__).parent
@@ -23,11 +41,17 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)  # Dates come back as aware UTC datetimes
 db = client[os.environ['DB_NAME']]
 
 # Emergent LLM Key
 EMERGENT_LLM_KEY = os.environ['EMERGENT_LLM_KEY']
+# OpenAI-compatible endpoint for the Emergent key - by default the proxy emergentintegrations itself
+# calls, so the default deployment uses pooled clients and real streaming. Empty = LlmChat per call.
+LLM_API_BASE = os.environ.get(
+    'LLM_API_BASE',
+    os.environ.get('INTEGRATION_PROXY_URL', 'https://integrations.emergentagent.com') + '/llm'
+) or None
 
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'omega-aurora-secret-key-change-in-production')
@@ -45,6 +69,108 @@ TOKENS_FOR_7_AGENTS = 35000   # 7 agents * 5000 tokens
 INITIAL_TOKENS = TOKENS_FOR_2_AGENTS  # New users get 2 free agents
 TOKEN_LIMIT_MIN = -60000  # Max debt = ~12 agents (to prevent attacks)
 
+# In-process user cache (per worker) - the short TTL bounds staleness across uvicorn workers
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', '10000'))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '30'))
+
+# Token escrow - estimate is held before each LLM call and settled to actual usage afterwards
+TOKEN_HOLD_ESTIMATE = 2000  # Average per stage
+TOKEN_HOLD_TTL_SECONDS = 120  # Longer than any LLM timeout; expired holds are reclaimed
+TOKEN_HOLD_SWEEP_INTERVAL_SECONDS = 60
+TOKEN_LEDGER_WRITE_ATTEMPTS = 3  # A usage transaction record is retried this often after its balance change
+
+# Clarify/optimize response cache - in-memory LRU in front of a Mongo collection with a TTL index
+RESPONSE_CACHE_MAX_SIZE = int(os.environ.get('RESPONSE_CACHE_MAX_SIZE', '2000'))
+RESPONSE_CACHE_MEMORY_TTL_SECONDS = float(os.environ.get('RESPONSE_CACHE_MEMORY_TTL_SECONDS', '3600'))
+RESPONSE_CACHE_HIT_CHARGE_RATIO = float(os.environ.get('RESPONSE_CACHE_HIT_CHARGE_RATIO', '0.1'))  # Share of the original cost charged on a hit
+
+# Active-user sketches - one HyperLogLog per UTC day (2^14 one-byte registers = 16 KB, ~0.8% std error)
+ACTIVE_USERS_HLL_PRECISION = 14
+ACTIVE_USERS_FLUSH_INTERVAL_SECONDS = 30
+ACTIVE_USERS_MAX_WINDOW_DAYS = 366
+
+# Online migration of legacy ISO-string timestamps to BSON dates
+DATETIME_MIGRATION_BATCH_SIZE = int(os.environ.get('DATETIME_MIGRATION_BATCH_SIZE', '500'))
+DATETIME_MIGRATION_PAUSE_SECONDS = float(os.environ.get('DATETIME_MIGRATION_PAUSE_SECONDS', '0.2'))  # Between batches
+DATETIME_MIGRATION_LEASE_SECONDS = 60
+
+# Content-addressed master_prompt storage - one zlib-compressed body per distinct text, reference counted
+PROMPT_BODY_COMPRESSION_LEVEL = 9
+PROMPT_BODY_MIGRATION_BATCH_SIZE = int(os.environ.get('PROMPT_BODY_MIGRATION_BATCH_SIZE', '200'))
+PROMPT_BODY_MIGRATION_PAUSE_SECONDS = float(os.environ.get('PROMPT_BODY_MIGRATION_PAUSE_SECONDS', '0.2'))  # Between batches
+PROMPT_BODY_MIGRATION_LEASE_SECONDS = 60
+PROMPT_BODY_REBUILD_GRACE_SECONDS = 600  # Bodies referenced this recently are left alone by a rebuild
+
+# GDPR export - streamed from Mongo cursors; large accounts can run it as a job that writes a zip to disk
+GDPR_EXPORT_BATCH_SIZE = 500
+GDPR_EXPORT_CHUNK_BYTES = 64 * 1024  # Flush streamed output in chunks of about this size
+GDPR_EXPORT_DIR = Path(os.environ.get('GDPR_EXPORT_DIR', '/tmp/omega-gdpr-exports'))
+GDPR_EXPORT_RETENTION_HOURS = int(os.environ.get('GDPR_EXPORT_RETENTION_HOURS', '24'))
+GDPR_EXPORT_STALE_SECONDS = 600  # A running job without progress for this long is marked failed
+GDPR_EXPORT_SWEEP_INTERVAL_SECONDS = 600
+
+# GDPR account deletion - a background job works through the user's data in checkpointed batches
+GDPR_DELETION_BATCH_SIZE = int(os.environ.get('GDPR_DELETION_BATCH_SIZE', '500'))
+GDPR_DELETION_PAUSE_SECONDS = float(os.environ.get('GDPR_DELETION_PAUSE_SECONDS', '0.1'))  # Between batches
+GDPR_DELETION_LEASE_SECONDS = max(60, int(USER_CACHE_TTL_SECONDS) + 30)  # Outlasts the account step waiting for user caches to expire
+GDPR_DELETION_POLL_SECONDS = 60  # How often workers look for unfinished jobs (new requests wake them at once)
+GDPR_DELETION_MAX_ATTEMPTS = 5
+GDPR_DELETION_TOKEN_DAYS = int(os.environ.get('GDPR_DELETION_TOKEN_DAYS', '30'))  # Lifetime of a job's status token
+GDPR_AUDIT_RECENT_DAYS = 30  # Audit logs newer than this are deleted, older ones anonymized
+
+# Audit log writer - log_audit only enqueues; a background task writes batches with insert_many
+AUDIT_QUEUE_MAX_SIZE = int(os.environ.get('AUDIT_QUEUE_MAX_SIZE', '10000'))
+AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', '500'))  # Flush once this many entries are buffered...
+AUDIT_FLUSH_INTERVAL_SECONDS = float(os.environ.get('AUDIT_FLUSH_INTERVAL_MS', '200')) / 1000  # ...or this long after the first one
+AUDIT_OVERFLOW_POLICY = os.environ.get('AUDIT_OVERFLOW_POLICY', 'block')  # "block" (up to the timeout, then drop) or "drop"
+AUDIT_ENQUEUE_TIMEOUT_SECONDS = float(os.environ.get('AUDIT_ENQUEUE_TIMEOUT_SECONDS', '1'))
+AUDIT_WRITE_ATTEMPTS = 3
+
+# Migration of audit entries from the plain collection set aside when audit_logs became time-series
+AUDIT_MIGRATION_BATCH_SIZE = int(os.environ.get('AUDIT_MIGRATION_BATCH_SIZE', '1000'))
+AUDIT_MIGRATION_PAUSE_SECONDS = float(os.environ.get('AUDIT_MIGRATION_PAUSE_SECONDS', '0.2'))  # Between batches
+AUDIT_MIGRATION_LEASE_SECONDS = 60
+
+# Data retention - scheduled, leased, batched and throttled so production traffic keeps priority
+RETENTION_INTERVAL_SECONDS = float(os.environ.get('RETENTION_INTERVAL_SECONDS', str(24 * 3600)))
+RETENTION_CHECK_INTERVAL_SECONDS = 3600  # How often workers check whether a run is due
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '500'))
+RETENTION_MAX_OPS_PER_SECOND = float(os.environ.get('RETENTION_MAX_OPS_PER_SECOND', '200'))
+RETENTION_LEASE_SECONDS = 120
+RETENTION_TRANSACTION_DAYS = 365 * 7  # Accounting retention
+RETENTION_INACTIVE_USER_DAYS = 365 * 2
+
+# Admin overview snapshot - recomputed in the background, served from memory / Mongo
+OVERVIEW_REFRESH_MIN_SECONDS = 5
+
+# Near-duplicate clarify index (MinHash/LSH) - reuses questions of similar business use cases
+CLARIFY_SIMILARITY_THRESHOLD = float(os.environ.get('CLARIFY_SIMILARITY_THRESHOLD', '0.8'))  # Estimated Jaccard of word 3-grams
+CLARIFY_INDEX_MAX_ENTRIES = int(os.environ.get('CLARIFY_INDEX_MAX_ENTRIES', '200000'))
+CLARIFY_INDEX_SYNC_INTERVAL_SECONDS = 60
+
+# Platform settings snapshot - workers poll the settings version and reload when it changes
+SETTINGS_VERSION_POLL_SECONDS = float(os.environ.get('SETTINGS_VERSION_POLL_SECONDS', '5'))
+
+# Admin user listing - keyset pages sorted on indexed user fields (ADMIN_USER_SORT_FIELDS) or on
+# user_stats aggregates (ADMIN_USER_STATS_SORT_FIELDS); search prefix-matches users.search_keys
+ADMIN_USERS_PAGE_SIZE = 50
+ADMIN_USERS_MAX_PAGE_SIZE = 200
+ADMIN_USERS_SEARCH_MAX_WORDS = 5
+ADMIN_USER_LISTING_MIGRATION_ID = "admin_user_listing"
+
+# Prompt history - keyset pages of (created_at, id) per user, master_prompt only on the detail fetch
+PROMPTS_PAGE_SIZE = 20
+PROMPTS_MAX_PAGE_SIZE = 100
+
+# Prompt search - prompt fields through the per-user text index (db_indexes.PROMPT_SEARCH_WEIGHTS),
+# bodies by their terms among the caller's own bodies; hits ranked by their combined score
+PROMPT_HIGHLIGHT_FIELDS = ("name", "description.general_function", "description.specialization", "description.output", "master_prompt")
+PROMPT_SEARCH_PAGE_SIZE = 20
+PROMPT_SEARCH_MAX_PAGE_SIZE = 50
+PROMPT_SEARCH_MAX_TERMS = 10
+PROMPT_SEARCH_SNIPPET_CHARS = 120
+PROMPT_SEARCH_MAX_CANDIDATES = int(os.environ.get('PROMPT_SEARCH_MAX_CANDIDATES', '500'))  # Best text hits ranked per query
+
 # Create the main app without a prefix
 app = FastAPI()
 
@@ -119,6 +245,7 @@ class User(BaseModel):
     omega_tokens_balance: int = INITIAL_TOKENS  # Initial balance for new users
     locked_price_99: Optional[float] = None  # Locked price for 99 CZK package
     locked_price_399: Optional[float] = None  # Locked price for 399 CZK package
+    sequence_id: Optional[int] = None  # Registration order shown in admin (admin is 1)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     last_login: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))  # Kept for backward compat
     last_login_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))  # New field for admin analytics
@@ -142,6 +269,7 @@ class TokenTransaction(BaseModel):
     transaction_type: Literal["initial", "purchase", "usage", "admin_grant"]
     description: str
     openai_tokens_used: Optional[int] = None  # For usage transactions
+    cached: bool = False  # Usage served from the response cache (no OpenAI call)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 # Auth Request/Response Models
@@ -197,6 +325,7 @@ class GeneratedPrompt(BaseModel):
     name: str  # Auto-generated by GPT-4.1, user can edit
     description: AgentCharacteristics  # Auto-generated by GPT-4.1
     master_prompt: str  # The final generated prompt
+    master_prompt_size: int = 0  # Characters in master_prompt, shown in the history list
     conversation_summary: Optional[str] = None  # Brief summary of conversation
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -215,6 +344,30 @@ class GeneratedPromptResponse(BaseModel):
     conversation_summary: Optional[str] = None
     created_at: datetime
 
+class GeneratedPromptSummary(BaseModel):
+    id: str
+    name: str
+    description: AgentCharacteristics
+    master_prompt_size: int
+    created_at: datetime
+
+class GeneratedPromptPage(BaseModel):
+    items: List[GeneratedPromptSummary]
+    next_cursor: Optional[str] = None
+
+class PromptSearchHighlight(BaseModel):
+    field: str  # e.g. "name", "description.output", "master_prompt"
+    snippet: str
+    matches: List[List[int]]  # [start, end) character ranges within snippet
+
+class PromptSearchHit(GeneratedPromptSummary):
+    score: float
+    highlights: List[PromptSearchHighlight]
+
+class PromptSearchPage(BaseModel):
+    items: List[PromptSearchHit]
+    next_cursor: Optional[str] = None
+
 # Platform Settings Model
 class PlatformSettings(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -223,6 +376,7 @@ class PlatformSettings(BaseModel):
     use_emergent_key: bool = True  # Use Emergent LLM key vs custom OpenAI key
     custom_openai_api_key: Optional[str] = None
     selected_model: str = "gpt-4.1"  # Default model
+    stage_models: Dict[str, str] = Field(default_factory=dict)  # Per-stage override, e.g. {"clarify": "gpt-4.1-mini"}
     price_99: float = 99.0  # Price for 10K tokens package
     price_399: float = 399.0  # Price for 35K tokens package
     default_master_prompt: Optional[str] = None  # Platform-wide default
@@ -246,12 +400,16 @@ class PlatformSettings(BaseModel):
     # SMSmanager.cz credentials
     smsmanager_api_key: Optional[str] = None
     smsmanager_gateway: Optional[str] = None  # Gateway number/name
+    # Admin dashboard
+    overview_refresh_seconds: int = 60  # How often the cached admin overview is recomputed
+    version: int = 0  # Bumped on every update, polled by workers to refresh their snapshot
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class PlatformSettingsUpdate(BaseModel):
     use_emergent_key: Optional[bool] = None
     custom_openai_api_key: Optional[str] = None
     selected_model: Optional[str] = None
+    stage_models: Optional[Dict[str, str]] = None
     price_99: Optional[float] = None
     price_399: Optional[float] = None
     default_master_prompt: Optional[str] = None
@@ -273,6 +431,8 @@ class PlatformSettingsUpdate(BaseModel):
     aws_region: Optional[str] = None
     smsmanager_api_key: Optional[str] = None
     smsmanager_gateway: Optional[str] = None
+    # Admin dashboard
+    overview_refresh_seconds: Optional[int] = None
 
 # Admin Models
 class AdminOverviewResponse(BaseModel):
@@ -284,6 +444,7 @@ class AdminOverviewResponse(BaseModel):
     min_consumption: Optional[dict] = None  # {tokens, user_name, agent_name}
     max_consumption: Optional[dict] = None  # {tokens, user_name, agent_name}
     token_history: List[dict]  # [{day, tokens}]
+    generated_at: Optional[datetime] = None  # When this snapshot was computed
 
 class AdminUserListItem(BaseModel):
     id: str
@@ -337,6 +498,658 @@ class GDPRExportResponse(BaseModel):
     gdpr_notice: str
 
 
+# User Cache
+class UserCache:
+    """Bounded LRU/TTL cache of user documents keyed by user id"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._version = 0  # Bumped on every invalidation
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get(self, user_id: str) -> Optional[dict]:
+        user = self._cache.get(user_id)
+        if user is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(user)  # Callers get a copy, the cached document stays untouched
+
+    def set(self, user: dict, version: Optional[int] = None):
+        """Store a user document. Skipped if an invalidation happened since `version` was read."""
+        if version is not None and version != self._version:
+            return
+        self._cache[user["id"]] = dict(user)
+
+    def invalidate(self, user_id: str):
+        self._version += 1
+        self._cache.pop(user_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "max_size": self._cache.maxsize,
+            "ttl_seconds": self._cache.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+user_cache = UserCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL_SECONDS)
+
+# Active User Sketches
+class HyperLogLog:
+    """Cardinality sketch: 2^precision one-byte registers, mergeable by element-wise max"""
+
+    def __init__(self, precision: int = ACTIVE_USERS_HLL_PRECISION, registers: Optional[bytes] = None):
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            self.registers = np.zeros(self.m, dtype=np.uint8)
+        else:
+            self.registers = np.frombuffer(registers, dtype=np.uint8).copy()
+
+    def add(self, value: str):
+        h = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = h >> (64 - self.precision)
+        rest_bits = 64 - self.precision
+        rank = rest_bits - (h & ((1 << rest_bits) - 1)).bit_length() + 1  # Position of the first 1-bit
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * np.log(self.m / zeros)  # Linear counting for small cardinalities
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return self.registers.tobytes()
+
+class ActiveUserSketches:
+    """
+    Distinct active users per UTC day. Tracking only touches an in-process
+    sketch; flush() merges it into the day's document (compare-and-swap on
+    `version`). Window counts merge the stored days with unflushed local
+    state, so cost depends on the window length, not on the user count.
+    """
+
+    def __init__(self, precision: int = ACTIVE_USERS_HLL_PRECISION):
+        self.precision = precision
+        self._pending: Dict[str, HyperLogLog] = {}
+        self.flushes = 0
+
+    @staticmethod
+    def day_key(moment: Optional[datetime] = None) -> str:
+        return (moment or datetime.now(timezone.utc)).astimezone(timezone.utc).date().isoformat()
+
+    def track(self, user_id: str, moment: Optional[datetime] = None):
+        day = self.day_key(moment)
+        sketch = self._pending.get(day)
+        if sketch is None:
+            sketch = self._pending[day] = HyperLogLog(self.precision)
+        sketch.add(user_id)
+
+    async def _merge_day(self, day: str, sketch: HyperLogLog):
+        for _ in range(5):
+            doc = await db.active_user_sketches.find_one({"day": day}, {"_id": 0, "registers": 1, "version": 1})
+            if doc is None:
+                try:
+                    await db.active_user_sketches.insert_one({
+                        "day": day,
+                        "precision": self.precision,
+                        "registers": sketch.to_bytes(),
+                        "version": 1
+                    })
+                    return
+                except DuplicateKeyError:
+                    continue  # Another worker created it first - merge into theirs
+            
+            stored = HyperLogLog(self.precision, doc["registers"])
+            merged = HyperLogLog(self.precision, doc["registers"])
+            merged.merge(sketch)
+            if np.array_equal(merged.registers, stored.registers):
+                return  # Nothing new for this day
+            result = await db.active_user_sketches.update_one(
+                {"day": day, "version": doc["version"]},
+                {"$set": {"registers": merged.to_bytes()}, "$inc": {"version": 1}}
+            )
+            if result.modified_count:
+                return
+        raise RuntimeError(f"Could not merge active-user sketch for {day} (concurrent updates)")
+
+    async def flush(self):
+        """Merge local sketches into Mongo; a day that fails (or is cancelled) stays pending"""
+        flushed = False
+        for day in list(self._pending):
+            sketch = self._pending.pop(day)
+            try:
+                await self._merge_day(day, sketch)
+                flushed = True
+            except BaseException:
+                if day in self._pending:
+                    sketch.merge(self._pending[day])
+                self._pending[day] = sketch
+                raise
+        if flushed:
+            self.flushes += 1
+
+    async def count(self, start_day: str, end_day: str) -> int:
+        """Estimated distinct users active between two UTC days (inclusive)"""
+        union = HyperLogLog(self.precision)
+        async for doc in db.active_user_sketches.find(
+            {"day": {"$gte": start_day, "$lte": end_day}},
+            {"_id": 0, "registers": 1}
+        ):
+            union.merge(HyperLogLog(self.precision, doc["registers"]))
+        for day, sketch in self._pending.items():
+            if start_day <= day <= end_day:
+                union.merge(sketch)
+        return union.count()
+
+    async def count_last_days(self, days: int) -> int:
+        """Estimated distinct users active in the last `days` UTC days, today included"""
+        today = datetime.now(timezone.utc).date()
+        return await self.count((today - timedelta(days=days - 1)).isoformat(), today.isoformat())
+
+    async def backfill_from_logins(self, days: int = 30):
+        """Seed empty sketches from users' last login (a lower bound for days before tracking started)"""
+        if await db.active_user_sketches.find_one({}, {"_id": 1}):
+            return
+        since = datetime.now(timezone.utc) - timedelta(days=days)
+        async for user in db.users.find(
+            datetime_filter("last_login_at", "$gte", since),
+            {"_id": 0, "id": 1, "last_login_at": 1}
+        ):
+            self.track(user["id"], as_datetime(user["last_login_at"]))
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "precision": self.precision,
+            "sketch_bytes": 1 << self.precision,
+            "pending_days": len(self._pending),
+            "flushes": self.flushes
+        }
+
+active_users = ActiveUserSketches()
+
+# Audit Log Writer
+class AuditLogWriter:
+    """
+    Buffers audit entries in a bounded queue and writes them in batches of up to
+    batch_size, at most flush_interval after the first buffered entry. When the
+    queue is full, "block" makes the caller wait up to enqueue_timeout for room
+    (backpressure) before dropping the entry; "drop" drops it right away.
+    audit_logs is a time-series collection, which does not enforce unique _ids,
+    so a batch that was sent before (and may be partly written) is filtered
+    against the collection before it is sent again.
+    """
+
+    def __init__(self, max_size: int, batch_size: int, flush_interval: float, overflow_policy: str, enqueue_timeout: float):
+        if overflow_policy not in ("block", "drop"):
+            raise ValueError(f"Unknown audit overflow policy: {overflow_policy}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.enqueue_timeout = enqueue_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._batch: List[tuple] = []  # (enqueued_at, document) taken off the queue, not yet written
+        self._running = False
+        self.max_depth = 0
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.total_blocked = 0.0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.total_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_entry_delay = 0.0
+        self.max_entry_delay = 0.0
+
+    async def write(self, doc: dict):
+        """Queue an entry; written directly when the background writer is not running (scripts, tests)"""
+        if not self._running:
+            await db.audit_logs.insert_one(doc)
+            return
+        item = (time.monotonic(), doc)
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.overflow_policy == "drop":
+                self._drop(1, "queue full")
+                return
+            self.blocked += 1
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(self._queue.put(item), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self._drop(1, "queue full")
+                return
+            finally:
+                self.total_blocked += time.monotonic() - started
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def _drop(self, count: int, reason: str):
+        self.dropped += count
+        logger.warning(f"Dropped {count} audit log entries ({reason})")
+
+    async def run(self):
+        """Background writer; cancel it and call close() to write what is still buffered"""
+        self._running = True
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch.append(await self._queue.get())
+            deadline = loop.time() + self.flush_interval
+            while len(self._batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush()
+
+    async def _flush(self):
+        batch = self._batch
+        for attempt in range(1, AUDIT_WRITE_ATTEMPTS + 1):
+            started = time.monotonic()
+            try:
+                # insert_many gives documents their _id when it sends them
+                if any("_id" in doc for _, doc in batch):
+                    unwritten = {id(doc) for doc in await unwritten_audit_entries([doc for _, doc in batch])}
+                    batch = [item for item in batch if id(item[1]) in unwritten]
+                if batch:
+                    await db.audit_logs.insert_many([doc for _, doc in batch], ordered=False)
+                failed = 0
+            except BulkWriteError as e:
+                failed = len(e.details.get("writeErrors", []))
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"Failed to write {len(batch)} audit log entries (attempt {attempt}): {str(e)}")
+                if attempt == AUDIT_WRITE_ATTEMPTS:
+                    self._drop(len(batch), "write failed")
+                    break
+                await asyncio.sleep(0.5 * attempt)
+                continue
+            
+            finished = time.monotonic()
+            latency = finished - started
+            self.flushes += 1
+            self.total_flush_latency += latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.written += len(batch) - failed
+            for enqueued_at, _ in batch:
+                self.total_entry_delay += finished - enqueued_at
+                self.max_entry_delay = max(self.max_entry_delay, finished - enqueued_at)
+            if failed:
+                self._drop(failed, "rejected by Mongo")
+            break
+        self._batch = []
+
+    async def close(self):
+        """Stop queueing and write everything still buffered (called on shutdown after run() is cancelled)"""
+        self._running = False
+        while not self._queue.empty():
+            self._batch.append(self._queue.get_nowait())
+        while self._batch:
+            remaining = self._batch[self.batch_size:]
+            self._batch = self._batch[:self.batch_size]
+            await self._flush()
+            self._batch = remaining
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "queue_max_size": self._queue.maxsize,
+            "overflow_policy": self.overflow_policy,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "total_blocked_ms": round(self.total_blocked * 1000, 1),
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "avg_batch_size": round(self.written / self.flushes, 1) if self.flushes else 0.0,
+            "avg_flush_ms": round(self.total_flush_latency / self.flushes * 1000, 1) if self.flushes else None,
+            "max_flush_ms": round(self.max_flush_latency * 1000, 1),
+            "avg_entry_delay_ms": round(self.total_entry_delay / self.written * 1000, 1) if self.written else None,
+            "max_entry_delay_ms": round(self.max_entry_delay * 1000, 1)
+        }
+
+audit_writer = AuditLogWriter(
+    AUDIT_QUEUE_MAX_SIZE, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL_SECONDS,
+    AUDIT_OVERFLOW_POLICY, AUDIT_ENQUEUE_TIMEOUT_SECONDS
+)
+
+# Response Cache
+class ResponseCache:
+    """
+    Two-tier cache of parsed clarify/optimize replies: an in-process LRU/TTL
+    cache in front of the `llm_response_cache` collection (TTL-indexed on
+    created_at, which is stored as a native date for that reason).
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(stage: str, user_input: str, conversation_context: str, system_message: str, model: str) -> str:
+        """Hash of everything that determines the reply; input and context are whitespace/case normalized"""
+        def normalize(text: str) -> str:
+            return " ".join(text.lower().split())
+        
+        payload = json.dumps(
+            [stage, normalize(user_input), normalize(conversation_context), system_message, model],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            self.memory_hits += 1
+            return entry
+        
+        entry = await db.llm_response_cache.find_one({"_id": key}, {"_id": 0, "items": 1, "tokens_used": 1})
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        self.db_hits += 1
+        self._memory[key] = entry
+        return entry
+
+    async def set(self, key: str, stage: str, items: list, tokens_used: int, extra: Optional[dict] = None):
+        entry = {"items": items, "tokens_used": tokens_used}
+        self._memory[key] = entry
+        try:
+            await db.llm_response_cache.update_one(
+                {"_id": key},
+                {"$set": {**entry, **(extra or {}), "stage": stage, "created_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to store cached response: {str(e)}", exc_info=True)
+
+    async def purge(self) -> int:
+        self._memory.clear()
+        result = await db.llm_response_cache.delete_many({})
+        return result.deleted_count
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.db_hits
+        lookups = hits + self.misses
+        return {
+            "memory_size": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_SIZE, RESPONSE_CACHE_MEMORY_TTL_SECONDS)
+
+# Near-Duplicate Clarify Index
+MINHASH_PRIME = (1 << 31) - 1  # Keeps a * x + b within uint64
+
+class MinHashLSHIndex:
+    """
+    In-memory MinHash/LSH index over word 3-gram shingles.
+    Signatures are split into bands; entries sharing any band bucket with the
+    query are candidates, and the best candidate is accepted if its estimated
+    Jaccard similarity (share of equal signature slots) reaches the threshold.
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 16, threshold: float = 0.8, seed: int = 42):
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self._buckets: List[dict] = [{} for _ in range(bands)]
+        self._signatures = np.empty((1024, num_perm), dtype=np.uint32)
+        self._values: list = []
+        self._positions: Dict[str, int] = {}  # key -> row in _signatures / _values
+        self._free: List[int] = []  # Rows of removed entries, reused by add
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._positions
+
+    def signature(self, text: str) -> np.ndarray:
+        words = re.findall(r'\w+', text.lower())
+        shingles = {" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles)
+        ) % MINHASH_PRIME
+        return ((np.outer(hashes, self._a) + self._b) % MINHASH_PRIME).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, key: str, text: str, value):
+        if key in self._positions:
+            return
+        signature = self.signature(text)
+        if self._free:
+            position = self._free.pop()
+            self._values[position] = value
+        else:
+            position = len(self._values)
+            if position == len(self._signatures):
+                self._signatures = np.concatenate([self._signatures, np.empty_like(self._signatures)])
+            self._values.append(value)
+        self._signatures[position] = signature
+        self._positions[key] = position
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band].setdefault(band_key, []).append(position)
+
+    def remove(self, key: str):
+        position = self._positions.pop(key, None)
+        if position is None:
+            return
+        for band, band_key in self._band_keys(self._signatures[position]):
+            bucket = self._buckets[band][band_key]
+            bucket.remove(position)
+            if not bucket:
+                del self._buckets[band][band_key]
+        self._values[position] = None
+        self._free.append(position)
+
+    def query(self, text: str) -> Optional[tuple]:
+        """Return (value, estimated_similarity) of the most similar entry above the threshold"""
+        if not self._positions:
+            return None
+        signature = self.signature(text)
+        candidates = set()
+        for band, band_key in self._band_keys(signature):
+            candidates.update(self._buckets[band].get(band_key, ()))
+        if not candidates:
+            return None
+        
+        positions = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarities = (self._signatures[positions] == signature).mean(axis=1)
+        best = int(similarities.argmax())
+        if similarities[best] < self.threshold:
+            return None
+        return self._values[positions[best]], float(similarities[best])
+
+class ClarifySimilarityIndex:
+    """
+    Near-duplicate lookup for clarify requests, one MinHash/LSH index per
+    scope (system message + model). Fed by this worker's own clarify results
+    and incrementally synced from clarify entries in `llm_response_cache`,
+    so every worker converges on the same corpus. Entries expire with the
+    cache's TTL (so no hit outlives the stored reply) and the oldest are
+    evicted once max_entries is reached.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, ttl: float):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._indexes: dict = {}
+        # key -> (scope, created_at), oldest first; synced entries can be up to one sync interval
+        # older than local ones added before them, which only delays their expiry by that much
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._synced_until: Optional[tuple] = None  # (created_at, _id) of the last synced entry
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.expired = 0
+
+    @staticmethod
+    def scope(system_message: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\n{system_message}".encode('utf-8')).hexdigest()[:16]
+
+    def size(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._indexes = {}
+        self._entries = OrderedDict()
+        self._synced_until = None
+
+    def _remove_oldest(self):
+        key, (scope, _) = self._entries.popitem(last=False)
+        index = self._indexes[scope]
+        index.remove(key)
+        if not len(index):
+            del self._indexes[scope]
+
+    def add(self, scope: str, key: str, text: str, items: list, tokens_used: int, created_at: Optional[datetime] = None):
+        if key in self._entries:
+            return
+        while len(self._entries) >= self.max_entries:
+            self._remove_oldest()
+            self.evicted += 1
+        index = self._indexes.get(scope)
+        if index is None:
+            index = self._indexes[scope] = MinHashLSHIndex(threshold=self.threshold)
+        index.add(key, text, {"items": items, "tokens_used": tokens_used})
+        self._entries[key] = (scope, created_at or datetime.now(timezone.utc))
+
+    def expire(self, now: Optional[datetime] = None):
+        """Drop entries whose reply the cache's TTL index has removed (or is about to)"""
+        cutoff = (now or datetime.now(timezone.utc)) - timedelta(seconds=self.ttl)
+        while self._entries and as_datetime(next(iter(self._entries.values()))[1]) < cutoff:
+            self._remove_oldest()
+            self.expired += 1
+
+    def query(self, scope: str, text: str) -> Optional[dict]:
+        index = self._indexes.get(scope)
+        match = index.query(text) if index is not None else None
+        if match is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        value, similarity = match
+        return {**value, "similarity": round(similarity, 3)}
+
+    async def sync(self):
+        """Add clarify entries stored (by any worker) since the last sync, then expire old ones"""
+        query = {"stage": "clarify", "scope": {"$exists": True}}
+        if self._synced_until:
+            # (created_at, _id) cursor - entries sharing the last timestamp are not skipped
+            created_at, last_id = self._synced_until
+            query["$or"] = [{"created_at": {"$gt": created_at}}, {"created_at": created_at, "_id": {"$gt": last_id}}]
+        else:
+            query["created_at"] = {"$gte": datetime.now(timezone.utc) - timedelta(seconds=self.ttl)}
+        
+        async for doc in db.llm_response_cache.find(
+            query,
+            {"items": 1, "tokens_used": 1, "scope": 1, "source_text": 1, "created_at": 1}
+        ).sort([("created_at", 1), ("_id", 1)]):
+            self.add(doc["scope"], doc["_id"], doc["source_text"], doc["items"], doc["tokens_used"], doc["created_at"])
+            self._synced_until = (doc["created_at"], doc["_id"])
+        self.expire()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self.size(),
+            "max_entries": self.max_entries,
+            "scopes": len(self._indexes),
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+clarify_index = ClarifySimilarityIndex(CLARIFY_SIMILARITY_THRESHOLD, CLARIFY_INDEX_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+
+# Datetime Helpers
+def as_datetime(value) -> Optional[datetime]:
+    """Normalize a stored timestamp (BSON date or legacy ISO string) to an aware UTC datetime"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def datetime_filter(field: str, op: str, moment: datetime) -> dict:
+    """
+    Range condition on a timestamp field that matches BSON dates and, until the
+    datetime migration has finished, legacy ISO strings (compared lexicographically).
+    """
+    return {"$or": [
+        {field: {op: moment}},
+        {field: {op: moment.astimezone(timezone.utc).isoformat()}}
+    ]}
+
+# Background Tasks
+# Strong references keep fire-and-forget tasks alive. Short writes (background_tasks) are awaited on
+# shutdown for up to SHUTDOWN_DRAIN_TIMEOUT_SECONDS; long jobs (job_tasks) are cancelled instead -
+# migrations, backfills, exports and retention runs resume from their checkpoints or get swept.
+SHUTDOWN_DRAIN_TIMEOUT_SECONDS = float(os.environ.get('SHUTDOWN_DRAIN_TIMEOUT_SECONDS', '10'))
+background_tasks: set = set()
+job_tasks: set = set()
+
+def spawn_background(coro) -> asyncio.Task:
+    """Run a short write off the request's critical path"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def spawn_job(coro) -> asyncio.Task:
+    """Run a long background job; shutdown cancels it rather than waiting for it"""
+    task = asyncio.create_task(coro)
+    job_tasks.add(task)
+    task.add_done_callback(job_tasks.discard)
+    return task
+
+
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
 async def root():
@@ -381,11 +1194,25 @@ async def get_current_user(request: Request) -> Optional[dict]:
     if not payload:
         return None
     
-    # Get user from database
-    user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
+    user = await get_user_by_id(payload["user_id"])
+    if not user or user.get("deletion_requested_at"):
+        return None  # Accounts pending GDPR deletion can no longer be used
+    active_users.track(user["id"])
+    return user
+
+async def get_user_by_id(user_id: str) -> Optional[dict]:
+    """Get user document, served from the in-process cache when possible"""
+    user = user_cache.get(user_id)
+    if user:
+        return user
+    
+    # Cache miss - load from database
+    version = user_cache.version
+    user = await db.users.find_one({"id": user_id}, {"_id": 0})
     if not user:
         return None
     
+    user_cache.set(user, version)
     return user
 
 async def require_auth(request: Request) -> dict:
@@ -395,46 +1222,459 @@ async def require_auth(request: Request) -> dict:
         raise HTTPException(status_code=401, detail="Not authenticated")
     return user
 
-async def require_tokens(user: dict, required_tokens: int) -> bool:
-    """Check if user has enough tokens (including debt limit)"""
-    if user.get("is_admin"):
-        return True  # Admin has unlimited tokens
-    
-    current_balance = user.get("omega_tokens_balance", 0)
-    if current_balance - required_tokens < TOKEN_LIMIT_MIN:
-        raise HTTPException(
-            status_code=402, 
-            detail=f"Insufficient Omega tokens. Current balance: {current_balance}, Required: {required_tokens}, Minimum allowed: {TOKEN_LIMIT_MIN}"
-        )
-    return True
-
-async def deduct_tokens(user_id: str, tokens_used: int, description: str, openai_tokens: Optional[int] = None):
-    """Deduct tokens from user balance and create transaction record"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+async def deduct_tokens(
+    user_id: str,
+    tokens_used: int,
+    description: str,
+    openai_tokens: Optional[int] = None,
+    min_balance: Optional[int] = None,
+    cached: bool = False
+) -> Optional[int]:
+    """
+    Deduct tokens from user balance and create transaction record.
+    The balance change is a single atomic $inc (safe for parallel stages),
+    followed by the awaited ledger write; derived aggregates update in the background.
+    With min_balance, the $inc only applies if the balance stays >= min_balance
+    (402 otherwise), so concurrent charges cannot overdraw the account.
+    Returns the new balance, or None if the user does not exist.
+    """
+    query = {"id": user_id}
+    if min_balance is not None:
+        query["omega_tokens_balance"] = {"$gte": min_balance + tokens_used}
+    # The document before the $inc: the new balance follows from it, and it is returned even when
+    # the guard above no longer holds after the update
+    user = await db.users.find_one_and_update(
+        query,
+        {"$inc": {"omega_tokens_balance": -tokens_used}},
+        projection={"_id": 0, "omega_tokens_balance": 1},
+        return_document=ReturnDocument.BEFORE
+    )
     if not user:
-        return
+        if min_balance is not None:
+            raise HTTPException(
+                status_code=402,
+                detail=f"Insufficient Omega tokens. Required: {tokens_used}, Minimum allowed: {min_balance}"
+            )
+        return None
+    user_cache.invalidate(user_id)
     
     new_balance = user["omega_tokens_balance"] - tokens_used
-    
-    # Update user balance
-    await db.users.update_one(
-        {"id": user_id},
-        {"$set": {"omega_tokens_balance": new_balance}}
-    )
-    
-    # Create transaction record
+    await record_usage_transaction(user_id, tokens_used, new_balance, description, openai_tokens, cached)
+    return new_balance
+
+async def record_usage_transaction(user_id: str, tokens_used: int, new_balance: int, description: str, openai_tokens: Optional[int] = None, cached: bool = False):
+    """Write the usage transaction record; rollups and user stats follow in the background"""
     transaction = TokenTransaction(
         user_id=user_id,
         amount=-tokens_used,
         balance_after=new_balance,
         transaction_type="usage",
         description=description,
-        openai_tokens_used=openai_tokens
+        openai_tokens_used=openai_tokens,
+        cached=cached
     )
     
     doc = transaction.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.token_transactions.insert_one(doc)
+    await insert_token_transaction(doc)
+    spawn_background(update_token_rollups(transaction.created_at, tokens_used, openai_tokens, user_id, description))
+    spawn_background(update_user_stats(
+        user_id,
+        {"total_tokens_consumed": tokens_used},
+        {"max_openai_tokens": openai_tokens} if openai_tokens else None
+    ))
+
+async def reserve_tokens(user: dict, amount: int) -> dict:
+    """
+    Atomically move `amount` tokens from the user's balance into an escrow hold.
+    Raises 402 if the hold would push the balance below TOKEN_LIMIT_MIN.
+    The hold must be settled (settle_tokens) or released (release_tokens); holds
+    that are neither are reclaimed after TOKEN_HOLD_TTL_SECONDS.
+    """
+    now = datetime.now(timezone.utc)
+    hold = {
+        "id": str(uuid.uuid4()),
+        "amount": amount,
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=TOKEN_HOLD_TTL_SECONDS)
+    }
+    
+    query = {"id": user["id"]}
+    if not user.get("is_admin"):  # Admin has unlimited tokens
+        query["omega_tokens_balance"] = {"$gte": TOKEN_LIMIT_MIN + amount}
+    
+    updated = await db.users.find_one_and_update(
+        query,
+        {
+            "$inc": {"omega_tokens_balance": -amount},
+            "$push": {"token_holds": hold}
+        },
+        projection={"_id": 0, "omega_tokens_balance": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    user_cache.invalidate(user["id"])
+    if not updated:
+        raise HTTPException(
+            status_code=402,
+            detail=f"Insufficient Omega tokens. Current balance: {user.get('omega_tokens_balance', 0)}, Required: {amount}, Minimum allowed: {TOKEN_LIMIT_MIN}"
+        )
+    return hold
+
+async def settle_tokens(user_id: str, hold: dict, tokens_used: int, description: str, openai_tokens: Optional[int] = None) -> Optional[int]:
+    """Settle an escrow hold to the actual usage (refunds or charges the difference) and record the transaction"""
+    user = await db.users.find_one_and_update(
+        {"id": user_id, "token_holds.id": hold["id"]},
+        {
+            "$inc": {"omega_tokens_balance": hold["amount"] - tokens_used},
+            "$pull": {"token_holds": {"id": hold["id"]}}
+        },
+        projection={"_id": 0, "omega_tokens_balance": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    hold["settled"] = True
+    if not user:
+        # Hold already reclaimed by the sweeper - charge the usage directly
+        return await deduct_tokens(user_id, tokens_used, description, openai_tokens)
+    user_cache.invalidate(user_id)
+    
+    new_balance = user["omega_tokens_balance"] + hold["amount"] - tokens_used
+    await record_usage_transaction(user_id, tokens_used, new_balance, description, openai_tokens)
+    return new_balance
+
+async def release_tokens(user_id: str, hold: dict) -> bool:
+    """Return an unsettled escrow hold to the user's balance. Returns False if it was already gone."""
+    result = await db.users.update_one(
+        {"id": user_id, "token_holds.id": hold["id"]},
+        {
+            "$inc": {"omega_tokens_balance": hold["amount"]},
+            "$pull": {"token_holds": {"id": hold["id"]}}
+        }
+    )
+    hold["settled"] = True
+    user_cache.invalidate(user_id)
+    return result.modified_count > 0
+
+async def reclaim_expired_token_holds():
+    """Release escrow holds whose request never settled them (crashed worker, lost task)"""
+    now = datetime.now(timezone.utc)
+    reclaimed = 0
+    
+    async for user in db.users.find(
+        datetime_filter("token_holds.expires_at", "$lt", now),
+        {"_id": 0, "id": 1, "token_holds": 1}
+    ):
+        for hold in user.get("token_holds", []):
+            if as_datetime(hold["expires_at"]) < now and await release_tokens(user["id"], hold):
+                reclaimed += 1
+    
+    if reclaimed:
+        logger.info(f"Reclaimed {reclaimed} expired token holds")
+
+async def insert_token_transaction(doc: dict):
+    """
+    Write a token transaction record right after its balance change, retrying transient failures.
+    Retries are idempotent (the same _id, and a unique index on id). A record that still cannot be written is logged
+    in full so it can be replayed; the balance change itself is not rolled back.
+    """
+    for attempt in range(1, TOKEN_LEDGER_WRITE_ATTEMPTS + 1):
+        try:
+            await db.token_transactions.insert_one(doc)
+            return
+        except DuplicateKeyError:
+            return  # Written by an earlier attempt whose reply was lost
+        except Exception as e:
+            if attempt == TOKEN_LEDGER_WRITE_ATTEMPTS:
+                logger.error(
+                    f"Failed to record token transaction for user={doc.get('user_id')}: {str(e)}; "
+                    f"unrecorded transaction: {json_util.dumps(doc)}",
+                    exc_info=True
+                )
+                return
+            await asyncio.sleep(0.2 * attempt)
+
+# User Usage Stats
+# Materialized per-user aggregates of the ledgers, kept current with $inc/$max next to every raw write
+USER_STATS_FIELDS = ("agents_count", "total_tokens_consumed", "max_openai_tokens", "tokens_granted")
+
+async def update_user_stats(user_id: str, inc: dict, max_values: Optional[dict] = None):
+    """Apply increments (and running maxima) to a user's stats document, creating it if missing"""
+    update = {
+        "$inc": inc,
+        "$set": {"updated_at": datetime.now(timezone.utc)}
+    }
+    if max_values:
+        update["$max"] = max_values
+    # Every row carries the admin listing's sort fields, so sorting on them never skips a user
+    defaults = {field: 0 for field in ADMIN_USER_STATS_SORT_FIELDS if field not in inc}
+    if defaults:
+        update["$setOnInsert"] = defaults
+    try:
+        await db.user_stats.update_one({"user_id": user_id}, update, upsert=True)
+    except Exception as e:
+        logger.error(f"Failed to update user stats for user={user_id}: {str(e)}", exc_info=True)
+
+async def create_user_stats(user_id: str):
+    """Give a new user the zero stats row the admin listing pages through"""
+    await db.user_stats.update_one(
+        {"user_id": user_id},
+        {"$setOnInsert": {
+            **{field: 0 for field in ADMIN_USER_STATS_SORT_FIELDS},
+            "updated_at": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+
+async def ensure_user_stats_rows() -> int:
+    """Create the zero stats row of every user without one, in _id batches; returns rows created"""
+    for field in ADMIN_USER_STATS_SORT_FIELDS:
+        await db.user_stats.update_many({field: {"$exists": False}}, {"$set": {field: 0}})
+    
+    created, last_id = 0, None
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await db.users.find(query, {"id": 1}).sort("_id", 1).limit(1000).to_list(None)
+        if not batch:
+            break
+        now = datetime.now(timezone.utc)
+        result = await db.user_stats.bulk_write([
+            UpdateOne(
+                {"user_id": user["id"]},
+                {"$setOnInsert": {**{field: 0 for field in ADMIN_USER_STATS_SORT_FIELDS}, "updated_at": now}},
+                upsert=True
+            )
+            for user in batch
+        ], ordered=False)
+        created += result.upserted_count
+        last_id = batch[-1]["_id"]
+    return created
+
+async def get_user_stats(user_id: str) -> dict:
+    """Read a user's usage aggregates (zeros if the user has no activity yet)"""
+    stats = await db.user_stats.find_one({"user_id": user_id}, {"_id": 0}) or {}
+    return {
+        "agents_count": stats.get("agents_count", 0),
+        "total_tokens_consumed": stats.get("total_tokens_consumed", 0),
+        "max_openai_tokens": stats.get("max_openai_tokens"),
+        "tokens_granted": stats.get("tokens_granted", 0)
+    }
+
+async def recount_agents(user_ids: List[str]):
+    """Set agents_count of these users to the number of prompts they still own"""
+    counts = {
+        row["_id"]: row["agents_count"]
+        async for row in db.generated_prompts.aggregate([
+            {"$match": {"user_id": {"$in": user_ids}}},
+            {"$group": {"_id": "$user_id", "agents_count": {"$sum": 1}}}
+        ])
+    }
+    now = datetime.now(timezone.utc)
+    await db.user_stats.bulk_write([
+        UpdateOne({"user_id": user_id}, {"$set": {"agents_count": counts.get(user_id, 0), "updated_at": now}})
+        for user_id in user_ids
+    ], ordered=False)
+
+async def rebuild_user_stats() -> dict:
+    """
+    Recompute user_stats from generated_prompts and token_transactions.
+    Increments that land while the rebuild runs can be overwritten, so run it when traffic is low.
+    Stats documents of users without any remaining rows are reset to zero (the admin listing
+    pages through one row per user).
+    """
+    started = datetime.now(timezone.utc)
+    stats: Dict[str, dict] = {}
+    
+    async for row in db.token_transactions.aggregate([
+        {"$match": {"transaction_type": {"$in": ["usage", "admin_grant"]}}},
+        {"$group": {
+            "_id": "$user_id",
+            "total_tokens_consumed": {"$sum": {
+                "$cond": [{"$eq": ["$transaction_type", "usage"]}, {"$abs": "$amount"}, 0]
+            }},
+            "max_openai_tokens": {"$max": {
+                "$cond": [{"$eq": ["$transaction_type", "usage"]}, "$openai_tokens_used", None]
+            }},
+            "tokens_granted": {"$sum": {
+                "$cond": [{"$eq": ["$transaction_type", "admin_grant"]}, "$amount", 0]
+            }}
+        }}
+    ]):
+        stats[row["_id"]] = {
+            "total_tokens_consumed": row["total_tokens_consumed"],
+            "max_openai_tokens": row["max_openai_tokens"],
+            "tokens_granted": row["tokens_granted"]
+        }
+    
+    async for row in db.generated_prompts.aggregate([
+        {"$group": {"_id": "$user_id", "agents_count": {"$sum": 1}}}
+    ]):
+        stats.setdefault(row["_id"], {})["agents_count"] = row["agents_count"]
+    
+    operations = [
+        UpdateOne(
+            {"user_id": user_id},
+            {"$set": {
+                "agents_count": values.get("agents_count", 0),
+                "total_tokens_consumed": values.get("total_tokens_consumed", 0),
+                "max_openai_tokens": values.get("max_openai_tokens"),
+                "tokens_granted": values.get("tokens_granted", 0),
+                "updated_at": started
+            }},
+            upsert=True
+        )
+        for user_id, values in stats.items()
+        if user_id
+    ]
+    for i in range(0, len(operations), 1000):
+        await db.user_stats.bulk_write(operations[i:i + 1000], ordered=False)
+    
+    # Anything not rewritten above and not touched since the rebuild started is stale
+    reset = await db.user_stats.update_many(
+        datetime_filter("updated_at", "$lt", started),
+        {"$set": {
+            "agents_count": 0,
+            "total_tokens_consumed": 0,
+            "max_openai_tokens": None,
+            "tokens_granted": 0,
+            "updated_at": started
+        }}
+    )
+    await ensure_user_stats_rows()
+    
+    logger.info(f"Rebuilt user stats: {len(operations)} users, {reset.modified_count} stale reset")
+    return {"users": len(operations), "stale_reset": reset.modified_count}
+
+async def backfill_user_stats():
+    """Build user_stats on first start after upgrade (collection empty but ledgers present)"""
+    if await db.user_stats.find_one({}, {"_id": 1}):
+        return
+    if await db.token_transactions.find_one({}, {"_id": 1}) or await db.generated_prompts.find_one({}, {"_id": 1}):
+        await rebuild_user_stats()
+
+# Token Usage Rollups
+# Pre-aggregated usage per UTC day and hour plus one all-time document, maintained at write time.
+# openai_* fields only count transactions that report OpenAI usage (as the overview always did).
+TOKEN_ROLLUP_PERIODS = {"day": 10, "hour": 13}  # Bucket = ISO timestamp prefix of this length
+
+def token_rollup_bucket(created_at: datetime, period: str) -> str:
+    """UTC bucket key, e.g. '2025-01-31' (day) or '2025-01-31T14' (hour)"""
+    return created_at.astimezone(timezone.utc).isoformat()[:TOKEN_ROLLUP_PERIODS[period]]
+
+async def update_token_rollups(created_at: datetime, tokens_used: int, openai_tokens: Optional[int], user_id: str, description: str):
+    """Fold one usage transaction into its day/hour buckets and the all-time rollup (single ordered bulk write)"""
+    inc = {"transactions": 1, "omega_tokens": tokens_used}
+    touched = {"$set": {"updated_at": datetime.now(timezone.utc)}}
+    extremes = {}
+    if openai_tokens:
+        inc.update({"metered_transactions": 1, "openai_tokens": openai_tokens})
+        extremes = {"$min": {"min_openai_tokens": openai_tokens}, "$max": {"max_openai_tokens": openai_tokens}}
+    
+    operations = [
+        UpdateOne(
+            {"period": period, "bucket": token_rollup_bucket(created_at, period)},
+            {"$inc": inc, **touched, **extremes},
+            upsert=True
+        )
+        for period in TOKEN_ROLLUP_PERIODS
+    ]
+    operations.append(UpdateOne({"period": "all", "bucket": "all"}, {"$inc": inc, **touched, **extremes}, upsert=True))
+    if openai_tokens:
+        usage = {"tokens": openai_tokens, "user_id": user_id, "description": description}
+        # The all-time rollup also remembers who made the cheapest/most expensive call
+        operations.append(UpdateOne(
+            {"period": "all", "bucket": "all", "$or": [{"min_usage": None}, {"min_usage.tokens": {"$gt": openai_tokens}}]},
+            {"$set": {"min_usage": usage}}
+        ))
+        operations.append(UpdateOne(
+            {"period": "all", "bucket": "all", "$or": [{"max_usage": None}, {"max_usage.tokens": {"$lt": openai_tokens}}]},
+            {"$set": {"max_usage": usage}}
+        ))
+    
+    try:
+        await db.token_rollups.bulk_write(operations, ordered=True)
+    except Exception as e:
+        logger.error(f"Failed to update token rollups for user={user_id}: {str(e)}", exc_info=True)
+
+async def rebuild_token_rollups() -> dict:
+    """
+    Recompute all token rollups from the usage transactions.
+    Like rebuild_user_stats, usage recorded while this runs can be overwritten.
+    """
+    started = datetime.now(timezone.utc)
+    metered = {"$gt": [{"$ifNull": ["$openai_tokens_used", 0]}, 0]}
+    hour_key = {"$cond": [
+        {"$eq": [{"$type": "$created_at"}, "string"]},
+        {"$substrBytes": ["$created_at", 0, TOKEN_ROLLUP_PERIODS["hour"]]},
+        {"$dateToString": {"format": "%Y-%m-%dT%H", "date": "$created_at"}}
+    ]}
+    
+    buckets: Dict[tuple, dict] = {}
+    
+    def fold(key: tuple, row: dict):
+        rollup = buckets.setdefault(key, {
+            "transactions": 0, "omega_tokens": 0, "metered_transactions": 0, "openai_tokens": 0,
+            "min_openai_tokens": None, "max_openai_tokens": None
+        })
+        for field in ("transactions", "omega_tokens", "metered_transactions", "openai_tokens"):
+            rollup[field] += row[field]
+        if row["min_openai_tokens"] is not None:
+            if rollup["min_openai_tokens"] is None or row["min_openai_tokens"] < rollup["min_openai_tokens"]:
+                rollup["min_openai_tokens"] = row["min_openai_tokens"]
+            if rollup["max_openai_tokens"] is None or row["max_openai_tokens"] > rollup["max_openai_tokens"]:
+                rollup["max_openai_tokens"] = row["max_openai_tokens"]
+    
+    async for row in db.token_transactions.aggregate([
+        {"$match": {"transaction_type": "usage"}},
+        {"$group": {
+            "_id": hour_key,
+            "transactions": {"$sum": 1},
+            "omega_tokens": {"$sum": {"$abs": "$amount"}},
+            "metered_transactions": {"$sum": {"$cond": [metered, 1, 0]}},
+            "openai_tokens": {"$sum": {"$cond": [metered, "$openai_tokens_used", 0]}},
+            "min_openai_tokens": {"$min": {"$cond": [metered, "$openai_tokens_used", None]}},
+            "max_openai_tokens": {"$max": {"$cond": [metered, "$openai_tokens_used", None]}}
+        }}
+    ]):
+        if not row["_id"]:
+            continue
+        fold(("hour", row["_id"]), row)
+        fold(("day", row["_id"][:TOKEN_ROLLUP_PERIODS["day"]]), row)
+        fold(("all", "all"), row)
+    
+    # Who made the cheapest / most expensive metered call
+    for field, direction in (("min_usage", 1), ("max_usage", -1)):
+        extreme = await db.token_transactions.find_one(
+            {"transaction_type": "usage", "openai_tokens_used": {"$gt": 0}},
+            {"_id": 0, "openai_tokens_used": 1, "user_id": 1, "description": 1},
+            sort=[("openai_tokens_used", direction)]
+        )
+        if extreme and ("all", "all") in buckets:
+            buckets[("all", "all")][field] = {
+                "tokens": extreme["openai_tokens_used"],
+                "user_id": extreme["user_id"],
+                "description": extreme.get("description")
+            }
+    
+    operations = [
+        UpdateOne(
+            {"period": period, "bucket": bucket},
+            {"$set": {**values, "updated_at": started}},
+            upsert=True
+        )
+        for (period, bucket), values in buckets.items()
+    ]
+    for i in range(0, len(operations), 1000):
+        await db.token_rollups.bulk_write(operations[i:i + 1000], ordered=False)
+    # Buckets not rewritten above and not touched since the rebuild started are stale
+    removed = await db.token_rollups.delete_many(datetime_filter("updated_at", "$lt", started))
+    
+    logger.info(f"Rebuilt token rollups: {len(operations)} buckets, {removed.deleted_count} stale removed")
+    return {"buckets": len(operations), "stale_removed": removed.deleted_count}
+
+async def backfill_token_rollups():
+    """Build token rollups on first start after upgrade (no rollups but usage transactions present)"""
+    if await db.token_rollups.find_one({}, {"_id": 1}):
+        return
+    if await db.token_transactions.find_one({"transaction_type": "usage"}, {"_id": 1}):
+        await rebuild_token_rollups()
 
 # Authentication Endpoints
 @api_router.post("/auth/admin/login", response_model=AuthResponse)
@@ -455,21 +1695,24 @@ async def admin_login(credentials: AdminLoginRequest, response: Response):
             name="Admin",
             is_admin=True,
             is_banned=False,
-            omega_tokens_balance=999999999  # Unlimited for admin
+            omega_tokens_balance=999999999,  # Unlimited for admin
+            sequence_id=1
         )
         doc = admin.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        doc['last_login'] = doc['last_login'].isoformat()
-        doc['last_login_at'] = doc['last_login_at'].isoformat()
+        doc["search_keys"] = user_search_keys(doc["name"], doc["email"])
         await db.users.insert_one(doc)
+        await create_user_stats(doc["id"])
         admin_user = admin.model_dump()
     else:
         # Update last login
-        now_iso = datetime.now(timezone.utc).isoformat()
+        now = datetime.now(timezone.utc)
         await db.users.update_one(
             {"email": "admin@omegacodex.local"},
-            {"$set": {"last_login": now_iso, "last_login_at": now_iso}}
+            {"$set": {"last_login": now, "last_login_at": now}}
         )
+        user_cache.invalidate(admin_user["id"])
+    
+    active_users.track(admin_user["id"])
     
     # Create JWT token
     token = create_jwt_token(admin_user["id"], admin_user["email"], True)
@@ -522,13 +1765,16 @@ async def process_google_session(session_data: SessionDataRequest, response: Res
             # Existing user - check ban status
             if existing_user.get("is_banned", False):
                 raise HTTPException(status_code=403, detail="Váš účet byl zablokován administrátorem")
+            if existing_user.get("deletion_requested_at"):
+                raise HTTPException(status_code=403, detail="Váš účet se právě maže")
             
             # Update last login
-            now_iso = datetime.now(timezone.utc).isoformat()
+            now = datetime.now(timezone.utc)
             await db.users.update_one(
                 {"email": user_data["email"]},
-                {"$set": {"last_login": now_iso, "last_login_at": now_iso}}
+                {"$set": {"last_login": now, "last_login_at": now}}
             )
+            user_cache.invalidate(existing_user["id"])
             user_doc = existing_user
         else:
             # NEW USER: Create shadow account immediately
@@ -559,17 +1805,14 @@ async def process_google_session(session_data: SessionDataRequest, response: Res
                 referral_code=referral_code,
                 referred_by=referred_by_user_id,  # Track referrer from start
                 referral_count=0,
-                omega_tokens_balance=INITIAL_TOKENS
+                omega_tokens_balance=INITIAL_TOKENS,
+                sequence_id=await next_user_sequence_id()
             )
             
             doc = new_user.model_dump()
-            doc['created_at'] = doc['created_at'].isoformat()
-            doc['last_login'] = doc['last_login'].isoformat()
-            doc['last_login_at'] = doc['last_login_at'].isoformat()
-            if doc.get('phone_verification_expires'):
-                doc['phone_verification_expires'] = doc['phone_verification_expires'].isoformat()
-            
+            doc["search_keys"] = user_search_keys(doc["name"], doc["email"])
             await db.users.insert_one(doc)
+            await create_user_stats(doc["id"])
             user_doc = new_user.model_dump()
             
             # Create initial token transaction (pending verification)
@@ -581,9 +1824,10 @@ async def process_google_session(session_data: SessionDataRequest, response: Res
                 description="Initial token grant (pending phone verification)"
             )
             trans_doc = transaction.model_dump()
-            trans_doc['created_at'] = trans_doc['created_at'].isoformat()
             await db.token_transactions.insert_one(trans_doc)
         
+        active_users.track(user_doc["id"])
+        
         # Create JWT token for shadow account too
         token = create_jwt_token(user_doc["id"], user_doc["email"], user_doc.get("is_admin", False))
         
@@ -612,6 +1856,8 @@ async def process_google_session(session_data: SessionDataRequest, response: Res
             "omega_tokens_balance": user_doc["omega_tokens_balance"]
         }
         
+    except HTTPException:
+        raise
     except httpx.HTTPError as e:
         logger.error(f"Error calling Emergent Auth API: {str(e)}")
         raise HTTPException(status_code=401, detail="Invalid session ID")
@@ -660,9 +1906,7 @@ async def create_status_check(input: StatusCheckCreate):
     status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
     
-    # Convert to dict and serialize datetime to ISO string for MongoDB
     doc = status_obj.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
     
     _ = await db.status_checks.insert_one(doc)
     return status_obj
@@ -672,115 +1916,591 @@ async def get_status_checks():
     # Exclude MongoDB's _id field from the query results
     status_checks = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
     
-    # Convert ISO string timestamps back to datetime objects
     for check in status_checks:
-        if isinstance(check['timestamp'], str):
-            check['timestamp'] = datetime.fromisoformat(check['timestamp'])
+        check['timestamp'] = as_datetime(check['timestamp'])
     
     return status_checks
 
-# Omega Agent Generator Endpoint
-@api_router.post("/generate", response_model=GenerateResponse)
-async def generate_omega_prompt(request: GenerateRequest, http_request: Request):
-    """
-    Generate Omega prompts through three stages:
-    1. clarify: Ask clarifying questions about business use case
-    2. optimize: Provide optimization suggestions and pattern recommendations
-    3. final: Assemble complete Omega prompt in markdown format
-    
-    Requires authentication. Deducts Omega tokens based on OpenAI API usage.
-    """
-    # Require authentication
+# Omega Agent Generator Helpers
+CLARIFY_SYSTEM_MESSAGE = """You are a business analyst helping to understand a use case for AI prompt engineering. 
+            
+Your task: Ask 3-6 clarifying questions to deeply understand:
+- The business context and goals
+- Target audience and use cases
+- Key constraints and requirements
+- Success metrics and expected outcomes
+- Technical environment and integration needs
+
+Return ONLY a JSON array of questions, no other text. Format: ["Question 1?", "Question 2?", "Question 3?"]"""
+
+OPTIMIZE_SYSTEM_MESSAGE = """You are an AI prompt engineering expert specializing in the Omega framework.
+
+Based on the business context and clarifying answers provided, analyze and suggest:
+1. 3-5 specific optimizations for prompt structure
+2. Recommended pattern (CustomerSupport, LeadQualification, ContentPlanning, or MarketResearch)
+3. Key considerations for implementation
+
+Return ONLY a JSON array of suggestion strings, no other text. Format: ["Suggestion 1", "Suggestion 2", "Pattern: CustomerSupport"]"""
+
+FINAL_SYSTEM_MESSAGE = """You are an Omega prompt architect. Assemble a complete, production-ready prompt using the Ω framework.
+
+Structure your response as a well-formatted markdown document with these sections:
+
+# Omega Prompt: [Use Case Title]
+
+## 1. Context & Purpose
+Define the core objective and business context.
+
+## 2. Role & Persona
+Specify the AI's role, expertise, and communication style.
+
+## 3. Constraints & Rules
+List what the AI must do, must not do, and guardrails.
+
+## 4. Output Format
+Describe the expected structure and format of responses.
+
+## 5. Evaluation Checklist
+Provide criteria to assess prompt effectiveness.
+
+## 6. Example Interaction
+Show a sample input-output pair.
+
+Make it comprehensive, actionable, and ready to use."""
+
+# Stage-specific configurations
+STAGE_TEMPERATURES = {
+    OmegaStage.clarify: 0.2,
+    OmegaStage.optimize: 0.3,
+    OmegaStage.final: 0.4
+}
+
+# LLM call timeout per stage (seconds)
+STAGE_TIMEOUTS = {
+    OmegaStage.clarify: 30.0,
+    OmegaStage.optimize: 30.0,
+    OmegaStage.final: 40.0
+}
+
+def validate_generate_request(request: GenerateRequest):
+    """Validate input limits shared by the /generate endpoints"""
+    if len(request.user_input) > 4000:
+        raise HTTPException(status_code=400, detail="Input too long (max 4000 characters)")
+    
+    if len(request.messages) > 20:
+        raise HTTPException(status_code=400, detail="Too many messages (max 20)")
+
+def build_conversation_context(request: GenerateRequest) -> str:
+    """Build conversation history from the last 10 messages"""
+    conversation = []
+    for msg in request.messages[-10:]:  # Last 10 messages for context
+        conversation.append(f"{msg.role}: {msg.content}")
+    
+    return "\n".join(conversation) if conversation else "No previous conversation"
+
+def build_stage_prompt(request: GenerateRequest, conversation_context: str) -> tuple:
+    """Return (system_message, user_text) for the requested stage"""
+    if request.stage == OmegaStage.clarify:
+        system_message = request.master_prompt or CLARIFY_SYSTEM_MESSAGE
+        user_text = f"Business Use Case: {request.user_input}\n\nConversation Context:\n{conversation_context}"
+    elif request.stage == OmegaStage.optimize:
+        system_message = request.master_prompt or OPTIMIZE_SYSTEM_MESSAGE
+        user_text = f"Business Use Case: {request.user_input}\n\nConversation Context:\n{conversation_context}\n\nProvide optimization suggestions and pattern recommendation."
+    elif request.stage == OmegaStage.final:
+        system_message = request.master_prompt or FINAL_SYSTEM_MESSAGE
+        pattern_context = f"\nRecommended Pattern: {request.pattern}" if request.pattern else ""
+        user_text = f"Business Use Case: {request.user_input}{pattern_context}\n\nConversation Context:\n{conversation_context}\n\nGenerate the complete Omega prompt in markdown format."
+    else:
+        raise HTTPException(status_code=400, detail=f"Invalid stage: {request.stage}")
+    
+    return system_message, user_text
+
+# Platform Settings Service
+class SettingsService:
+    """
+    Immutable in-process snapshot of the global PlatformSettings document.
+    Every update bumps the document's `version`; each worker polls just that
+    field (poll_version) and reloads the snapshot when it changed, so updates
+    reach all uvicorn workers within SETTINGS_VERSION_POLL_SECONDS. Reads
+    after the first load do no I/O.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[MappingProxyType] = None
+        self.version: Optional[int] = None
+        self.reloads = 0
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> MappingProxyType:
+        if self._snapshot is None:
+            await self.reload()
+        return self._snapshot
+
+    async def reload(self):
+        async with self._lock:
+            settings = await db.settings.find_one({"id": "global"}, {"_id": 0})
+            if not settings:
+                # Create default settings if not exists
+                settings = PlatformSettings().model_dump()
+                await db.settings.update_one({"id": "global"}, {"$setOnInsert": dict(settings)}, upsert=True)
+            self._install(settings)
+
+    def _install(self, settings: dict):
+        self._snapshot = MappingProxyType(settings)
+        self.version = settings.get("version", 0)
+        self.reloads += 1
+
+    async def poll_version(self):
+        """Reload the snapshot if another worker updated the settings"""
+        doc = await db.settings.find_one({"id": "global"}, {"_id": 0, "version": 1})
+        if self._snapshot is None or doc is None or doc.get("version", 0) != self.version:
+            await self.reload()
+
+    async def update(self, update_data: dict) -> MappingProxyType:
+        """Apply a partial update, bump the version and install the result locally"""
+        await self.get()  # Make sure the document exists with all defaults
+        settings = await db.settings.find_one_and_update(
+            {"id": "global"},
+            {"$set": update_data, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        self._install(settings)
+        return self._snapshot
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "reloads": self.reloads,
+            "poll_interval_seconds": SETTINGS_VERSION_POLL_SECONDS
+        }
+
+settings_service = SettingsService()
+
+# LLM Routing
+LLM_ROUTE_STAGES = ("clarify", "optimize", "final", "name", "description")
+
+class LlmRoute(BaseModel):
+    stage: str
+    provider: str = "openai"
+    model: str = "gpt-4.1"
+    api_key: str
+
+async def resolve_llm_route(stage: str) -> LlmRoute:
+    """Pick model and credentials for a stage from the cached platform settings"""
+    settings = await settings_service.get()
+    model = (settings.get("stage_models") or {}).get(stage) or settings.get("selected_model") or "gpt-4.1"
+    api_key = EMERGENT_LLM_KEY
+    if not settings.get("use_emergent_key", True) and settings.get("custom_openai_api_key"):
+        api_key = settings["custom_openai_api_key"]
+    return LlmRoute(stage=stage, model=model, api_key=api_key)
+
+class LlmMetrics:
+    """Per (stage, model) call counts, latency and estimated token usage of LLM calls"""
+
+    def __init__(self):
+        self._stats: dict = {}
+
+    def record(self, route: LlmRoute, latency: float, tokens: int = 0, first_chunk_latency: Optional[float] = None, error: bool = False):
+        stats = self._stats.setdefault((route.stage, route.model), {
+            "calls": 0, "errors": 0, "total_latency": 0.0, "max_latency": 0.0,
+            "total_tokens": 0, "streams": 0, "total_first_chunk_latency": 0.0
+        })
+        stats["calls"] += 1
+        stats["errors"] += int(error)
+        stats["total_latency"] += latency
+        stats["max_latency"] = max(stats["max_latency"], latency)
+        stats["total_tokens"] += tokens
+        if first_chunk_latency is not None:
+            stats["streams"] += 1
+            stats["total_first_chunk_latency"] += first_chunk_latency
+
+    def stats(self) -> List[dict]:
+        result = []
+        for (stage, model), stats in sorted(self._stats.items()):
+            calls = stats["calls"]
+            result.append({
+                "stage": stage,
+                "model": model,
+                "calls": calls,
+                "errors": stats["errors"],
+                "avg_latency_ms": round(stats["total_latency"] / calls * 1000, 1),
+                "max_latency_ms": round(stats["max_latency"] * 1000, 1),
+                "avg_tokens": round(stats["total_tokens"] / calls, 1),
+                "avg_first_chunk_ms": round(stats["total_first_chunk_latency"] / stats["streams"] * 1000, 1) if stats["streams"] else None
+            })
+        return result
+
+llm_metrics = LlmMetrics()
+
+# LLM Client Pool
+class LlmClientPool:
+    """
+    Process-wide LLM clients keyed by (provider, model, api_key), created on
+    first use or at startup (warm_up) and closed on shutdown.
+    Calls go through one pooled AsyncOpenAI client per key, so HTTP connections
+    and TLS sessions are reused across requests. The Emergent universal key
+    goes to LLM_API_BASE (its proxy, the default); only if that is set empty
+    do its calls fall back to a session-scoped LlmChat. Custom OpenAI keys
+    always go to api.openai.com, never to the proxy.
+    """
+
+    def __init__(self, api_base: Optional[str]):
+        self.api_base = api_base
+        self._clients: dict = {}
+
+    def client(self, route: LlmRoute):
+        """Pooled AsyncOpenAI client, or None when native calls are not available"""
+        if route.provider != "openai":
+            return None
+        if route.api_key == EMERGENT_LLM_KEY and not self.api_base:
+            return None
+        key = (route.provider, route.model, route.api_key)
+        client = self._clients.get(key)
+        if client is None:
+            try:
+                from openai import AsyncOpenAI
+            except ImportError:
+                return None
+            base_url = self.api_base if route.api_key == EMERGENT_LLM_KEY else None
+            client = self._clients[key] = AsyncOpenAI(api_key=route.api_key, base_url=base_url)
+        return client
+
+    def chat(self, route: LlmRoute, session_id: str, system_message: str) -> LlmChat:
+        return LlmChat(
+            api_key=route.api_key,
+            session_id=session_id,
+            system_message=system_message
+        ).with_model(route.provider, route.model)
+
+    async def send(self, route: LlmRoute, system_message: str, user_text: str, session_id: str, temperature: Optional[float] = None) -> str:
+        """Return the complete LLM reply"""
+        started = asyncio.get_running_loop().time()
+        try:
+            client = self.client(route)
+            if client is None:
+                reply = await self.chat(route, session_id, system_message).send_message(UserMessage(text=user_text))
+            else:
+                options = {"temperature": temperature} if temperature is not None else {}
+                completion = await client.chat.completions.create(
+                    model=route.model,
+                    messages=[
+                        {"role": "system", "content": system_message},
+                        {"role": "user", "content": user_text}
+                    ],
+                    **options
+                )
+                reply = completion.choices[0].message.content or ""
+        except BaseException:  # Includes timeouts (cancellation by wait_for)
+            llm_metrics.record(route, asyncio.get_running_loop().time() - started, error=True)
+            raise
+        
+        llm_metrics.record(route, asyncio.get_running_loop().time() - started, len(reply) // 4)
+        return reply
+
+    async def stream(self, route: LlmRoute, system_message: str, user_text: str, session_id: str, temperature: float, timeout: float):
+        """
+        Yield the LLM reply in chunks as they arrive. Needs a native client (check
+        client(route) first) - LlmChat can only return the complete reply.
+        Raises asyncio.TimeoutError if the whole reply takes longer than `timeout`.
+        """
+        client = self.client(route)
+        if client is None:
+            raise RuntimeError(f"No streaming client for {route.provider}/{route.model}")
+        
+        started = asyncio.get_running_loop().time()
+        deadline = started + timeout
+        first_chunk_latency = None
+        chars = 0
+        completed = False
+        stream = None
+        try:
+            stream = await asyncio.wait_for(
+                client.chat.completions.create(
+                    model=route.model,
+                    messages=[
+                        {"role": "system", "content": system_message},
+                        {"role": "user", "content": user_text}
+                    ],
+                    temperature=temperature,
+                    stream=True
+                ),
+                timeout=timeout
+            )
+            chunks = stream.__aiter__()
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    break
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_chunk_latency is None:
+                        first_chunk_latency = asyncio.get_running_loop().time() - started
+                    chars += len(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+            completed = True
+        finally:
+            llm_metrics.record(
+                route, asyncio.get_running_loop().time() - started, chars // 4,
+                first_chunk_latency=first_chunk_latency, error=not completed
+            )
+            if stream is not None:
+                # Closing the response aborts the upstream generation (e.g. on client disconnect)
+                await stream.close()
+
+    async def warm_up(self, routes: List[LlmRoute]):
+        """Create clients for the given routes and open their connections"""
+        for route in routes:
+            client = self.client(route)
+            if client is None:
+                continue
+            try:
+                await asyncio.wait_for(client.models.list(), timeout=5.0)
+            except Exception as e:
+                logger.warning(f"LLM client warm-up failed for {route.provider}/{route.model}: {str(e)}")
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.close()
+        self._clients = {}
+
+    def stats(self) -> dict:
+        return {
+            "native_clients": len(self._clients),
+            "api_base_configured": bool(self.api_base)
+        }
+
+llm_pool = LlmClientPool(LLM_API_BASE)
+
+class JsonArrayStreamParser:
+    """
+    Incremental parser for an LLM reply that should contain a JSON array.
+    feed() consumes the reply chunk by chunk and returns every top-level array
+    element completed by that chunk (a string element is complete as soon as
+    its closing quote arrives). Text before the opening bracket, such as a
+    ```json fence, is skipped.
+    """
+
+    def __init__(self):
+        self.items: list = []
+        self.started = False  # Seen the opening bracket
+        self.finished = False  # Seen the matching closing bracket
+        self.malformed = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._item: List[str] = []
+
+    def feed(self, chunk: str) -> list:
+        completed = []
+        if self.finished or self.malformed:
+            return completed
+        
+        for char in chunk:
+            if not self.started:
+                if char == '[':
+                    self.started = True
+                    self._depth = 1
+                continue
+            
+            if self._in_string:
+                self._item.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._emit(completed)
+            elif char == '"':
+                self._in_string = True
+                self._item.append(char)
+            elif char in '[{':
+                self._depth += 1
+                self._item.append(char)
+            elif char in ']}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(completed)  # Trailing scalar element, if any
+                    self.finished = True
+                    break
+                self._item.append(char)
+                if self._depth == 1:
+                    self._emit(completed)
+            elif char == ',' and self._depth == 1:
+                self._emit(completed)
+            elif self._depth > 1 or not char.isspace():
+                self._item.append(char)
+            
+            if self.malformed:
+                break
+        
+        return completed
+
+    def _emit(self, completed: list):
+        raw = "".join(self._item).strip()
+        self._item = []
+        if not raw:
+            return
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            self.malformed = True
+            return
+        self.items.append(value)
+        completed.append(value)
+
+    def result(self) -> Optional[list]:
+        """
+        All parsed elements. A truncated or malformed array keeps the elements completed
+        before it broke off (they may already have been streamed); None if the reply was
+        not a JSON array or broke off before its first element.
+        """
+        if self.finished and not self.malformed:
+            return self.items
+        return self.items or None
+
+def fallback_questions(response_text: str) -> List[str]:
+    """Fallback for non-JSON clarify replies: split by newlines and keep questions"""
+    lines = [line.strip() for line in response_text.split('\n') if line.strip()]
+    return [line for line in lines if line.endswith('?')][:6]
+
+def fallback_suggestions(response_text: str) -> List[str]:
+    """Fallback for non-JSON optimize replies: split by newlines and strip bullets"""
+    lines = [line.strip() for line in response_text.split('\n') if line.strip()]
+    return [line.lstrip('- •*').strip() for line in lines if line][:5]
+
+def parse_json_array_reply(response_text: str, fallback) -> list:
+    """Parse a complete clarify/optimize reply, using `fallback` when it is not a JSON array"""
+    parser = JsonArrayStreamParser()
+    parser.feed(response_text)
+    items = parser.result()
+    return items if items is not None else fallback(response_text)
+
+async def lookup_cached_reply(request: GenerateRequest, conversation_context: str, system_message: str, model: str) -> tuple:
+    """
+    Return (cache_key, cached reply or None) for a clarify/optimize request.
+    Exact matches come from the response cache; clarify requests additionally
+    fall back to the near-duplicate index.
+    """
+    cache_key = ResponseCache.make_key(request.stage.value, request.user_input, conversation_context, system_message, model)
+    cached = await response_cache.get(cache_key)
+    if cached is None and request.stage == OmegaStage.clarify:
+        cached = clarify_index.query(
+            ClarifySimilarityIndex.scope(system_message, model),
+            f"{request.user_input}\n{conversation_context}"
+        )
+    return cache_key, cached
+
+async def store_cached_reply(request: GenerateRequest, cache_key: str, conversation_context: str, system_message: str, model: str, items: list, tokens_used: int):
+    """Store a parsed clarify/optimize reply in the response cache (and the near-duplicate index)"""
+    extra = None
+    if request.stage == OmegaStage.clarify:
+        scope = ClarifySimilarityIndex.scope(system_message, model)
+        source_text = f"{request.user_input}\n{conversation_context}"
+        clarify_index.add(scope, cache_key, source_text, items, tokens_used)
+        extra = {"scope": scope, "source_text": source_text}
+    await response_cache.set(cache_key, request.stage.value, items, tokens_used, extra)
+
+async def charge_cached_reply(user: dict, stage: OmegaStage, cached: dict, session_id: str) -> int:
+    """Charge the reduced token amount for a reply served from the response cache"""
+    tokens_used = int(cached["tokens_used"] * RESPONSE_CACHE_HIT_CHARGE_RATIO)
+    if tokens_used:
+        # Conditional on the live balance, not on the (possibly stale) cached user document
+        await deduct_tokens(
+            user["id"],
+            tokens_used,
+            f"{stage.value.capitalize()} stage (cached) - Session {session_id}",
+            None,  # No OpenAI call - kept out of the metered usage in token_rollups and user_stats
+            min_balance=None if user.get("is_admin") else TOKEN_LIMIT_MIN,  # Admin has unlimited tokens
+            cached=True
+        )
+    return tokens_used
+
+def sse_event(event: str, data: dict) -> str:
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Omega Agent Generator Endpoint
+@api_router.post("/generate", response_model=GenerateResponse)
+async def generate_omega_prompt(request: GenerateRequest, http_request: Request):
+    """
+    Generate Omega prompts through three stages:
+    1. clarify: Ask clarifying questions about business use case
+    2. optimize: Provide optimization suggestions and pattern recommendations
+    3. final: Assemble complete Omega prompt in markdown format
+    
+    Requires authentication. Deducts Omega tokens based on OpenAI API usage.
+    """
+    # Require authentication
     user = await require_auth(http_request)
     
     # Check if user is banned
     if user.get("is_banned", False):
         raise HTTPException(status_code=403, detail="Váš účet byl zablokován administrátorem")
     
+    hold = None
     try:
         # Validate input length
-        if len(request.user_input) > 4000:
-            raise HTTPException(status_code=400, detail="Input too long (max 4000 characters)")
-        
-        if len(request.messages) > 20:
-            raise HTTPException(status_code=400, detail="Too many messages (max 20)")
-        
-        # Estimate tokens needed (rough estimate before API call)
-        estimated_tokens = 2000  # Average per stage
-        await require_tokens(user, estimated_tokens)
+        validate_generate_request(request)
         
         # Create chat instance with appropriate model and temperature
         session_id = request.session_id or str(uuid.uuid4())
         
-        # Stage-specific configurations
-        temperatures = {
-            OmegaStage.clarify: 0.2,
-            OmegaStage.optimize: 0.3,
-            OmegaStage.final: 0.4
-        }
-        
         # Build conversation history
-        conversation = []
-        for msg in request.messages[-10:]:  # Last 10 messages for context
-            conversation.append(f"{msg.role}: {msg.content}")
+        conversation_context = build_conversation_context(request)
+        system_message, user_text = build_stage_prompt(request, conversation_context)
+        route = await resolve_llm_route(request.stage.value)
+        
+        # Clarify/optimize replies are served from the response cache when possible
+        cache_key = None
+        if request.stage != OmegaStage.final:
+            cache_key, cached = await lookup_cached_reply(request, conversation_context, system_message, route.model)
+            if cached:
+                tokens_used = await charge_cached_reply(user, request.stage, cached, session_id)
+                items_field = "questions" if request.stage == OmegaStage.clarify else "suggestions"
+                usage = {"tokens": tokens_used, "cached": True}
+                if "similarity" in cached:
+                    usage["similarity"] = cached["similarity"]
+                return GenerateResponse(
+                    stage=request.stage,
+                    usage=usage,
+                    **{items_field: cached["items"]}
+                )
         
-        conversation_context = "\n".join(conversation) if conversation else "No previous conversation"
+        # Reserve estimated tokens in escrow before the API call (settled to actual usage afterwards)
+        hold = await reserve_tokens(user, TOKEN_HOLD_ESTIMATE)
         
         # Stage 1: Clarify - Ask clarifying questions
         if request.stage == OmegaStage.clarify:
-            system_message = request.master_prompt or """You are a business analyst helping to understand a use case for AI prompt engineering. 
-            
-Your task: Ask 3-6 clarifying questions to deeply understand:
-- The business context and goals
-- Target audience and use cases
-- Key constraints and requirements
-- Success metrics and expected outcomes
-- Technical environment and integration needs
-
-Return ONLY a JSON array of questions, no other text. Format: ["Question 1?", "Question 2?", "Question 3?"]"""
-            
-            chat = LlmChat(
-                api_key=EMERGENT_LLM_KEY,
-                session_id=session_id,
-                system_message=system_message
-            ).with_model("openai", "gpt-4.1")
-            
-            user_message = UserMessage(
-                text=f"Business Use Case: {request.user_input}\n\nConversation Context:\n{conversation_context}"
-            )
-            
             try:
                 # Add timeout
                 response = await asyncio.wait_for(
-                    chat.send_message(user_message),
-                    timeout=30.0
+                    llm_pool.send(route, system_message, user_text, session_id, STAGE_TEMPERATURES[OmegaStage.clarify]),
+                    timeout=STAGE_TIMEOUTS[OmegaStage.clarify]
                 )
                 
-                # Parse questions from response
-                import json
-                import re
-                
-                # Try to extract JSON array from response
+                # Parse questions from response (JSON array, newline fallback otherwise)
                 response_text = response.strip()
-                
-                # Look for JSON array pattern
-                json_match = re.search(r'\[[\s\S]*\]', response_text)
-                if json_match:
-                    questions_json = json_match.group(0)
-                    questions = json.loads(questions_json)
-                else:
-                    # Fallback: split by newlines and filter
-                    lines = [line.strip() for line in response_text.split('\n') if line.strip()]
-                    questions = [line for line in lines if line.endswith('?')][:6]
+                questions = parse_json_array_reply(response_text, fallback_questions)
                 
                 # Deduct tokens based on response length (approximate OpenAI token count)
                 tokens_used = len(response_text) // 4  # Rough estimate: 1 token ≈ 4 characters
-                await deduct_tokens(
+                await settle_tokens(
                     user["id"], 
+                    hold,
                     tokens_used, 
                     f"Clarify stage - Session {session_id}",
                     tokens_used
                 )
+                if questions:
+                    spawn_background(store_cached_reply(
+                        request, cache_key, conversation_context, system_message, route.model, questions, tokens_used
+                    ))
                 
                 return GenerateResponse(
                     stage=OmegaStage.clarify,
@@ -793,55 +2513,29 @@ Return ONLY a JSON array of questions, no other text. Format: ["Question 1?", "Q
         
         # Stage 2: Optimize - Provide suggestions and pattern recommendations
         elif request.stage == OmegaStage.optimize:
-            system_message = request.master_prompt or """You are an AI prompt engineering expert specializing in the Omega framework.
-
-Based on the business context and clarifying answers provided, analyze and suggest:
-1. 3-5 specific optimizations for prompt structure
-2. Recommended pattern (CustomerSupport, LeadQualification, ContentPlanning, or MarketResearch)
-3. Key considerations for implementation
-
-Return ONLY a JSON array of suggestion strings, no other text. Format: ["Suggestion 1", "Suggestion 2", "Pattern: CustomerSupport"]"""
-            
-            chat = LlmChat(
-                api_key=EMERGENT_LLM_KEY,
-                session_id=session_id,
-                system_message=system_message
-            ).with_model("openai", "gpt-4.1")
-            
-            user_message = UserMessage(
-                text=f"Business Use Case: {request.user_input}\n\nConversation Context:\n{conversation_context}\n\nProvide optimization suggestions and pattern recommendation."
-            )
-            
             try:
                 response = await asyncio.wait_for(
-                    chat.send_message(user_message),
-                    timeout=30.0
+                    llm_pool.send(route, system_message, user_text, session_id, STAGE_TEMPERATURES[OmegaStage.optimize]),
+                    timeout=STAGE_TIMEOUTS[OmegaStage.optimize]
                 )
                 
-                # Parse suggestions from response
-                import json
-                import re
-                
+                # Parse suggestions from response (JSON array, newline fallback otherwise)
                 response_text = response.strip()
-                
-                # Look for JSON array pattern
-                json_match = re.search(r'\[[\s\S]*\]', response_text)
-                if json_match:
-                    suggestions_json = json_match.group(0)
-                    suggestions = json.loads(suggestions_json)
-                else:
-                    # Fallback: split by newlines
-                    lines = [line.strip() for line in response_text.split('\n') if line.strip()]
-                    suggestions = [line.lstrip('- •*').strip() for line in lines if line][:5]
+                suggestions = parse_json_array_reply(response_text, fallback_suggestions)
                 
                 # Deduct tokens
                 tokens_used = len(response_text) // 4
-                await deduct_tokens(
+                await settle_tokens(
                     user["id"], 
+                    hold,
                     tokens_used, 
                     f"Optimize stage - Session {session_id}",
                     tokens_used
                 )
+                if suggestions:
+                    spawn_background(store_cached_reply(
+                        request, cache_key, conversation_context, system_message, route.model, suggestions, tokens_used
+                    ))
                 
                 return GenerateResponse(
                     stage=OmegaStage.optimize,
@@ -853,55 +2547,18 @@ Return ONLY a JSON array of suggestion strings, no other text. Format: ["Suggest
                 raise HTTPException(status_code=504, detail="Request timeout - please try again")
         
         # Stage 3: Final - Assemble complete Omega prompt
-        elif request.stage == OmegaStage.final:
-            system_message = request.master_prompt or """You are an Omega prompt architect. Assemble a complete, production-ready prompt using the Ω framework.
-
-Structure your response as a well-formatted markdown document with these sections:
-
-# Omega Prompt: [Use Case Title]
-
-## 1. Context & Purpose
-Define the core objective and business context.
-
-## 2. Role & Persona
-Specify the AI's role, expertise, and communication style.
-
-## 3. Constraints & Rules
-List what the AI must do, must not do, and guardrails.
-
-## 4. Output Format
-Describe the expected structure and format of responses.
-
-## 5. Evaluation Checklist
-Provide criteria to assess prompt effectiveness.
-
-## 6. Example Interaction
-Show a sample input-output pair.
-
-Make it comprehensive, actionable, and ready to use."""
-            
-            chat = LlmChat(
-                api_key=EMERGENT_LLM_KEY,
-                session_id=session_id,
-                system_message=system_message
-            ).with_model("openai", "gpt-4.1")
-            
-            pattern_context = f"\nRecommended Pattern: {request.pattern}" if request.pattern else ""
-            
-            user_message = UserMessage(
-                text=f"Business Use Case: {request.user_input}{pattern_context}\n\nConversation Context:\n{conversation_context}\n\nGenerate the complete Omega prompt in markdown format."
-            )
-            
+        else:
             try:
                 response = await asyncio.wait_for(
-                    chat.send_message(user_message),
-                    timeout=40.0
+                    llm_pool.send(route, system_message, user_text, session_id, STAGE_TEMPERATURES[OmegaStage.final]),
+                    timeout=STAGE_TIMEOUTS[OmegaStage.final]
                 )
                 
                 # Deduct tokens
                 tokens_used = len(response) // 4
-                await deduct_tokens(
+                await settle_tokens(
                     user["id"], 
+                    hold,
                     tokens_used, 
                     f"Final stage - Session {session_id}",
                     tokens_used
@@ -915,15 +2572,414 @@ Make it comprehensive, actionable, and ready to use."""
                 
             except asyncio.TimeoutError:
                 raise HTTPException(status_code=504, detail="Request timeout - please try again")
-        
-        else:
-            raise HTTPException(status_code=400, detail=f"Invalid stage: {request.stage}")
             
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error in /api/generate: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    finally:
+        # Release the escrow if the stage did not settle it (timeout, LLM or parse error)
+        if hold and not hold.get("settled"):
+            await release_tokens(user["id"], hold)
+
+@api_router.post("/generate/stream")
+async def generate_omega_prompt_stream(request: GenerateRequest, http_request: Request):
+    """
+    Streaming variant of /generate (Server-Sent Events).
+    Events:
+    - item: {"index": N, "text": "..."} - clarify/optimize: next question or suggestion,
+      sent as soon as the model closes it
+    - delta: {"text": "..."} - final: next chunk of the markdown prompt
+    - done: {"stage": ..., "questions"|"suggestions": [...], "usage": {"tokens": N}} -
+      stream finished, tokens charged
+    - error: {"status_code": N, "detail": "..."} - generation failed; on a timeout the part
+      already streamed is charged, otherwise nothing
+    Tokens are held in escrow up front and settled when the stream ends. If the client
+    disconnects, the upstream LLM call is cancelled and only the streamed part is charged.
+    Uncached replies need the pooled OpenAI-compatible client (503 without one).
+    Requires authentication.
+    """
+    user = await require_auth(http_request)
+    
+    if user.get("is_banned", False):
+        raise HTTPException(status_code=403, detail="Váš účet byl zablokován administrátorem")
+    
+    validate_generate_request(request)
+    
+    stage = request.stage
+    session_id = request.session_id or str(uuid.uuid4())
+    conversation_context = build_conversation_context(request)
+    system_message, user_text = build_stage_prompt(request, conversation_context)
+    route = await resolve_llm_route(stage.value)
+    description = f"{stage.value.capitalize()} stage - Session {session_id}"
+    items_field = "questions" if stage == OmegaStage.clarify else "suggestions"
+    
+    cache_key = None
+    if stage != OmegaStage.final:
+        cache_key, cached = await lookup_cached_reply(request, conversation_context, system_message, route.model)
+        if cached:
+            tokens_used = await charge_cached_reply(user, stage, cached, session_id)
+            usage = {"tokens": tokens_used, "cached": True}
+            if "similarity" in cached:
+                usage["similarity"] = cached["similarity"]
+            
+            async def cached_stream():
+                for index, item in enumerate(cached["items"]):
+                    yield sse_event("item", {"index": index, "text": item})
+                yield sse_event("done", {
+                    "stage": stage.value,
+                    items_field: cached["items"],
+                    "usage": usage
+                })
+            
+            return StreamingResponse(cached_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+    
+    # LlmChat only returns whole replies; an SSE stream over one would just delay the first byte
+    if llm_pool.client(route) is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Streaming is not available for this model configuration (LLM_API_BASE is empty) - use /api/generate"
+        )
+    
+    # Reserve before the stream starts so an insufficient balance is a plain 402
+    hold = await reserve_tokens(user, TOKEN_HOLD_ESTIMATE)
+    
+    def settle_streamed(parts: list, reason: str):
+        """Charge what was already streamed and release the rest of the hold"""
+        tokens_used = len("".join(parts)) // 4
+        if not tokens_used:
+            return release_tokens(user["id"], hold)
+        return settle_tokens(user["id"], hold, tokens_used, f"{description} ({reason})", tokens_used)
+    
+    async def event_stream():
+        parser = JsonArrayStreamParser()
+        parts = []
+        finished = False
+        try:
+            async for text in llm_pool.stream(
+                route,
+                system_message,
+                user_text,
+                session_id,
+                STAGE_TEMPERATURES[stage],
+                STAGE_TIMEOUTS[stage]
+            ):
+                parts.append(text)
+                if stage == OmegaStage.final:
+                    yield sse_event("delta", {"text": text})
+                    continue
+                for item in parser.feed(text):
+                    yield sse_event("item", {"index": len(parser.items) - 1, "text": item})
+            
+            done = {"stage": stage.value}
+            response_text = "".join(parts)
+            if stage != OmegaStage.final:
+                # Not a JSON array - send the newline fallback items at the end (never after items
+                # were streamed: result() keeps those, so indexes are not reused)
+                response_text = response_text.strip()
+                items = parser.result()
+                if items is None:
+                    fallback = fallback_questions if stage == OmegaStage.clarify else fallback_suggestions
+                    items = fallback(response_text)
+                    for index, item in enumerate(items):
+                        yield sse_event("item", {"index": index, "text": item})
+                done[items_field] = items
+            
+            tokens_used = len(response_text) // 4
+            await settle_tokens(user["id"], hold, tokens_used, description, tokens_used)
+            if cache_key and done.get(items_field):
+                spawn_background(store_cached_reply(
+                    request, cache_key, conversation_context, system_message, route.model, done[items_field], tokens_used
+                ))
+            finished = True
+            done["usage"] = {"tokens": tokens_used}
+            yield sse_event("done", done)
+            
+        except asyncio.TimeoutError:
+            # The client already has the streamed part, so it is charged like an interrupted stream
+            await settle_streamed(parts, "timed out")
+            yield sse_event("error", {"status_code": 504, "detail": "Request timeout - please try again"})
+        except Exception as e:
+            logger.error(f"Error in /api/generate/stream: {str(e)}", exc_info=True)
+            if not hold.get("settled"):
+                await release_tokens(user["id"], hold)
+            yield sse_event("error", {"status_code": 500, "detail": f"Internal server error: {str(e)}"})
+        finally:
+            if not finished and not hold.get("settled"):
+                # Client disconnected - this generator is being cancelled, so settle the
+                # streamed part detached
+                spawn_background(settle_streamed(parts, "interrupted"))
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Prompt Body Storage
+# master_prompt bodies live in prompt_bodies, keyed by the SHA-256 of the text and zlib-compressed;
+# generated_prompts only hold master_prompt_hash. refcount is raised before a prompt is inserted and
+# lowered after prompts are deleted, so a crash in between can only leave it too high, never too low;
+# rebuild_prompt_body_refcounts() recounts and removes bodies nobody references.
+PROMPT_BODY_MIGRATION_ID = "prompt_bodies"
+PROMPT_BODY_TERMS_MIGRATION_ID = "prompt_body_terms"
+
+def prompt_body_hash(body: str) -> str:
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+def master_prompt_terms(body: str) -> str:
+    """Distinct folded words of a body - what the search index needs instead of the full markdown"""
+    return " ".join(dict.fromkeys(re.findall(r'\w+', fold_text(body))))
+
+async def store_prompt_body(body: str) -> str:
+    """Store a body, or add a reference to the identical one already stored, and return its hash"""
+    body_hash = prompt_body_hash(body)
+    raw = body.encode('utf-8')
+    compressed = zlib.compress(raw, PROMPT_BODY_COMPRESSION_LEVEL)
+    update = {
+        "$inc": {"refcount": 1},
+        "$set": {"updated_at": datetime.now(timezone.utc)},
+        "$setOnInsert": {
+            "body": compressed,
+            "size": len(body),
+            "raw_bytes": len(raw),
+            "stored_bytes": len(compressed),
+            "terms": master_prompt_terms(body),
+            "created_at": datetime.now(timezone.utc)
+        }
+    }
+    try:
+        await db.prompt_bodies.update_one({"id": body_hash}, update, upsert=True)
+    except DuplicateKeyError:
+        # Another request inserted the same body first; it exists now, so this only increments
+        await db.prompt_bodies.update_one({"id": body_hash}, update, upsert=True)
+    return body_hash
+
+async def release_prompt_bodies(refs: Dict[str, int]):
+    """Drop references (hash -> number of prompts removed) and delete bodies nobody references"""
+    if not refs:
+        return
+    await db.prompt_bodies.bulk_write(
+        [UpdateOne({"id": body_hash}, {"$inc": {"refcount": -count}}) for body_hash, count in refs.items()],
+        ordered=False
+    )
+    await db.prompt_bodies.delete_many({"id": {"$in": list(refs)}, "refcount": {"$lte": 0}})
+
+async def prompt_body_refs(query: dict) -> Dict[str, int]:
+    """Count the body references held by the prompts matching query (hash -> prompts)"""
+    refs = {}
+    async for row in db.generated_prompts.aggregate([
+        {"$match": {**query, "master_prompt_hash": {"$exists": True}}},
+        {"$group": {"_id": "$master_prompt_hash", "count": {"$sum": 1}}}
+    ]):
+        refs[row["_id"]] = row["count"]
+    return refs
+
+async def resolve_master_prompts(prompts: List[dict]) -> List[dict]:
+    """Fill in master_prompt for prompts stored by hash (not yet migrated ones still carry it inline)"""
+    hashes = {p["master_prompt_hash"] for p in prompts if "master_prompt" not in p and p.get("master_prompt_hash")}
+    bodies = {}
+    if hashes:
+        async for doc in db.prompt_bodies.find({"id": {"$in": list(hashes)}}, {"_id": 0, "id": 1, "body": 1}):
+            bodies[doc["id"]] = zlib.decompress(doc["body"]).decode('utf-8')
+    for prompt in prompts:
+        if "master_prompt" not in prompt:
+            body_hash = prompt.get("master_prompt_hash")
+            if body_hash not in bodies:
+                logger.error(f"Missing prompt body {body_hash} for prompt {prompt.get('id')}")
+            prompt["master_prompt"] = bodies.get(body_hash, "")
+    return prompts
+
+async def rebuild_prompt_body_refcounts() -> dict:
+    """
+    Recount references from generated_prompts, correcting counts left too high by interrupted
+    writes and deleting orphaned bodies. A body is only corrected if it has not been referenced
+    within the grace period and is unchanged since it was read, so concurrent saves are safe.
+    """
+    refs = await prompt_body_refs({})
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=PROMPT_BODY_REBUILD_GRACE_SECONDS)
+    
+    operations = []
+    async for body in db.prompt_bodies.find(
+        {"updated_at": {"$lt": cutoff}},
+        {"_id": 0, "id": 1, "refcount": 1, "updated_at": 1}
+    ):
+        count = refs.get(body["id"], 0)
+        unchanged = {"id": body["id"], "updated_at": body["updated_at"]}
+        if count == 0:
+            operations.append(DeleteOne(unchanged))
+        elif count != body["refcount"]:
+            operations.append(UpdateOne(unchanged, {"$set": {"refcount": count}}))
+    
+    corrected = removed = 0
+    for i in range(0, len(operations), 1000):
+        result = await db.prompt_bodies.bulk_write(operations[i:i + 1000], ordered=False)
+        corrected += result.modified_count
+        removed += result.deleted_count
+    
+    logger.info(f"Rebuilt prompt body refcounts: {corrected} corrected, {removed} orphans removed")
+    return {"corrected": corrected, "orphans_removed": removed}
+
+async def prompt_body_report() -> dict:
+    """Storage and deduplication figures for prompt bodies"""
+    totals = await db.prompt_bodies.aggregate([
+        {"$group": {
+            "_id": None,
+            "bodies": {"$sum": 1},
+            "references": {"$sum": "$refcount"},
+            "logical_bytes": {"$sum": {"$multiply": ["$raw_bytes", "$refcount"]}},
+            "unique_bytes": {"$sum": "$raw_bytes"},
+            "stored_bytes": {"$sum": "$stored_bytes"}
+        }}
+    ]).to_list(1)
+    totals = totals[0] if totals else {}
+    bodies = totals.get("bodies", 0)
+    references = totals.get("references", 0)
+    logical_bytes = totals.get("logical_bytes", 0)
+    unique_bytes = totals.get("unique_bytes", 0)
+    stored_bytes = totals.get("stored_bytes", 0)
+    return {
+        "bodies": bodies,
+        "references": references,
+        "logical_bytes": logical_bytes,  # What inline storage would hold
+        "unique_bytes": unique_bytes,  # After deduplication
+        "stored_bytes": stored_bytes,  # After deduplication and compression
+        "dedup_ratio": round(logical_bytes / unique_bytes, 2) if unique_bytes else None,
+        "compression_ratio": round(unique_bytes / stored_bytes, 2) if stored_bytes else None,
+        "total_ratio": round(logical_bytes / stored_bytes, 2) if stored_bytes else None,
+        "inline_prompts": await db.generated_prompts.count_documents({"master_prompt": {"$exists": True}})
+    }
+
+async def migrate_inline_prompt_bodies() -> int:
+    """
+    Move master_prompt bodies stored inline in generated_prompts into prompt_bodies, in _id order
+    with a checkpoint per batch. A prompt is only rewritten if its body is unchanged since it was
+    read; otherwise the reference just taken is released again.
+    """
+    state = await db.migrations.find_one({"id": PROMPT_BODY_MIGRATION_ID}, {"_id": 0}) or {}
+    last_id = state.get("checkpoint")
+    moved = 0
+    
+    while True:
+        if not await acquire_lease(PROMPT_BODY_MIGRATION_ID, PROMPT_BODY_MIGRATION_LEASE_SECONDS):
+            raise RuntimeError("Prompt body migration lease lost to another worker")
+        
+        query = {"master_prompt": {"$exists": True}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db.generated_prompts.find(query, {"master_prompt": 1}).sort("_id", 1).to_list(PROMPT_BODY_MIGRATION_BATCH_SIZE)
+        if not batch:
+            return moved
+        
+        batch_moved = 0
+        for doc in batch:
+            body = doc["master_prompt"]
+            body_hash = await store_prompt_body(body)
+            result = await db.generated_prompts.update_one(
+                {"_id": doc["_id"], "master_prompt": body},
+                {
+                    "$set": {
+                        "master_prompt_hash": body_hash,
+                        "master_prompt_size": len(body)
+                    },
+                    "$unset": {"master_prompt": ""}
+                }
+            )
+            if result.modified_count:
+                batch_moved += 1
+            else:
+                await release_prompt_bodies({body_hash: 1})
+        
+        moved += batch_moved
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"id": PROMPT_BODY_MIGRATION_ID},
+            {"$set": {"checkpoint": last_id, "updated_at": datetime.now(timezone.utc)}, "$inc": {"moved": batch_moved}},
+            upsert=True
+        )
+        await asyncio.sleep(PROMPT_BODY_MIGRATION_PAUSE_SECONDS)
+
+async def run_prompt_body_migration():
+    """Move inline prompt bodies to prompt_bodies; no-op once completed"""
+    state = await db.migrations.find_one({"id": PROMPT_BODY_MIGRATION_ID}, {"_id": 0, "completed_at": 1})
+    if state and state.get("completed_at"):
+        return
+    if not await acquire_lease(PROMPT_BODY_MIGRATION_ID, PROMPT_BODY_MIGRATION_LEASE_SECONDS):
+        return  # Another worker is running it
+    
+    try:
+        moved = await migrate_inline_prompt_bodies()
+        await db.migrations.update_one(
+            {"id": PROMPT_BODY_MIGRATION_ID},
+            {"$set": {"completed_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        logger.info(f"Prompt body migration completed: {moved} prompts moved")
+    finally:
+        await release_lease(PROMPT_BODY_MIGRATION_ID)
+
+async def backfill_prompt_body_terms() -> int:
+    """
+    Give bodies stored before search terms moved onto them their terms, in _id order with a
+    checkpoint per batch, then drop the per-prompt copies (master_prompt_terms) nothing reads.
+    """
+    state = await db.migrations.find_one({"id": PROMPT_BODY_TERMS_MIGRATION_ID}, {"_id": 0}) or {}
+    last_id = state.get("checkpoint")
+    filled = 0
+    
+    while True:
+        if not await acquire_lease(PROMPT_BODY_TERMS_MIGRATION_ID, PROMPT_BODY_MIGRATION_LEASE_SECONDS):
+            raise RuntimeError("Prompt body terms migration lease lost to another worker")
+        
+        query = {"terms": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db.prompt_bodies.find(query, {"body": 1}).sort("_id", 1).to_list(PROMPT_BODY_MIGRATION_BATCH_SIZE)
+        if not batch:
+            break
+        
+        # A body never changes once stored (it is keyed by its hash), so no concurrent-write guard
+        result = await db.prompt_bodies.bulk_write([
+            UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"terms": master_prompt_terms(zlib.decompress(doc["body"]).decode('utf-8'))}}
+            )
+            for doc in batch
+        ], ordered=False)
+        filled += result.modified_count
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"id": PROMPT_BODY_TERMS_MIGRATION_ID},
+            {"$set": {"checkpoint": last_id, "updated_at": datetime.now(timezone.utc)}, "$inc": {"filled": result.modified_count}},
+            upsert=True
+        )
+        await asyncio.sleep(PROMPT_BODY_MIGRATION_PAUSE_SECONDS)
+    
+    await db.generated_prompts.update_many(
+        {"master_prompt_terms": {"$exists": True}},
+        {"$unset": {"master_prompt_terms": ""}}
+    )
+    return filled
+
+async def run_prompt_body_terms_migration():
+    """Move search terms from prompts onto their bodies; no-op once completed"""
+    state = await db.migrations.find_one({"id": PROMPT_BODY_TERMS_MIGRATION_ID}, {"_id": 0, "completed_at": 1})
+    if state and state.get("completed_at"):
+        return
+    if not await acquire_lease(PROMPT_BODY_TERMS_MIGRATION_ID, PROMPT_BODY_MIGRATION_LEASE_SECONDS):
+        return  # Another worker is running it
+    
+    try:
+        filled = await backfill_prompt_body_terms()
+        await db.migrations.update_one(
+            {"id": PROMPT_BODY_TERMS_MIGRATION_ID},
+            {"$set": {"completed_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        logger.info(f"Prompt body terms migration completed: {filled} bodies filled")
+    finally:
+        await release_lease(PROMPT_BODY_TERMS_MIGRATION_ID)
 
 # Generated Prompt History Endpoints
 @api_router.post("/prompts", response_model=GeneratedPromptResponse)
@@ -938,40 +2994,32 @@ async def create_generated_prompt(request: GeneratedPromptCreate, http_request:
     
     try:
         # Generate agent name using GPT-4.1
-        name_chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=str(uuid.uuid4()),
-            system_message="You are an AI that generates concise, professional agent names (2-4 words max). Respond with ONLY the name, no explanation."
-        ).with_model("openai", "gpt-4.1")
-        
-        name_message = UserMessage(
-            text=f"Based on this conversation context, generate a short agent name:\n\n{request.conversation_context[:1000]}"
-        )
-        
         agent_name = await asyncio.wait_for(
-            name_chat.send_message(name_message),
+            llm_pool.send(
+                await resolve_llm_route("name"),
+                "You are an AI that generates concise, professional agent names (2-4 words max). Respond with ONLY the name, no explanation.",
+                f"Based on this conversation context, generate a short agent name:\n\n{request.conversation_context[:1000]}",
+                str(uuid.uuid4())
+            ),
             timeout=15.0
         )
         agent_name = agent_name.strip().strip('"').strip("'")
         
         # Generate agent description (3 characteristics) using GPT-4.1
-        desc_chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=str(uuid.uuid4()),
-            system_message="""Generate a 3-part agent description in JSON format with these exact keys:
+        desc_system_message = """Generate a 3-part agent description in JSON format with these exact keys:
 - "general_function": One sentence describing the main purpose (Czech: Obecná funkce)
 - "specialization": One sentence describing specific expertise (Czech: Specializace)  
 - "output": One sentence describing what the agent produces (Czech: Výstup)
 
 Respond with ONLY valid JSON, no markdown formatting."""
-        ).with_model("openai", "gpt-4.1")
-        
-        desc_message = UserMessage(
-            text=f"Based on this conversation and master prompt, generate the 3-part description:\n\nConversation:\n{request.conversation_context[:800]}\n\nMaster Prompt:\n{request.master_prompt[:500]}"
-        )
         
         description_json = await asyncio.wait_for(
-            desc_chat.send_message(desc_message),
+            llm_pool.send(
+                await resolve_llm_route("description"),
+                desc_system_message,
+                f"Based on this conversation and master prompt, generate the 3-part description:\n\nConversation:\n{request.conversation_context[:800]}\n\nMaster Prompt:\n{request.master_prompt[:500]}",
+                str(uuid.uuid4())
+            ),
             timeout=20.0
         )
         
@@ -991,19 +3039,19 @@ Respond with ONLY valid JSON, no markdown formatting."""
             name=agent_name,
             description=AgentCharacteristics(**description_data),
             master_prompt=request.master_prompt,
+            master_prompt_size=len(request.master_prompt),
             conversation_summary=request.conversation_context[:200] + "..." if len(request.conversation_context) > 200 else request.conversation_context
         )
         
-        # Save to MongoDB
-        doc = prompt.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        doc['description'] = {
-            'general_function': doc['description'].general_function,
-            'specialization': doc['description'].specialization,
-            'output': doc['description'].output
-        }
-        
-        await db.generated_prompts.insert_one(doc)
+        # Save to MongoDB - the body is stored once in prompt_bodies, the prompt keeps its hash
+        doc = prompt.model_dump(exclude={"master_prompt"})
+        doc["master_prompt_hash"] = await store_prompt_body(prompt.master_prompt)
+        try:
+            await db.generated_prompts.insert_one(doc)
+        except Exception:
+            await release_prompt_bodies({doc["master_prompt_hash"]: 1})
+            raise
+        await update_user_stats(user["id"], {"agents_count": 1})
         
         return GeneratedPromptResponse(
             id=prompt.id,
@@ -1023,48 +3071,233 @@ Respond with ONLY valid JSON, no markdown formatting."""
         logger.error(f"Error creating prompt: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@api_router.get("/prompts", response_model=List[GeneratedPromptResponse])
-async def get_generated_prompts():
+@api_router.get("/prompts", response_model=GeneratedPromptPage)
+async def get_generated_prompts(
+    request: Request,
+    limit: int = PROMPTS_PAGE_SIZE,
+    cursor: Optional[str] = None
+):
     """
-    Get all generated prompts, sorted by creation date (newest first).
+    Get a page of the caller's generated prompts, newest first, without the master_prompt body.
+    Pass next_cursor back to get the following page; fetch /prompts/{id} for the full prompt.
+    Requires authentication.
     """
+    user = await require_auth(request)
+    
     try:
-        prompts = await db.generated_prompts.find({}, {"_id": 0}).sort("created_at", -1).to_list(100)
+        limit = max(1, min(limit, PROMPTS_MAX_PAGE_SIZE))
+        query = {"user_id": user["id"]}
+        if cursor:
+            sort_value, last_id = decode_cursor(cursor)
+            query = {"$and": [query, keyset_filter("created_at", sort_value, last_id, -1)]}
+        
+        # Served by the (user_id, created_at, id) index; prompts saved before the size was
+        # stored get it computed server-side so the body never leaves the database
+        pipeline = [
+            {"$match": query},
+            {"$sort": {"created_at": -1, "id": -1}},
+            {"$limit": limit + 1},
+            {"$project": {
+                "_id": 0,
+                "id": 1,
+                "name": 1,
+                "description": 1,
+                "created_at": 1,
+                "master_prompt_size": {"$ifNull": ["$master_prompt_size", {"$strLenCP": "$master_prompt"}]}
+            }}
+        ]
+        prompts = await db.generated_prompts.aggregate(pipeline).to_list(limit + 1)
+        
+        next_cursor = None
+        if len(prompts) > limit:
+            prompts = prompts[:limit]
+            next_cursor = encode_cursor(prompts[-1]["created_at"], prompts[-1]["id"])
         
-        # Convert ISO string timestamps back to datetime objects
         for prompt in prompts:
-            if isinstance(prompt['created_at'], str):
-                prompt['created_at'] = datetime.fromisoformat(prompt['created_at'])
-            
-            # Convert description dict to AgentCharacteristics
-            if isinstance(prompt['description'], dict):
-                prompt['description'] = AgentCharacteristics(**prompt['description'])
+            prompt['created_at'] = as_datetime(prompt['created_at'])
         
-        return prompts
+        return {"items": prompts, "next_cursor": next_cursor}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching prompts: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+def fold_text(text: str) -> str:
+    """Lowercase and strip diacritics (Příliš -> prilis), as the version 3 text index does"""
+    return ''.join(c for c in unicodedata.normalize('NFD', text.lower()) if not unicodedata.combining(c))
+
+def _fold_variants() -> Dict[str, str]:
+    """Map each base letter to the accented Latin letters that fold to it (c -> čćç...)"""
+    variants: Dict[str, str] = {}
+    for code in [*range(0xC0, 0x250), *range(0x1E00, 0x1F00)]:
+        char = chr(code)
+        folded = fold_text(char)
+        if len(folded) == 1 and folded != char.lower():
+            variants[folded] = variants.get(folded, "") + char
+    return variants
+
+FOLD_VARIANTS = _fold_variants()
+
+def search_terms(query: str) -> List[str]:
+    """Split a search query into distinct folded words"""
+    return list(dict.fromkeys(re.findall(r'\w+', fold_text(query))))[:PROMPT_SEARCH_MAX_TERMS]
+
+def search_pattern(terms: List[str]) -> re.Pattern:
+    """Whole-word regex for the folded terms that matches their accented spellings directly"""
+    # Matching the original text avoids folding whole master_prompt bodies just to find a snippet
+    alternatives = [
+        ''.join(f"[{re.escape(c + FOLD_VARIANTS[c])}]" if c in FOLD_VARIANTS else re.escape(c) for c in term)
+        for term in terms
+    ]
+    return re.compile(r'\b(?:' + '|'.join(alternatives) + r')\b', re.IGNORECASE)
+
+def highlight_text(field: str, text: str, pattern: re.Pattern) -> Optional[dict]:
+    """Snippet of text around the first matched word, with match ranges relative to the snippet"""
+    first = pattern.search(text)
+    if not first:
+        return None
+    
+    start = max(0, first.start() - PROMPT_SEARCH_SNIPPET_CHARS // 3)
+    end = min(len(text), start + PROMPT_SEARCH_SNIPPET_CHARS)
+    spans = []
+    # One character past the snippet keeps \b exact at its edge without scanning the rest of the body
+    for m in pattern.finditer(text, first.start(), end + 1):
+        if m.end() > end:
+            break
+        spans.append((m.start(), m.end()))
+    
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(text) else ""
+    shift = len(prefix) - start
+    return {
+        "field": field,
+        "snippet": prefix + text[start:end] + suffix,
+        "matches": [[span_start + shift, span_end + shift] for span_start, span_end in spans]
+    }
+
+@api_router.get("/prompts/search", response_model=PromptSearchPage)
+async def search_generated_prompts(
+    request: Request,
+    q: str,
+    limit: int = PROMPT_SEARCH_PAGE_SIZE,
+    cursor: Optional[str] = None
+):
+    """
+    Full-text search over the caller's prompts (name, description and master_prompt).
+    Matching ignores case and Czech diacritics; hits are ranked by relevance and carry
+    highlighted snippets. Pass next_cursor back to get the following page.
+    Requires authentication.
+    """
+    user = await require_auth(request)
+    
+    try:
+        terms = search_terms(q)
+        if not terms:
+            raise HTTPException(status_code=400, detail="Search query must contain at least one word")
+        limit = max(1, min(limit, PROMPT_SEARCH_MAX_PAGE_SIZE))
+        search = " ".join(terms)
+        
+        # Prompt fields: equality on user_id is the prefix of the compound text index, so only
+        # this user's postings are scanned regardless of how many prompts are stored overall.
+        # Mongo ranks them; only the best PROMPT_SEARCH_MAX_CANDIDATES are paged through.
+        scores: Dict[str, float] = {}
+        async for row in db.generated_prompts.find(
+            {"user_id": user["id"], "$text": {"$search": search}},
+            {"_id": 0, "id": 1, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"})]).limit(PROMPT_SEARCH_MAX_CANDIDATES):
+            scores[row["id"]] = row["score"]
+        
+        # Bodies are shared between users, so a text index over them would scan every user's
+        # postings; their terms are matched among this user's own bodies instead (id index), and
+        # each matched query word counts 1 - master_prompt's weight in the text index
+        body_hashes = await db.generated_prompts.distinct("master_prompt_hash", {"user_id": user["id"]})
+        if body_hashes:
+            words = set(terms)
+            body_scores = {
+                doc["id"]: len(words.intersection(doc["terms"].split()))
+                async for doc in db.prompt_bodies.find(
+                    {"id": {"$in": body_hashes}, "terms": {"$regex": "(?:^| )(?:" + "|".join(map(re.escape, terms)) + ")(?: |$)"}},
+                    {"_id": 0, "id": 1, "terms": 1}
+                )
+            }
+            if body_scores:
+                async for row in db.generated_prompts.find(
+                    {"user_id": user["id"], "master_prompt_hash": {"$in": list(body_scores)}},
+                    {"_id": 0, "id": 1, "master_prompt_hash": 1}
+                ):
+                    scores[row["id"]] = scores.get(row["id"], 0) + body_scores[row["master_prompt_hash"]]
+        
+        # Keyset on (score, id) descending, as the list endpoint pages on (created_at, id)
+        ranked = sorted(((score, prompt_id) for prompt_id, score in scores.items()), reverse=True)
+        if cursor:
+            last = tuple(decode_cursor(cursor))
+            ranked = [row for row in ranked if row < last]
+        
+        next_cursor = None
+        if len(ranked) > limit:
+            ranked = ranked[:limit]
+            next_cursor = encode_cursor(*ranked[-1])
+        
+        found = {
+            hit["id"]: hit
+            async for hit in db.generated_prompts.aggregate([
+                {"$match": {"user_id": user["id"], "id": {"$in": [prompt_id for _, prompt_id in ranked]}}},
+                {"$project": {
+                    "_id": 0,
+                    "id": 1,
+                    "name": 1,
+                    "description": 1,
+                    "master_prompt": 1,
+                    "master_prompt_hash": 1,
+                    "created_at": 1,
+                    "master_prompt_size": {"$ifNull": ["$master_prompt_size", {"$strLenCP": "$master_prompt"}]}
+                }}
+            ])
+        }
+        hits = [{**found[prompt_id], "score": score} for score, prompt_id in ranked if prompt_id in found]
+        
+        await resolve_master_prompts(hits)
+        pattern = search_pattern(terms)
+        for hit in hits:
+            texts = {"name": hit["name"], "master_prompt": hit.pop("master_prompt")}
+            for key, value in hit["description"].items():
+                texts[f"description.{key}"] = value
+            hit["highlights"] = [
+                highlight
+                for field in PROMPT_HIGHLIGHT_FIELDS
+                if (highlight := highlight_text(field, texts.get(field) or "", pattern))
+            ]
+            hit["created_at"] = as_datetime(hit["created_at"])
+        
+        return {"items": hits, "next_cursor": next_cursor}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error searching prompts: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
 @api_router.get("/prompts/{prompt_id}", response_model=GeneratedPromptResponse)
-async def get_generated_prompt(prompt_id: str):
+async def get_generated_prompt(prompt_id: str, request: Request):
     """
-    Get a single generated prompt by ID.
+    Get a single generated prompt by ID, including the full master_prompt.
+    Requires authentication; only the owner can read it.
     """
+    user = await require_auth(request)
+    
     try:
-        prompt = await db.generated_prompts.find_one({"id": prompt_id}, {"_id": 0})
+        prompt = await db.generated_prompts.find_one(
+            {"id": prompt_id, "user_id": user["id"]},
+            {"_id": 0, "master_prompt_terms": 0}
+        )
         
         if not prompt:
             raise HTTPException(status_code=404, detail="Prompt not found")
         
-        # Convert ISO string timestamp back to datetime
-        if isinstance(prompt['created_at'], str):
-            prompt['created_at'] = datetime.fromisoformat(prompt['created_at'])
-        
-        # Convert description dict to AgentCharacteristics
-        if isinstance(prompt['description'], dict):
-            prompt['description'] = AgentCharacteristics(**prompt['description'])
-        
+        await resolve_master_prompts([prompt])
+        prompt['created_at'] = as_datetime(prompt['created_at'])
         return prompt
         
     except HTTPException:
@@ -1074,30 +3307,26 @@ async def get_generated_prompt(prompt_id: str):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @api_router.patch("/prompts/{prompt_id}", response_model=GeneratedPromptResponse)
-async def update_generated_prompt(prompt_id: str, update: GeneratedPromptUpdate):
+async def update_generated_prompt(prompt_id: str, update: GeneratedPromptUpdate, request: Request):
     """
     Update the name of a generated prompt.
+    Requires authentication; only the owner can rename it.
     """
+    user = await require_auth(request)
+    
     try:
-        result = await db.generated_prompts.update_one(
-            {"id": prompt_id},
-            {"$set": {"name": update.name}}
+        prompt = await db.generated_prompts.find_one_and_update(
+            {"id": prompt_id, "user_id": user["id"]},
+            {"$set": {"name": update.name}},
+            projection={"_id": 0, "master_prompt_terms": 0},
+            return_document=ReturnDocument.AFTER
         )
         
-        if result.matched_count == 0:
+        if not prompt:
             raise HTTPException(status_code=404, detail="Prompt not found")
         
-        # Fetch and return updated prompt
-        prompt = await db.generated_prompts.find_one({"id": prompt_id}, {"_id": 0})
-        
-        # Convert ISO string timestamp back to datetime
-        if isinstance(prompt['created_at'], str):
-            prompt['created_at'] = datetime.fromisoformat(prompt['created_at'])
-        
-        # Convert description dict to AgentCharacteristics
-        if isinstance(prompt['description'], dict):
-            prompt['description'] = AgentCharacteristics(**prompt['description'])
-        
+        await resolve_master_prompts([prompt])
+        prompt['created_at'] = as_datetime(prompt['created_at'])
         return prompt
         
     except HTTPException:
@@ -1115,35 +3344,269 @@ async def require_admin(request: Request) -> dict:
         raise HTTPException(status_code=403, detail="Admin access required")
     return user
 
-# GDPR Audit Logging Function
-async def log_audit(
-    user_id: str,
-    action: str,
-    resource_type: str,
-    request: Request,
-    resource_id: Optional[str] = None,
-    details: Optional[dict] = None
-):
-    """Log GDPR-relevant actions for audit trail"""
+async def next_user_sequence_id() -> int:
+    """Allocate the next registration sequence ID (admin is always 1, users start at 2)"""
+    counter = await db.counters.find_one_and_update(
+        {"_id": "user_sequence_id"},
+        {"$inc": {"value": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["value"] + 1
+
+async def backfill_user_sequence_ids():
+    """Assign sequence IDs to users created before they were stored, in registration order"""
+    assigned = 0
+    cursor = db.users.find(
+        {"sequence_id": {"$exists": False}},
+        {"_id": 0, "id": 1, "is_admin": 1}
+    ).sort("created_at", 1)
+    async for user in cursor:
+        sequence_id = 1 if user.get("is_admin") else await next_user_sequence_id()
+        result = await db.users.update_one(
+            {"id": user["id"], "sequence_id": {"$exists": False}},
+            {"$set": {"sequence_id": sequence_id}}
+        )
+        assigned += result.modified_count
+        user_cache.invalidate(user["id"])
+    if assigned:
+        logger.info(f"Backfilled sequence IDs for {assigned} users")
+
+def user_search_keys(name: str, email: str) -> List[str]:
+    """Folded name words, the email and its words; admin search prefix-matches these"""
+    email = email.lower()
+    return list(dict.fromkeys(re.findall(r'\w+', fold_text(name)) + [email] + re.findall(r'\w+', email)))
+
+async def backfill_admin_user_listing():
+    """
+    Give users created before the admin listing paged through user_stats and searched
+    search_keys their stats row and search keys; no-op once completed.
+    """
+    state = await db.migrations.find_one({"id": ADMIN_USER_LISTING_MIGRATION_ID}, {"_id": 0, "completed_at": 1})
+    if state and state.get("completed_at"):
+        return
+    # The zero rows created below would make backfill_user_stats think stats were already built
+    await backfill_user_stats()
+    created = await ensure_user_stats_rows()
+    
+    keyed = 0
+    cursor = db.users.find({"search_keys": {"$exists": False}}, {"_id": 0, "id": 1, "name": 1, "email": 1})
+    while batch := await cursor.to_list(1000):
+        result = await db.users.bulk_write([
+            UpdateOne({"id": user["id"]}, {"$set": {"search_keys": user_search_keys(user.get("name") or "", user.get("email") or "")}})
+            for user in batch
+        ], ordered=False)
+        keyed += result.modified_count
+    
+    await db.migrations.update_one(
+        {"id": ADMIN_USER_LISTING_MIGRATION_ID},
+        {"$set": {"completed_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    logger.info(f"Admin user listing backfill completed: {created} stats rows created, {keyed} users keyed")
+
+def encode_cursor(sort_value, last_id: str) -> str:
+    """Encode the last row's (sort value, id) pair as an opaque keyset cursor"""
+    return base64.urlsafe_b64encode(json_util.dumps([sort_value, last_id]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a keyset cursor, raise 400 if it was not produced by encode_cursor"""
+    try:
+        sort_value, last_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return sort_value, last_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_filter(field: str, sort_value, last_id: str, direction: int, tie_field: str = "id") -> dict:
+    """Match rows strictly after (sort_value, last_id) in a (field, tie_field) sort; missing values sort lowest"""
+    op = "$gt" if direction == 1 else "$lt"
+    if sort_value is None:
+        tie = {field: None, tie_field: {op: last_id}}
+        return {"$or": [tie, {field: {"$ne": None}}]} if direction == 1 else tie
+    branches = [{field: {op: sort_value}}, {field: sort_value, tie_field: {op: last_id}}]
+    if direction == -1:
+        branches.append({field: None})
+    # Legacy ISO strings sort before BSON dates until the datetime migration has run
+    if isinstance(sort_value, datetime) and direction == -1:
+        branches.append({field: {"$type": "string"}})
+    elif isinstance(sort_value, str) and direction == 1:
+        branches.append({field: {"$type": "date"}})
+    return {"$or": branches}
+
+# GDPR Audit Logging Function
+async def log_audit(
+    user_id: str,
+    action: str,
+    resource_type: str,
+    request: Request,
+    resource_id: Optional[str] = None,
+    details: Optional[dict] = None,
+    durable: bool = False
+):
+    """
+    Log GDPR-relevant actions for audit trail (queued; audit_writer inserts them in batches).
+    durable=True inserts the entry before returning, for entries a following step relies on.
+    """
+    try:
+        audit_entry = AuditLog(
+            user_id=user_id,
+            action=action,
+            resource_type=resource_type,
+            resource_id=resource_id,
+            ip_address=request.client.host if request.client else None,
+            user_agent=request.headers.get("user-agent"),
+            details=details
+        )
+        
+        if durable:
+            await db.audit_logs.insert_one(audit_log_document(audit_entry))
+        else:
+            await audit_writer.write(audit_log_document(audit_entry))
+        
+        logger.info(f"Audit log: user={user_id}, action={action}, resource={resource_type}")
+    except Exception as e:
+        logger.error(f"Failed to log audit entry: {str(e)}", exc_info=True)
+        # Don't fail the request if audit logging fails
+
+_mongo_version: Optional[tuple] = None
+
+async def mongo_version() -> tuple:
+    """(major, minor) of the MongoDB server, read once per process"""
+    global _mongo_version
+    if _mongo_version is None:
+        info = await db.command("buildInfo")
+        _mongo_version = tuple(info["versionArray"][:2])
+    return _mongo_version
+
+def audit_log_document(entry: AuditLog) -> dict:
+    """Stored shape of an audit entry: user_id and action form the time-series meta"""
+    doc = entry.model_dump(exclude={"user_id", "action"})
+    doc["meta"] = {"user_id": entry.user_id, "action": entry.action}
+    return doc
+
+def audit_log_view(doc: dict) -> dict:
+    """Flat AuditLog fields of a stored entry"""
+    view = {key: value for key, value in doc.items() if key != "meta"}
+    view.update(doc.get("meta") or {})
+    return view
+
+async def unwritten_audit_entries(docs: List[dict]) -> List[dict]:
+    """The documents (with _ids) not yet in audit_logs; bounding timestamp lets Mongo skip other buckets"""
+    timestamps = [doc["timestamp"] for doc in docs]
+    written = {
+        doc["_id"] async for doc in db.audit_logs.find(
+            {"timestamp": {"$gte": min(timestamps), "$lte": max(timestamps)}, "_id": {"$in": [doc["_id"] for doc in docs]}},
+            {"_id": 1}
+        )
+    }
+    return [doc for doc in docs if doc["_id"] not in written]
+
+async def legacy_audit_collections() -> List[str]:
+    """Plain audit collections still waiting for migrate_legacy_audit_logs"""
+    return await legacy_collections(db, "audit_logs")
+
+async def plain_audit_collections() -> List[str]:
+    """
+    Plain collections holding audit entries: the legacy ones, plus audit_logs itself until it
+    is converted. Their entries may be flat (older releases) or in the meta shape.
+    """
+    names = await legacy_audit_collections()
+    if not await is_time_series(db, "audit_logs"):
+        names.append("audit_logs")
+    return names
+
+def plain_audit_filter(user_id: str) -> dict:
+    return {"$or": [{"user_id": user_id}, {"meta.user_id": user_id}]}
+
+# Audit Log Migration
+# The conversion (POST /api/admin/migrations/audit-logs or `db_indexes.py --convert-time-series`,
+# once every worker runs this release) replaces a plain audit_logs with a time-series collection
+# and keeps the old one as audit_logs_legacy_*. Its entries are copied over batch by batch and
+# removed from the source once written, so a restarted migration continues with what is left;
+# entries already past retention are dropped instead of copied. Readers include the legacy
+# collections until then.
+AUDIT_MIGRATION_ID = "audit_logs_time_series"
+
+async def migrate_legacy_audit_logs(name: str) -> int:
+    """
+    Move one legacy collection's entries into audit_logs, then drop it. Entries without a usable
+    timestamp cannot go into a time-series collection; they are skipped, counted and left in the
+    legacy collection (still read by the GDPR export and deletion) for manual review.
+    """
+    source = db[name]
+    moved = 0
+    last_id = None
+    while True:
+        if not await acquire_lease(AUDIT_MIGRATION_ID, AUDIT_MIGRATION_LEASE_SECONDS):
+            raise RuntimeError("Audit log migration lease lost to another worker")
+        
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await source.find(query).sort("_id", 1).limit(AUDIT_MIGRATION_BATCH_SIZE).to_list(AUDIT_MIGRATION_BATCH_SIZE)
+        if not batch:
+            left = await source.count_documents({})
+            if left:
+                logger.warning(f"Audit log migration left {left} entries without a usable timestamp in {name}")
+            else:
+                await source.drop()
+            return moved
+        last_id = batch[-1]["_id"]
+        
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=AUDIT_LOG_RETENTION_SECONDS)
+        docs, expired, skipped = [], 0, set()
+        for doc in batch:
+            try:
+                timestamp = as_datetime(doc.get("timestamp"))
+            except (ValueError, TypeError):
+                timestamp = None
+            if timestamp is None:
+                logger.warning(f"Skipping audit entry without a usable timestamp in {name} on _id={doc['_id']}: {doc.get('timestamp')!r}")
+                skipped.add(doc["_id"])
+                continue
+            if timestamp < cutoff:
+                expired += 1
+                continue  # The TTL would remove it right away
+            doc["timestamp"] = timestamp
+            if "meta" not in doc:  # Written flat by an older release
+                doc["meta"] = {"user_id": doc.pop("user_id", None), "action": doc.pop("action", None)}
+            docs.append(doc)
+        if docs:
+            # A batch interrupted before its delete below is partly in audit_logs already
+            docs = await unwritten_audit_entries(docs)
+        if docs:
+            await db.audit_logs.insert_many(docs, ordered=False)
+        await source.delete_many({"_id": {"$in": [doc["_id"] for doc in batch if doc["_id"] not in skipped]}})
+        
+        moved += len(docs)
+        await db.migrations.update_one(
+            {"id": AUDIT_MIGRATION_ID},
+            {
+                "$set": {"updated_at": datetime.now(timezone.utc)},
+                "$inc": {"moved": len(docs), "expired": expired, "skipped": len(skipped)}
+            },
+            upsert=True
+        )
+        await asyncio.sleep(AUDIT_MIGRATION_PAUSE_SECONDS)
+
+async def run_audit_log_migration():
+    """Migrate every legacy audit collection; no-op when there is none"""
+    names = await legacy_audit_collections()
+    if not names:
+        return
+    if not await acquire_lease(AUDIT_MIGRATION_ID, AUDIT_MIGRATION_LEASE_SECONDS):
+        return  # Another worker is running it
+    
     try:
-        audit_entry = AuditLog(
-            user_id=user_id,
-            action=action,
-            resource_type=resource_type,
-            resource_id=resource_id,
-            ip_address=request.client.host if request.client else None,
-            user_agent=request.headers.get("user-agent"),
-            details=details
+        moved = 0
+        for name in names:
+            moved += await migrate_legacy_audit_logs(name)
+        await db.migrations.update_one(
+            {"id": AUDIT_MIGRATION_ID},
+            {"$set": {"completed_at": datetime.now(timezone.utc)}},
+            upsert=True
         )
-        
-        doc = audit_entry.model_dump()
-        doc['timestamp'] = doc['timestamp'].isoformat()
-        await db.audit_logs.insert_one(doc)
-        
-        logger.info(f"Audit log: user={user_id}, action={action}, resource={resource_type}")
-    except Exception as e:
-        logger.error(f"Failed to log audit entry: {str(e)}", exc_info=True)
-        # Don't fail the request if audit logging fails
+        logger.info(f"Audit log migration completed: {moved} entries moved from {', '.join(names)}")
+    finally:
+        await release_lease(AUDIT_MIGRATION_ID)
 
 # Phone Verification & Referral Helper Functions
 def generate_referral_code() -> str:
@@ -1167,9 +3630,9 @@ async def send_sms_verification(phone_number: str, code: str) -> bool:
     """
     try:
         # Get SMS settings
-        settings = await db.settings.find_one({"id": "global"}, {"_id": 0})
+        settings = await settings_service.get()
         
-        if not settings or not settings.get("sms_enabled", False):
+        if not settings.get("sms_enabled", False):
             # MOCK mode
             logger.info(f"[MOCK SMS] Sending verification code {code} to {phone_number}")
             return True
@@ -1189,7 +3652,7 @@ async def send_sms_verification(phone_number: str, code: str) -> bool:
         logger.error(f"Error sending SMS: {str(e)}", exc_info=True)
         return False
 
-async def send_sms_aws_sns(phone_number: str, code: str, settings: dict) -> bool:
+async def send_sms_aws_sns(phone_number: str, code: str, settings: MappingProxyType) -> bool:
     """Send SMS via AWS SNS"""
     aws_access_key = settings.get("aws_access_key_id")
     aws_secret_key = settings.get("aws_secret_access_key")
@@ -1239,7 +3702,7 @@ async def send_sms_aws_sns(phone_number: str, code: str, settings: dict) -> bool
         logger.error(f"AWS SNS error: {str(e)}", exc_info=True)
         return False
 
-async def send_sms_smsmanager(phone_number: str, code: str, settings: dict) -> bool:
+async def send_sms_smsmanager(phone_number: str, code: str, settings: MappingProxyType) -> bool:
     """Send SMS via SMSmanager.cz"""
     api_key = settings.get("smsmanager_api_key")
     gateway = settings.get("smsmanager_gateway")
@@ -1288,104 +3751,303 @@ def validate_czech_phone(phone_number: str) -> bool:
     pattern = r'^\+420[1-9][0-9]{8}$'
     return bool(re.match(pattern, phone_number))
 
+# Leases
+# A lease lets one worker (across uvicorn processes) own a maintenance job; it lapses if the owner dies
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+async def acquire_lease(name: str, ttl_seconds: float) -> bool:
+    """Take or renew the named lease; False if another live worker holds it"""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.leases.find_one_and_update(
+            {"id": name, "$or": [{"owner": WORKER_ID}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=ttl_seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False  # Lease document exists and is held by someone else
+
+async def release_lease(name: str):
+    await db.leases.delete_one({"id": name, "owner": WORKER_ID})
+
+# Datetime Migration
+# Timestamp fields that were written as ISO strings before they became BSON dates
+DATETIME_FIELDS = {
+    "users": ("created_at", "last_login", "last_login_at", "phone_verification_expires"),
+    "token_transactions": ("created_at",),
+    "generated_prompts": ("created_at",),
+    "phone_verifications": ("created_at", "expires_at"),
+    "settings": ("updated_at",),
+    "status_checks": ("timestamp",),
+    "user_stats": ("updated_at",),
+    "token_rollups": ("updated_at",),
+}
+DATETIME_MIGRATION_ID = "native_datetimes"
+
+async def migrate_collection_datetimes(collection: str, fields: tuple) -> int:
+    """
+    Convert one collection in _id order, batch by batch. Each value is only replaced
+    if it still holds the string that was read, so concurrent writes are never clobbered.
+    The last _id is checkpointed after every batch, so an interrupted run resumes there.
+    """
+    state = await db.migrations.find_one({"id": DATETIME_MIGRATION_ID}, {"_id": 0}) or {}
+    last_id = state.get("checkpoints", {}).get(collection)
+    converted = 0
+    
+    while True:
+        if not await acquire_lease(DATETIME_MIGRATION_ID, DATETIME_MIGRATION_LEASE_SECONDS):
+            raise RuntimeError("Datetime migration lease lost to another worker")
+        
+        query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db[collection].find(query, {field: 1 for field in fields}).sort("_id", 1).to_list(DATETIME_MIGRATION_BATCH_SIZE)
+        if not batch:
+            return converted
+        
+        operations = []
+        for doc in batch:
+            for field in fields:
+                value = doc.get(field)
+                if not isinstance(value, str):
+                    continue
+                try:
+                    parsed = as_datetime(value)
+                except ValueError:
+                    logger.warning(f"Skipping unparseable {collection}.{field} on _id={doc['_id']}: {value!r}")
+                    continue
+                operations.append(UpdateOne({"_id": doc["_id"], field: value}, {"$set": {field: parsed}}))
+        modified = 0
+        if operations:
+            modified = (await db[collection].bulk_write(operations, ordered=False)).modified_count
+            converted += modified
+        
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"id": DATETIME_MIGRATION_ID},
+            {
+                "$set": {f"checkpoints.{collection}": last_id, "updated_at": datetime.now(timezone.utc)},
+                "$inc": {f"converted.{collection}": modified}
+            },
+            upsert=True
+        )
+        await asyncio.sleep(DATETIME_MIGRATION_PAUSE_SECONDS)
+
+async def run_datetime_migration():
+    """Convert legacy ISO-string timestamps in every collection; no-op once completed"""
+    state = await db.migrations.find_one({"id": DATETIME_MIGRATION_ID}, {"_id": 0, "completed_at": 1})
+    if state and state.get("completed_at"):
+        return
+    if not await acquire_lease(DATETIME_MIGRATION_ID, DATETIME_MIGRATION_LEASE_SECONDS):
+        return  # Another worker is running it
+    
+    try:
+        total = 0
+        for collection, fields in DATETIME_FIELDS.items():
+            total += await migrate_collection_datetimes(collection, fields)
+        await db.migrations.update_one(
+            {"id": DATETIME_MIGRATION_ID},
+            {"$set": {"completed_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        logger.info(f"Datetime migration completed: {total} values converted")
+    finally:
+        await release_lease(DATETIME_MIGRATION_ID)
+
+# Admin Overview Snapshot
+async def compute_admin_overview() -> dict:
+    """Compute the admin dashboard metrics (the expensive part behind /api/admin/overview)"""
+    total_users = await db.users.count_documents({})
+    
+    # Calculate revenue (estimate based on locked prices)
+    revenue = await db.users.aggregate([
+        {"$group": {
+            "_id": None,
+            "total": {"$sum": {"$add": [
+                {"$ifNull": ["$locked_price_99", 0]},
+                {"$ifNull": ["$locked_price_399", 0]}
+            ]}}
+        }}
+    ]).to_list(1)
+    total_revenue = revenue[0]["total"] if revenue else 0
+    
+    # Activity metrics from the daily HyperLogLog sketches (UTC calendar days)
+    active_24h = await active_users.count_last_days(1)
+    active_7d = await active_users.count_last_days(7)
+    
+    # Token consumption analytics from the pre-aggregated rollups
+    totals = await db.token_rollups.find_one({"period": "all", "bucket": "all"}, {"_id": 0}) or {}
+    metered_transactions = totals.get("metered_transactions", 0)
+    avg_tokens_per_agent = (
+        totals.get("openai_tokens", 0) / metered_transactions
+        if metered_transactions else 0
+    )
+    
+    async def describe_usage(usage: Optional[dict]) -> Optional[dict]:
+        if not usage:
+            return None
+        usage_user = await db.users.find_one({"id": usage["user_id"]}, {"_id": 0, "name": 1, "email": 1})
+        return {
+            "tokens": usage["tokens"],
+            "user_name": usage_user["name"] if usage_user else "Unknown",
+            "user_email": usage_user["email"] if usage_user else "Unknown",
+            "agent_name": usage.get("description") or "N/A"
+        }
+    
+    min_consumption = await describe_usage(totals.get("min_usage"))
+    max_consumption = await describe_usage(totals.get("max_usage"))
+    
+    # Token history by day (last 30 days with usage)
+    days = await db.token_rollups.find(
+        {"period": "day", "openai_tokens": {"$gt": 0}},
+        {"_id": 0, "bucket": 1, "openai_tokens": 1}
+    ).sort("bucket", -1).to_list(30)
+    token_history = [
+        {"day": day["bucket"], "tokens": day["openai_tokens"]}
+        for day in reversed(days)
+    ]
+    
+    return {
+        "total_revenue": total_revenue,
+        "total_users": total_users,
+        "active_users_24h": active_24h,
+        "active_users_7d": active_7d,
+        "avg_tokens_per_agent": round(avg_tokens_per_agent, 2),
+        "min_consumption": min_consumption,
+        "max_consumption": max_consumption,
+        "token_history": token_history,
+        "generated_at": datetime.now(timezone.utc)
+    }
+
+class OverviewSnapshot:
+    """
+    Admin overview served from memory and refreshed in the background.
+    The latest snapshot is also stored in Mongo, so a worker whose copy is
+    older than the refresh interval first adopts a newer one written by
+    another worker and only recomputes when none is fresh enough - admin
+    tabs polling the overview no longer multiply the work.
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[dict] = None
+        self.refreshes = 0
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    async def interval_seconds() -> int:
+        settings = await settings_service.get()
+        return max(OVERVIEW_REFRESH_MIN_SECONDS, settings.get("overview_refresh_seconds", 60))
+
+    @staticmethod
+    def _age_seconds(snapshot: Optional[dict]) -> float:
+        if not snapshot:
+            return float("inf")
+        generated_at = as_datetime(snapshot["generated_at"])
+        return (datetime.now(timezone.utc) - generated_at).total_seconds()
+
+    async def get(self, fresh: bool = False) -> dict:
+        if fresh or self._snapshot is None:
+            await self.refresh(force=fresh)
+        return self._snapshot
+
+    async def refresh(self, force: bool = False):
+        async with self._lock:
+            interval = await self.interval_seconds()
+            if not force and self._age_seconds(self._snapshot) < interval:
+                return
+            if not force:
+                stored = await db.admin_snapshots.find_one({"id": "overview"}, {"_id": 0})
+                if stored and self._age_seconds(stored["data"]) < interval:
+                    self._snapshot = stored["data"]
+                    return
+            snapshot = await compute_admin_overview()
+            await db.admin_snapshots.update_one(
+                {"id": "overview"},
+                {"$set": {"data": snapshot}},
+                upsert=True
+            )
+            self._snapshot = snapshot
+            self.refreshes += 1
+
+    async def run(self):
+        """Background refresher: re-reads the interval from settings every cycle"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Admin overview refresh failed: {str(e)}", exc_info=True)
+            await asyncio.sleep(await self.interval_seconds())
+
+    def stats(self) -> dict:
+        return {
+            "generated_at": self._snapshot["generated_at"] if self._snapshot else None,
+            "refreshes": self.refreshes
+        }
+
+overview_snapshot = OverviewSnapshot()
+
 # Admin Endpoints
 @api_router.get("/admin/overview", response_model=AdminOverviewResponse)
-async def get_admin_overview(request: Request):
+async def get_admin_overview(request: Request, fresh: bool = False):
     """
     Get admin dashboard overview with analytics and metrics.
+    Served from the background-refreshed snapshot; ?fresh=1 forces recomputation.
     Requires admin authentication.
     """
     await require_admin(request)
     
     try:
-        # Get all users
-        users = await db.users.find({}, {"_id": 0}).to_list(10000)
-        total_users = len(users)
-        
-        # Calculate revenue (estimate based on locked prices)
-        total_revenue = sum(
-            (user.get("locked_price_99", 0) or 0) + 
-            (user.get("locked_price_399", 0) or 0) 
-            for user in users
-        )
-        
-        # Activity metrics
-        now = datetime.now(timezone.utc)
-        active_24h = sum(
-            1 for user in users 
-            if user.get("last_login_at") and 
-            datetime.fromisoformat(user["last_login_at"]) >= now - timedelta(hours=24)
-        )
-        active_7d = sum(
-            1 for user in users 
-            if user.get("last_login_at") and 
-            datetime.fromisoformat(user["last_login_at"]) >= now - timedelta(days=7)
-        )
+        return AdminOverviewResponse(**await overview_snapshot.get(fresh=fresh))
         
-        # Token consumption analytics
-        transactions = await db.token_transactions.find(
-            {"transaction_type": "usage"},
-            {"_id": 0}
-        ).to_list(10000)
-        
-        # Calculate avg tokens per agent
-        usage_transactions = [t for t in transactions if t.get("openai_tokens_used")]
-        avg_tokens_per_agent = (
-            sum(t["openai_tokens_used"] for t in usage_transactions) / len(usage_transactions)
-            if usage_transactions else 0
-        )
+    except Exception as e:
+        logger.error(f"Error getting admin overview: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.get("/admin/active-users")
+async def get_active_users(
+    request: Request,
+    start_day: Optional[str] = None,
+    end_day: Optional[str] = None
+):
+    """
+    Estimated distinct active users (login or authenticated activity) for DAU/WAU/MAU,
+    plus an optional custom window of UTC days (YYYY-MM-DD, inclusive).
+    Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    try:
+        result = {
+            "dau": await active_users.count_last_days(1),
+            "wau": await active_users.count_last_days(7),
+            "mau": await active_users.count_last_days(30)
+        }
         
-        # Find min/max consumption
-        min_consumption = None
-        max_consumption = None
-        if usage_transactions:
-            min_trans = min(usage_transactions, key=lambda t: t["openai_tokens_used"])
-            max_trans = max(usage_transactions, key=lambda t: t["openai_tokens_used"])
-            
-            # Get user names
-            min_user = await db.users.find_one({"id": min_trans["user_id"]}, {"_id": 0, "name": 1, "email": 1})
-            max_user = await db.users.find_one({"id": max_trans["user_id"]}, {"_id": 0, "name": 1, "email": 1})
-            
-            min_consumption = {
-                "tokens": min_trans["openai_tokens_used"],
-                "user_name": min_user["name"] if min_user else "Unknown",
-                "user_email": min_user["email"] if min_user else "Unknown",
-                "agent_name": min_trans.get("description", "N/A")
-            }
-            max_consumption = {
-                "tokens": max_trans["openai_tokens_used"],
-                "user_name": max_user["name"] if max_user else "Unknown",
-                "user_email": max_user["email"] if max_user else "Unknown",
-                "agent_name": max_trans.get("description", "N/A")
+        if start_day or end_day:
+            today = datetime.now(timezone.utc).date()
+            try:
+                start = datetime.strptime(start_day, "%Y-%m-%d").date() if start_day else today
+                end = datetime.strptime(end_day, "%Y-%m-%d").date() if end_day else today
+            except ValueError:
+                raise HTTPException(status_code=400, detail="start_day and end_day must be YYYY-MM-DD")
+            if start > end or (end - start).days >= ACTIVE_USERS_MAX_WINDOW_DAYS:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Window must be 1-{ACTIVE_USERS_MAX_WINDOW_DAYS} days with start_day <= end_day"
+                )
+            result["window"] = {
+                "start_day": start.isoformat(),
+                "end_day": end.isoformat(),
+                "active_users": await active_users.count(start.isoformat(), end.isoformat())
             }
         
-        # Token history by day (last 30 days)
-        from collections import defaultdict
-        token_by_day = defaultdict(int)
-        for trans in usage_transactions:
-            if trans.get("created_at"):
-                day = datetime.fromisoformat(trans["created_at"]).date().isoformat()
-                token_by_day[day] += trans["openai_tokens_used"]
-        
-        # Convert to sorted list
-        token_history = [
-            {"day": day, "tokens": tokens}
-            for day, tokens in sorted(token_by_day.items())[-30:]
-        ]
-        
-        return AdminOverviewResponse(
-            total_revenue=total_revenue,
-            total_users=total_users,
-            active_users_24h=active_24h,
-            active_users_7d=active_7d,
-            avg_tokens_per_agent=round(avg_tokens_per_agent, 2),
-            min_consumption=min_consumption,
-            max_consumption=max_consumption,
-            token_history=token_history
-        )
+        return result
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error getting admin overview: {str(e)}", exc_info=True)
+        logger.error(f"Error counting active users: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @api_router.get("/admin/users")
@@ -1393,94 +4055,122 @@ async def get_admin_users(
     request: Request,
     search: Optional[str] = None,
     sort_by: Optional[str] = "created_at",
-    sort_dir: Optional[str] = "desc"
+    sort_dir: Optional[str] = "desc",
+    limit: int = ADMIN_USERS_PAGE_SIZE,
+    cursor: Optional[str] = None
 ):
     """
-    Get list of all users with computed metrics for admin management.
+    Get a page of users with computed metrics for admin management.
+    Sorted server-side on an indexed user field or usage aggregate; pass next_cursor back to get
+    the following page. search matches name and email words by prefix, ignoring case and diacritics.
     Requires admin authentication.
     """
     await require_admin(request)
     
     try:
-        # Get all users
-        query = {}
-        if search:
-            query = {
-                "$or": [
-                    {"name": {"$regex": search, "$options": "i"}},
-                    {"email": {"$regex": search, "$options": "i"}}
-                ]
-            }
-        
-        users = await db.users.find(query, {"_id": 0}).to_list(10000)
-        
-        # Sort by created_at to assign sequence IDs
-        users_sorted_by_registration = sorted(
-            users, 
-            key=lambda x: datetime.fromisoformat(x["created_at"]) if isinstance(x["created_at"], str) else x["created_at"]
-        )
-        
-        # Assign sequence IDs (admin is always 1, then 2, 3, 4...)
-        sequence_map = {}
-        next_non_admin_id = 2
-        
-        # First pass: assign 1 to admin
-        for user in users_sorted_by_registration:
-            if user.get("is_admin"):
-                sequence_map[user["id"]] = 1
+        stats_sort = sort_by in ADMIN_USER_STATS_SORT_FIELDS
+        if sort_by not in ADMIN_USER_SORT_FIELDS and not stats_sort:
+            raise HTTPException(
+                status_code=400,
+                detail=f"sort_by must be one of: {', '.join(ADMIN_USER_SORT_FIELDS + ADMIN_USER_STATS_SORT_FIELDS)}"
+            )
+        direction = 1 if sort_dir == "asc" else -1
+        limit = max(1, min(limit, ADMIN_USERS_MAX_PAGE_SIZE))
         
-        # Second pass: assign sequential IDs to non-admins
-        for user in users_sorted_by_registration:
-            if not user.get("is_admin"):
-                sequence_map[user["id"]] = next_non_admin_id
-                next_non_admin_id += 1
+        # Anchored, case-sensitive prefixes of the folded words can use the search_keys index
+        search_conditions = [
+            {"search_keys": {"$regex": f"^{re.escape(fold_text(word))}"}}
+            for word in (search or "").split()[:ADMIN_USERS_SEARCH_MAX_WORDS]
+        ]
+        after = decode_cursor(cursor) if cursor else None
+        sort_value = {"$ifNull": [f"$stats.{sort_by}", 0]} if stats_sort else f"${sort_by}"
+        # Each branch leaves the user's stats row (if any) in a `stats` field
+        stats_lookup = [
+            {"$lookup": {
+                "from": "user_stats",
+                "localField": "id",
+                "foreignField": "user_id",
+                "as": "stats"
+            }},
+            {"$addFields": {"stats": {"$first": "$stats"}}}
+        ]
         
-        # Compute metrics for each user
-        result = []
+        if stats_sort and not search_conditions:
+            # Page the stats rows on their (field, user_id) index and join each user as it is reached
+            pipeline = [
+                {"$match": keyset_filter(sort_by, *after, direction, tie_field="user_id") if after else {}},
+                {"$sort": {sort_by: direction, "user_id": direction}},
+                {"$lookup": {"from": "users", "localField": "user_id", "foreignField": "id", "as": "user"}},
+                {"$unwind": "$user"},
+                {"$addFields": {"user.stats": {field: f"${field}" for field in USER_STATS_FIELDS}}},
+                {"$replaceRoot": {"newRoot": "$user"}},
+                {"$limit": limit + 1}
+            ]
+            source = db.user_stats
+        elif stats_sort:
+            # A search matches few users: join their stats, then sort the matches on the aggregate
+            pipeline = [
+                {"$match": {"$and": search_conditions}},
+                *stats_lookup,
+                {"$addFields": {"sort_value": sort_value}},
+                {"$match": keyset_filter("sort_value", *after, direction) if after else {}},
+                {"$sort": {"sort_value": direction, "id": direction}},
+                {"$limit": limit + 1}
+            ]
+            source = db.users
+        else:
+            conditions = search_conditions + ([keyset_filter(sort_by, *after, direction)] if after else [])
+            # One round trip: page of users joined with their materialized usage stats
+            pipeline = [
+                {"$match": {"$and": conditions} if conditions else {}},
+                {"$sort": {sort_by: direction, "id": direction}},
+                {"$limit": limit + 1},
+                *stats_lookup
+            ]
+            source = db.users
+        pipeline.append({"$project": {
+            "_id": 0,
+            "id": 1,
+            "sequence_id": 1,
+            "name": 1,
+            "email": 1,
+            "is_banned": 1,
+            "omega_tokens_balance": 1,
+            "created_at": 1,
+            "sort_value": sort_value,
+            "last_login_at": {"$ifNull": ["$last_login_at", "$last_login"]},
+            "agents_count": {"$ifNull": ["$stats.agents_count", 0]},
+            "total_tokens_consumed": {"$ifNull": ["$stats.total_tokens_consumed", 0]},
+            "max_openai_tokens": "$stats.max_openai_tokens"
+        }})
+        users = await source.aggregate(pipeline).to_list(limit + 1)
+        
+        next_cursor = None
+        if len(users) > limit:
+            users = users[:limit]
+            last = users[-1]
+            next_cursor = encode_cursor(last.get("sort_value"), last["id"])
+        
+        items = []
         for user in users:
-            # Count agents
-            agents_count = await db.generated_prompts.count_documents({"user_id": user["id"]})
-            
-            # Get token consumption
-            transactions = await db.token_transactions.find(
-                {"user_id": user["id"], "transaction_type": "usage"},
-                {"_id": 0}
-            ).to_list(1000)
-            
-            total_tokens_consumed = sum(
-                abs(t["amount"]) for t in transactions
-            )
-            
-            # Find most expensive agent
-            most_expensive_agent = "N/A"
-            if transactions:
-                max_trans = max(
-                    (t for t in transactions if t.get("openai_tokens_used")),
-                    key=lambda t: t["openai_tokens_used"],
-                    default=None
-                )
-                if max_trans:
-                    most_expensive_agent = f"{max_trans['openai_tokens_used']} tokens"
-            
-            result.append({
+            max_openai_tokens = user.get("max_openai_tokens")
+            items.append({
                 "id": user["id"],
-                "sequence_id": sequence_map.get(user["id"], 0),
+                "sequence_id": user.get("sequence_id", 0),
                 "name": user["name"],
                 "email": user["email"],
                 "is_banned": user.get("is_banned", False),
                 "omega_tokens_balance": user["omega_tokens_balance"],
-                "agents_count": agents_count,
-                "total_tokens_consumed": total_tokens_consumed,
-                "most_expensive_agent": most_expensive_agent,
-                "last_login_at": user.get("last_login_at", user.get("last_login"))
+                "agents_count": user["agents_count"],
+                "total_tokens_consumed": user["total_tokens_consumed"],
+                "most_expensive_agent": f"{max_openai_tokens} tokens" if max_openai_tokens else "N/A",
+                "last_login_at": user.get("last_login_at")
             })
         
-        # Sort results
-        reverse = sort_dir == "desc"
-        result.sort(key=lambda x: x.get(sort_by, ""), reverse=reverse)
-        
-        return result
+        return {"items": items, "next_cursor": next_cursor}
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting admin users: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -1501,25 +4191,19 @@ async def get_admin_user_detail(user_id: str, request: Request):
         # Get user's agents
         prompts = await db.generated_prompts.find(
             {"user_id": user_id},
-            {"_id": 0}
+            {"_id": 0, "master_prompt_terms": 0}
         ).to_list(1000)
+        await resolve_master_prompts(prompts)
         
         # Convert prompts
         agents = []
         for prompt in prompts:
-            if isinstance(prompt['created_at'], str):
-                prompt['created_at'] = datetime.fromisoformat(prompt['created_at'])
+            prompt['created_at'] = as_datetime(prompt['created_at'])
             if isinstance(prompt['description'], dict):
                 prompt['description'] = AgentCharacteristics(**prompt['description'])
             agents.append(GeneratedPromptResponse(**prompt))
         
-        # Count agents and tokens
-        agents_count = len(agents)
-        transactions = await db.token_transactions.find(
-            {"user_id": user_id, "transaction_type": "usage"},
-            {"_id": 0}
-        ).to_list(1000)
-        total_tokens_consumed = sum(abs(t["amount"]) for t in transactions)
+        stats = await get_user_stats(user_id)
         
         return AdminUserDetailResponse(
             id=user["id"],
@@ -1528,11 +4212,11 @@ async def get_admin_user_detail(user_id: str, request: Request):
             picture=user.get("picture"),
             is_banned=user.get("is_banned", False),
             omega_tokens_balance=user["omega_tokens_balance"],
-            agents_count=agents_count,
-            total_tokens_consumed=total_tokens_consumed,
+            agents_count=stats["agents_count"],
+            total_tokens_consumed=stats["total_tokens_consumed"],
             agents=agents,
-            created_at=datetime.fromisoformat(user["created_at"]) if isinstance(user["created_at"], str) else user["created_at"],
-            last_login_at=datetime.fromisoformat(user.get("last_login_at", user.get("last_login"))) if isinstance(user.get("last_login_at", user.get("last_login")), str) else user.get("last_login_at", user.get("last_login"))
+            created_at=as_datetime(user["created_at"]),
+            last_login_at=as_datetime(user.get("last_login_at", user.get("last_login")))
         )
         
     except HTTPException:
@@ -1557,6 +4241,7 @@ async def ban_user(user_id: str, request: Request):
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
+        user_cache.invalidate(user_id)
         
         return {"message": "User banned successfully", "user_id": user_id}
         
@@ -1582,6 +4267,7 @@ async def unban_user(user_id: str, request: Request):
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
+        user_cache.invalidate(user_id)
         
         return {"message": "User unbanned successfully", "user_id": user_id}
         
@@ -1601,21 +4287,23 @@ async def adjust_user_tokens(user_id: str, adjustment: TokenAdjustmentRequest, r
     await require_admin(request)
     
     try:
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
+        # Atomic $inc so concurrent reserve/settle/release updates are never overwritten;
+        # a negative delta only applies if the balance stays non-negative
+        query = {"id": user_id}
+        if adjustment.delta < 0:
+            query["omega_tokens_balance"] = {"$gte": -adjustment.delta}
+        user = await db.users.find_one_and_update(
+            query,
+            {"$inc": {"omega_tokens_balance": adjustment.delta}},
+            projection={"_id": 0, "omega_tokens_balance": 1},
+            return_document=ReturnDocument.BEFORE
+        )
         if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        new_balance = user["omega_tokens_balance"] + adjustment.delta
-        
-        # Check non-negative constraint
-        if new_balance < 0:
+            if not await db.users.find_one({"id": user_id}, {"_id": 1}):
+                raise HTTPException(status_code=404, detail="User not found")
             raise HTTPException(status_code=400, detail="Token balance cannot be negative")
-        
-        # Update user balance
-        await db.users.update_one(
-            {"id": user_id},
-            {"$set": {"omega_tokens_balance": new_balance}}
-        )
+        user_cache.invalidate(user_id)
+        new_balance = user["omega_tokens_balance"] + adjustment.delta
         
         # Create transaction record
         transaction = TokenTransaction(
@@ -1627,8 +4315,8 @@ async def adjust_user_tokens(user_id: str, adjustment: TokenAdjustmentRequest, r
         )
         
         doc = transaction.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
         await db.token_transactions.insert_one(doc)
+        await update_user_stats(user_id, {"tokens_granted": adjustment.delta})
         
         return {
             "message": "Token balance adjusted successfully",
@@ -1637,10 +4325,220 @@ async def adjust_user_tokens(user_id: str, adjustment: TokenAdjustmentRequest, r
             "new_balance": new_balance
         }
         
-    except HTTPException:
-        raise
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error adjusting tokens: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.get("/admin/metrics")
+async def get_admin_metrics(request: Request):
+    """
+    Get in-process runtime metrics (caches, audit log queue) of the worker serving the request.
+    Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    return {
+        "user_cache": user_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "clarify_index": clarify_index.stats(),
+        "llm_pool": llm_pool.stats(),
+        "llm_calls": llm_metrics.stats(),
+        "settings": settings_service.stats(),
+        "overview": overview_snapshot.stats(),
+        "active_users": active_users.stats(),
+        "audit_writer": audit_writer.stats()
+    }
+
+@api_router.delete("/admin/cache/responses")
+async def purge_response_cache(request: Request):
+    """
+    Purge the clarify/optimize response cache (memory of this worker and the shared collection).
+    Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    try:
+        deleted = await response_cache.purge()
+        clarify_index.clear()
+        return {"message": "Response cache purged", "deleted": deleted}
+        
+    except Exception as e:
+        logger.error(f"Error purging response cache: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.post("/admin/user-stats/rebuild")
+async def rebuild_user_stats_endpoint(request: Request):
+    """
+    Rebuild the per-user usage aggregates from the raw prompt and transaction ledgers.
+    Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    try:
+        result = await rebuild_user_stats()
+        return {"message": "User stats rebuilt", **result}
+        
+    except Exception as e:
+        logger.error(f"Error rebuilding user stats: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.get("/admin/prompt-bodies")
+async def get_prompt_body_report(request: Request):
+    """
+    Storage report for content-addressed prompt bodies: deduplication and compression ratios.
+    Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    try:
+        return await prompt_body_report()
+        
+    except Exception as e:
+        logger.error(f"Error getting prompt body report: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.post("/admin/prompt-bodies/rebuild")
+async def rebuild_prompt_bodies_endpoint(request: Request):
+    """
+    Recount prompt body references and delete bodies no prompt points at.
+    Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    try:
+        result = await rebuild_prompt_body_refcounts()
+        return {"message": "Prompt body references rebuilt", **result}
+        
+    except Exception as e:
+        logger.error(f"Error rebuilding prompt body references: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.get("/admin/token-rollups")
+async def get_token_rollups(request: Request, period: Literal["day", "hour"] = "day", limit: int = 30):
+    """
+    Get the most recent daily or hourly token usage rollups (oldest first).
+    Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    try:
+        limit = max(1, min(limit, 24 * 90))
+        rollups = await db.token_rollups.find(
+            {"period": period},
+            {"_id": 0, "period": 0, "updated_at": 0}
+        ).sort("bucket", -1).to_list(limit)
+        return list(reversed(rollups))
+        
+    except Exception as e:
+        logger.error(f"Error getting token rollups: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.post("/admin/token-rollups/rebuild")
+async def rebuild_token_rollups_endpoint(request: Request):
+    """
+    Rebuild the daily/hourly token rollups from the usage transactions.
+    Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    try:
+        result = await rebuild_token_rollups()
+        return {"message": "Token rollups rebuilt", **result}
+        
+    except Exception as e:
+        logger.error(f"Error rebuilding token rollups: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.get("/admin/migrations/datetimes")
+async def get_datetime_migration_status(request: Request):
+    """
+    Progress of the ISO-string to BSON date migration, with remaining legacy values per collection.
+    Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    try:
+        state = await db.migrations.find_one({"id": DATETIME_MIGRATION_ID}, {"_id": 0, "checkpoints": 0}) or {}
+        remaining = {}
+        for collection, fields in DATETIME_FIELDS.items():
+            remaining[collection] = await db[collection].count_documents(
+                {"$or": [{field: {"$type": "string"}} for field in fields]}
+            )
+        return {
+            "converted": state.get("converted", {}),
+            "completed_at": state.get("completed_at"),
+            "remaining": remaining
+        }
+        
+    except Exception as e:
+        logger.error(f"Error getting datetime migration status: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.post("/admin/migrations/datetimes")
+async def restart_datetime_migration(request: Request):
+    """
+    Re-run the datetime migration from the start (e.g. after old workers wrote more ISO strings).
+    Runs in the background; poll GET /api/admin/migrations/datetimes for progress.
+    Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    try:
+        await db.migrations.update_one(
+            {"id": DATETIME_MIGRATION_ID},
+            {"$unset": {"completed_at": "", "checkpoints": ""}},
+            upsert=True
+        )
+        spawn_job(run_datetime_migration())
+        return {"message": "Datetime migration started"}
+        
+    except Exception as e:
+        logger.error(f"Error starting datetime migration: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.get("/admin/migrations/audit-logs")
+async def get_audit_log_migration_status(request: Request):
+    """
+    State of the audit_logs time-series conversion: whether audit_logs is a time-series
+    collection yet, entries left in legacy collections and the migration's counters.
+    Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    try:
+        state = await db.migrations.find_one({"id": AUDIT_MIGRATION_ID}, {"_id": 0}) or {}
+        return {
+            "time_series": await is_time_series(db, "audit_logs"),
+            "legacy": {name: await db[name].estimated_document_count() for name in await legacy_audit_collections()},
+            "moved": state.get("moved", 0),
+            "expired": state.get("expired", 0),
+            "skipped": state.get("skipped", 0),
+            "completed_at": state.get("completed_at")
+        }
+        
+    except Exception as e:
+        logger.error(f"Error getting audit log migration status: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.post("/admin/migrations/audit-logs")
+async def convert_audit_logs(request: Request):
+    """
+    Convert a plain audit_logs into a time-series collection and migrate its entries in the
+    background. Run it once every worker is on this release - an older worker would recreate a
+    plain audit_logs with its next write. Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    try:
+        await ensure_time_series_collections(db, convert=True)
+        await ensure_indexes(db)
+        spawn_job(run_audit_log_migration())
+        return {"message": "Audit log migration started"}
+        
     except Exception as e:
-        logger.error(f"Error adjusting tokens: {str(e)}", exc_info=True)
+        logger.error(f"Error converting audit logs: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @api_router.get("/admin/settings")
@@ -1652,17 +4550,8 @@ async def get_platform_settings(request: Request):
     await require_admin(request)
     
     try:
-        settings = await db.settings.find_one({"id": "global"}, {"_id": 0})
-        
-        if not settings:
-            # Create default settings if not exists
-            default_settings = PlatformSettings()
-            doc = default_settings.model_dump()
-            doc['updated_at'] = doc['updated_at'].isoformat()
-            await db.settings.insert_one(doc)
-            return default_settings
-        
-        return settings
+        # Served from the settings snapshot (created with defaults if not exists)
+        return dict(await settings_service.get())
         
     except Exception as e:
         logger.error(f"Error getting settings: {str(e)}", exc_info=True)
@@ -1677,30 +4566,30 @@ async def update_platform_settings(settings_update: PlatformSettingsUpdate, requ
     await require_admin(request)
     
     try:
-        # Get current settings or create default
-        current_settings = await db.settings.find_one({"id": "global"}, {"_id": 0})
-        
-        if not current_settings:
-            current_settings = PlatformSettings().model_dump()
-            current_settings['updated_at'] = current_settings['updated_at'].isoformat()
-            await db.settings.insert_one(current_settings)
-        
         # Update only provided fields
         update_data = {
             k: v for k, v in settings_update.model_dump(exclude_unset=True).items()
             if v is not None
         }
-        update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
-        
-        await db.settings.update_one(
-            {"id": "global"},
-            {"$set": update_data}
-        )
+        unknown_stages = set(update_data.get("stage_models", {})) - set(LLM_ROUTE_STAGES)
+        if unknown_stages:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown stages in stage_models: {', '.join(sorted(unknown_stages))}. Allowed: {', '.join(LLM_ROUTE_STAGES)}"
+            )
+        if update_data.get("overview_refresh_seconds", OVERVIEW_REFRESH_MIN_SECONDS) < OVERVIEW_REFRESH_MIN_SECONDS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"overview_refresh_seconds must be at least {OVERVIEW_REFRESH_MIN_SECONDS}"
+            )
+        update_data['updated_at'] = datetime.now(timezone.utc)
         
-        # Return updated settings
-        updated = await db.settings.find_one({"id": "global"}, {"_id": 0})
-        return updated
+        # Bumps the version so other workers reload their snapshot
+        updated = await settings_service.update(update_data)
+        return dict(updated)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating settings: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -1738,9 +4627,9 @@ async def request_phone_verification(phone_request: PhoneVerificationRequest):
             {"$set": {
                 "phone_number": phone_request.phone_number,
                 "verification_code": verification_code,
-                "expires_at": expires_at.isoformat(),
+                "expires_at": expires_at,  # BSON date - the TTL index removes expired codes
                 "attempts": 0,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }},
             upsert=True
         )
@@ -1782,7 +4671,7 @@ async def verify_phone_number(verify_request: PhoneVerificationCodeRequest, requ
             raise HTTPException(status_code=404, detail="Ověřovací kód nebyl nalezen")
         
         # Check expiration
-        expires_at = datetime.fromisoformat(verification["expires_at"])
+        expires_at = as_datetime(verification["expires_at"])
         if datetime.now(timezone.utc) > expires_at:
             await db.phone_verifications.delete_one({"phone_number": verify_request.phone_number})
             raise HTTPException(status_code=410, detail="Ověřovací kód vypršel")
@@ -1809,6 +4698,7 @@ async def verify_phone_number(verify_request: PhoneVerificationCodeRequest, requ
                 "phone_verified": True
             }}
         )
+        user_cache.invalidate(user_id)
         
         # Get updated user
         user_doc = await db.users.find_one({"id": user_id}, {"_id": 0})
@@ -1821,8 +4711,8 @@ async def verify_phone_number(verify_request: PhoneVerificationCodeRequest, requ
             referrer = await db.users.find_one({"id": referred_by_user_id}, {"_id": 0})
             if referrer and referrer.get("phone_verified", False):
                 # Get reward amount from settings
-                settings = await db.settings.find_one({"id": "global"}, {"_id": 0})
-                reward_tokens = settings.get("referral_reward_tokens", 10000) if settings else 10000
+                settings = await settings_service.get()
+                reward_tokens = settings.get("referral_reward_tokens", 10000)
                 
                 # Update referrer stats and balance
                 await db.users.update_one(
@@ -1834,6 +4724,7 @@ async def verify_phone_number(verify_request: PhoneVerificationCodeRequest, requ
                         }
                     }
                 )
+                user_cache.invalidate(referred_by_user_id)
                 
                 # Create reward transaction
                 referrer_new_balance = (await db.users.find_one({"id": referred_by_user_id}))["omega_tokens_balance"]
@@ -1845,8 +4736,8 @@ async def verify_phone_number(verify_request: PhoneVerificationCodeRequest, requ
                     description=f"Referral reward: {user_doc['name']} ({user_doc['email']})"
                 )
                 reward_doc = reward_transaction.model_dump()
-                reward_doc['created_at'] = reward_doc['created_at'].isoformat()
                 await db.token_transactions.insert_one(reward_doc)
+                await update_user_stats(referred_by_user_id, {"tokens_granted": reward_tokens})
                 
                 logger.info(f"Referral reward processed: {reward_tokens} tokens to {referred_by_user_id}")
         
@@ -1896,8 +4787,8 @@ async def get_referral_stats(request: Request):
         ).to_list(1000)
         
         # Get reward amount from settings
-        settings = await db.settings.find_one({"id": "global"}, {"_id": 0})
-        reward_per_referral = settings.get("referral_reward_tokens", 10000) if settings else 10000
+        settings = await settings_service.get()
+        reward_per_referral = settings.get("referral_reward_tokens", 10000)
         
         # Calculate rewards
         referred_users_list = []
@@ -1927,12 +4818,574 @@ async def get_referral_stats(request: Request):
         logger.error(f"Error getting referral stats: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
 
+# GDPR Export
+GDPR_NOTICE = "This export contains all personal data processed by Omega-Aurora Codex platform. You have the right to rectify, delete, or restrict processing of this data under GDPR Articles 16-18."
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, unseekable buffer for zipfile; drained between records so the archive streams"""
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.pending = 0
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.pending += len(data)
+        return len(data)
+    
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        self.pending = 0
+        return data
+
+def export_json(record: dict) -> str:
+    """One export record as a JSON line (BSON dates as ISO strings)"""
+    return json.dumps(record, ensure_ascii=False, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
+
+async def export_collection(collection: str, user_id: str, projection: dict, prepare=None):
+    """Yield a user's documents from one collection in batches, with no cap on the row count"""
+    batch = []
+    async for doc in db[collection].find({"user_id": user_id}, projection).batch_size(GDPR_EXPORT_BATCH_SIZE):
+        batch.append(doc)
+        if len(batch) == GDPR_EXPORT_BATCH_SIZE:
+            for record in (await prepare(batch) if prepare else batch):
+                yield record
+            batch = []
+    for record in (await prepare(batch) if prepare and batch else batch):
+        yield record
+
+async def export_audit_logs(user_id: str):
+    """
+    A user's audit entries: per-user buckets of the time-series collection, plus entries still in
+    a plain collection. Plain ones are read first - an entry moved meanwhile shows up in
+    audit_logs afterwards (at worst twice, never missing).
+    """
+    plain = await plain_audit_collections()
+    for name in plain:
+        async for doc in db[name].find(plain_audit_filter(user_id), {"_id": 0}).batch_size(GDPR_EXPORT_BATCH_SIZE):
+            yield audit_log_view(doc)
+    if "audit_logs" not in plain:
+        async for doc in db.audit_logs.find({"meta.user_id": user_id}, {"_id": 0}).batch_size(GDPR_EXPORT_BATCH_SIZE):
+            yield audit_log_view(doc)
+
+async def export_profile(user: dict):
+    yield {
+        "id": user["id"],
+        "email": user["email"],
+        "name": user["name"],
+        "picture": user.get("picture"),
+        "is_admin": user.get("is_admin", False),
+        "omega_tokens_balance": user["omega_tokens_balance"],
+        "created_at": user["created_at"],
+        "last_login_at": user.get("last_login_at")
+    }
+
+def gdpr_export_sections(user: dict) -> list:
+    """(name, record iterator) per exported dataset"""
+    return [
+        ("user_profile", export_profile(user)),
+        ("generated_prompts", export_collection(
+            "generated_prompts", user["id"], {"_id": 0, "master_prompt_terms": 0}, prepare=resolve_master_prompts
+        )),
+        ("token_transactions", export_collection("token_transactions", user["id"], {"_id": 0})),
+        ("audit_logs", export_audit_logs(user["id"])),
+    ]
+
+async def stream_gdpr_ndjson(user: dict):
+    """NDJSON export: a header line, then one {"type", "data"} line per record"""
+    buffer = [export_json({
+        "type": "export",
+        "export_date": datetime.now(timezone.utc),
+        "gdpr_notice": GDPR_NOTICE
+    }) + "\n"]
+    pending = len(buffer[0])
+    for name, records in gdpr_export_sections(user):
+        async for record in records:
+            line = export_json({"type": name, "data": record}) + "\n"
+            buffer.append(line)
+            pending += len(line)
+            if pending >= GDPR_EXPORT_CHUNK_BYTES:
+                yield "".join(buffer).encode("utf-8")
+                buffer, pending = [], 0
+    yield "".join(buffer).encode("utf-8")
+
+async def stream_gdpr_zip(user: dict):
+    """Zip export with one NDJSON file per dataset, compressed and emitted while the cursors are read"""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("README.txt", f"Export date: {datetime.now(timezone.utc).isoformat()}\n\n{GDPR_NOTICE}\n")
+        for name, records in gdpr_export_sections(user):
+            with archive.open(f"{name}.ndjson", mode="w", force_zip64=True) as entry:
+                async for record in records:
+                    entry.write((export_json(record) + "\n").encode("utf-8"))
+                    if sink.pending >= GDPR_EXPORT_CHUNK_BYTES:
+                        yield sink.drain()
+    yield sink.drain()
+
+def gdpr_export_filename(user_id: str, extension: str) -> str:
+    return f"omega-codex-data-{user_id[:8]}-{datetime.now(timezone.utc).strftime('%Y%m%d')}.{extension}"
+
+# GDPR Export Jobs
+# The archive is written to GDPR_EXPORT_DIR on the worker's host; the job id is the download handle
+def gdpr_export_job_view(job: dict) -> dict:
+    return {
+        "id": job["id"],
+        "status": job["status"],  # pending | running | completed | failed | expired
+        "created_at": job["created_at"],
+        "completed_at": job.get("completed_at"),
+        "expires_at": job.get("expires_at"),
+        "size_bytes": job.get("size_bytes", 0),
+        "error": job.get("error"),
+        "download_url": f"/api/gdpr/export/jobs/{job['id']}/download" if job["status"] == "completed" else None
+    }
+
+async def run_gdpr_export_job(job_id: str):
+    """Write a user's zip export to disk, recording progress on the job document"""
+    job = await db.gdpr_export_jobs.find_one({"id": job_id}, {"_id": 0})
+    user = await db.users.find_one({"id": job["user_id"]}, {"_id": 0}) if job else None
+    if not user:
+        await db.gdpr_export_jobs.update_one({"id": job_id}, {"$set": {"status": "failed", "error": "User not found"}})
+        return
+    
+    path = GDPR_EXPORT_DIR / f"{job_id}.zip"
+    partial = path.with_suffix(".part")
+    await db.gdpr_export_jobs.update_one(
+        {"id": job_id},
+        {"$set": {"status": "running", "worker": WORKER_ID, "updated_at": datetime.now(timezone.utc)}}
+    )
+    try:
+        GDPR_EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+        written = 0
+        with open(partial, "wb") as f:
+            async for chunk in stream_gdpr_zip(user):
+                await asyncio.to_thread(f.write, chunk)
+                written += len(chunk)
+                await db.gdpr_export_jobs.update_one(
+                    {"id": job_id},
+                    {"$set": {"size_bytes": written, "updated_at": datetime.now(timezone.utc)}}
+                )
+        partial.replace(path)
+        now = datetime.now(timezone.utc)
+        await db.gdpr_export_jobs.update_one(
+            {"id": job_id},
+            {"$set": {
+                "status": "completed",
+                "path": str(path),
+                "size_bytes": written,
+                "completed_at": now,
+                "updated_at": now,
+                "expires_at": now + timedelta(hours=GDPR_EXPORT_RETENTION_HOURS)
+            }}
+        )
+        logger.info(f"GDPR export job {job_id} completed: {written} bytes")
+    except Exception as e:
+        logger.error(f"GDPR export job {job_id} failed: {str(e)}", exc_info=True)
+        partial.unlink(missing_ok=True)
+        await db.gdpr_export_jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": "failed", "error": str(e), "updated_at": datetime.now(timezone.utc)}}
+        )
+
+def remove_gdpr_export_file(job: dict):
+    for path in (GDPR_EXPORT_DIR / f"{job['id']}.zip", GDPR_EXPORT_DIR / f"{job['id']}.part"):
+        path.unlink(missing_ok=True)
+
+async def sweep_gdpr_export_jobs():
+    """Delete expired archives and fail jobs whose worker stopped making progress"""
+    now = datetime.now(timezone.utc)
+    async for job in db.gdpr_export_jobs.find(
+        {"status": "completed", "expires_at": {"$lt": now}},
+        {"_id": 0, "id": 1}
+    ):
+        remove_gdpr_export_file(job)
+        await db.gdpr_export_jobs.update_one({"id": job["id"]}, {"$set": {"status": "expired"}, "$unset": {"path": ""}})
+    
+    stale = await db.gdpr_export_jobs.update_many(
+        {"status": {"$in": ["pending", "running"]}, "updated_at": {"$lt": now - timedelta(seconds=GDPR_EXPORT_STALE_SECONDS)}},
+        {"$set": {"status": "failed", "error": "Export was interrupted", "updated_at": now}}
+    )
+    if stale.modified_count:
+        logger.warning(f"Marked {stale.modified_count} interrupted GDPR export jobs as failed")
+
+async def delete_gdpr_exports(user_id: str):
+    """Remove a user's export archives and job records"""
+    async for job in db.gdpr_export_jobs.find({"user_id": user_id}, {"_id": 0, "id": 1}):
+        remove_gdpr_export_file(job)
+    await db.gdpr_export_jobs.delete_many({"user_id": user_id})
+
+# GDPR Deletion Jobs
+# Each step handles one bounded batch per call and returns how many documents it processed; 0 means
+# the step is finished. A batch only selects documents still holding the user's id, so re-running
+# a step after a crash simply continues with whatever is left. The anonymized ids are fixed when the
+# job is created, so a resumed job keeps grouping the user's records under the same alias.
+async def delete_prompts_batch(job: dict) -> int:
+    batch = await db.generated_prompts.find(
+        {"user_id": job["user_id"]},
+        {"_id": 1, "master_prompt_hash": 1}
+    ).limit(GDPR_DELETION_BATCH_SIZE).to_list(GDPR_DELETION_BATCH_SIZE)
+    if not batch:
+        return 0
+    refs: Dict[str, int] = {}
+    for doc in batch:
+        if doc.get("master_prompt_hash"):
+            refs[doc["master_prompt_hash"]] = refs.get(doc["master_prompt_hash"], 0) + 1
+    await db.generated_prompts.bulk_write([DeleteOne({"_id": doc["_id"]}) for doc in batch], ordered=False)
+    await release_prompt_bodies(refs)
+    return len(batch)
+
+async def anonymize_transactions_batch(job: dict) -> int:
+    # Kept with an anonymized user_id for 7 years per accounting law
+    batch = await db.token_transactions.find(
+        {"user_id": job["user_id"]},
+        {"_id": 1}
+    ).limit(GDPR_DELETION_BATCH_SIZE).to_list(GDPR_DELETION_BATCH_SIZE)
+    if not batch:
+        return 0
+    await db.token_transactions.bulk_write([
+        UpdateOne({"_id": doc["_id"]}, {"$set": {
+            "user_id": job["transaction_alias"],
+            "description": "User account deleted - GDPR Art. 17"
+        }})
+        for doc in batch
+    ], ordered=False)
+    return len(batch)
+
+async def purge_plain_audit_logs_batch(collection: str, job: dict, recent_cutoff: datetime) -> int:
+    batch = await db[collection].find(
+        plain_audit_filter(job["user_id"]),
+        {"_id": 1, "timestamp": 1, "meta": 1}
+    ).limit(GDPR_DELETION_BATCH_SIZE).to_list(GDPR_DELETION_BATCH_SIZE)
+    if not batch:
+        return 0
+    operations = []
+    for doc in batch:
+        try:
+            timestamp = as_datetime(doc.get("timestamp"))
+        except ValueError:
+            timestamp = None
+        if timestamp is None or timestamp >= recent_cutoff:
+            operations.append(DeleteOne({"_id": doc["_id"]}))
+        else:
+            field = "meta.user_id" if "meta" in doc else "user_id"
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {field: job["audit_alias"]}}))
+    await db[collection].bulk_write(operations, ordered=False)
+    return len(batch)
+
+async def purge_audit_logs_batch(job: dict) -> int:
+    # Recent logs are deleted; older ones are kept anonymized for security monitoring
+    recent_cutoff = as_datetime(job["requested_at"]) - timedelta(days=GDPR_AUDIT_RECENT_DAYS)
+    plain = await plain_audit_collections()
+    for name in plain:
+        processed = await purge_plain_audit_logs_batch(name, job, recent_cutoff)
+        if processed:
+            return processed
+    if "audit_logs" in plain:
+        return 0
+    # Time-series collections update whole buckets by meta, so this is one pass per call.
+    # Deletes filtered on the time field need MongoDB 7.0+; older servers anonymize recent logs too.
+    deleted = 0
+    if await mongo_version() >= (7, 0):
+        result = await db.audit_logs.delete_many({"meta.user_id": job["user_id"], "timestamp": {"$gte": recent_cutoff}})
+        deleted = result.deleted_count
+    anonymized = await db.audit_logs.update_many(
+        {"meta.user_id": job["user_id"]},
+        {"$set": {"meta.user_id": job["audit_alias"]}}
+    )
+    return deleted + anonymized.modified_count
+
+async def delete_account_records(job: dict) -> int:
+    # Other workers can serve the user from their cache for USER_CACHE_TTL_SECONDS after deletion
+    # was requested: wait that out, then sweep up rows written meanwhile behind the earlier steps
+    wait = (as_datetime(job["requested_at"]) + timedelta(seconds=USER_CACHE_TTL_SECONDS) - datetime.now(timezone.utc)).total_seconds()
+    if wait > 0:
+        await asyncio.sleep(wait)
+    for _, handler in GDPR_DELETION_STEPS[:-1]:
+        processed = await handler(job)
+        if processed:
+            return processed
+    
+    user_id = job["user_id"]
+    await db.user_stats.delete_one({"user_id": user_id})
+    await delete_gdpr_exports(user_id)
+    await db.users.delete_one({"id": user_id})
+    user_cache.invalidate(user_id)
+    return 0
+
+GDPR_DELETION_STEPS = (
+    ("generated_prompts", delete_prompts_batch),
+    ("token_transactions", anonymize_transactions_batch),
+    ("audit_logs", purge_audit_logs_batch),
+    ("account", delete_account_records),
+)
+
+def gdpr_deletion_job_exhausted(job: dict) -> bool:
+    """A failed job the worker no longer picks up - it only runs again once requeued"""
+    return job["status"] == "failed" and job.get("attempts", 0) >= GDPR_DELETION_MAX_ATTEMPTS
+
+def gdpr_deletion_job_view(job: dict) -> dict:
+    step = job.get("step", 0)
+    return {
+        "id": job["id"],
+        "status": job["status"],  # pending | running | completed | failed
+        "current_step": GDPR_DELETION_STEPS[step][0] if step < len(GDPR_DELETION_STEPS) else None,
+        "processed": job.get("processed", {}),
+        "attempts": job.get("attempts", 0),
+        "error": job.get("error"),
+        "retry_required": gdpr_deletion_job_exhausted(job),  # POST .../retry to run it again
+        "requested_at": job["requested_at"],
+        "completed_at": job.get("completed_at")
+    }
+
+def create_deletion_job_token(job_id: str) -> str:
+    """Signed handle for one deletion job; the account itself can no longer sign in"""
+    payload = {
+        "gdpr_deletion_job": job_id,
+        "exp": datetime.now(timezone.utc) + timedelta(days=GDPR_DELETION_TOKEN_DAYS)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def require_deletion_job_token(job_id: str, token: Optional[str]):
+    """Raise 403 unless token was issued by create_deletion_job_token for this job"""
+    payload = verify_jwt_token(token) if token else None
+    if not payload or payload.get("gdpr_deletion_job") != job_id:
+        raise HTTPException(status_code=403, detail="Invalid or expired deletion job token")
+
+async def requeue_gdpr_deletion_job(job_id: str) -> Optional[dict]:
+    """Give a job that used up its attempts a fresh set; it resumes from its checkpointed step"""
+    job = await db.gdpr_deletion_jobs.find_one_and_update(
+        {"id": job_id, "status": "failed", "attempts": {"$gte": GDPR_DELETION_MAX_ATTEMPTS}},
+        {"$set": {"status": "pending", "attempts": 0, "updated_at": datetime.now(timezone.utc)}, "$unset": {"error": ""}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if job:
+        logger.info(f"GDPR deletion job {job_id} requeued for user {job['user_id']}")
+        gdpr_deletion_wakeup.set()
+    return job
+
+async def run_gdpr_deletion_job(job_id: str):
+    """Run one deletion job from its checkpointed step, holding its lease while it works"""
+    lease = f"gdpr_deletion:{job_id}"
+    if not await acquire_lease(lease, GDPR_DELETION_LEASE_SECONDS):
+        return  # Another worker is running it
+    
+    try:
+        job = await db.gdpr_deletion_jobs.find_one_and_update(
+            {"id": job_id, "status": {"$ne": "completed"}},
+            {"$set": {"status": "running", "updated_at": datetime.now(timezone.utc)}, "$inc": {"attempts": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            return
+        
+        step = job.get("step", 0)
+        while step < len(GDPR_DELETION_STEPS):
+            name, handler = GDPR_DELETION_STEPS[step]
+            processed = await handler(job)
+            if processed:
+                update = {"$inc": {f"processed.{name}": processed}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+            else:
+                step += 1
+                update = {"$set": {"step": step, "updated_at": datetime.now(timezone.utc)}}
+            await db.gdpr_deletion_jobs.update_one({"id": job_id}, update)
+            
+            if not await acquire_lease(lease, GDPR_DELETION_LEASE_SECONDS):
+                raise RuntimeError("GDPR deletion lease lost to another worker")
+            await asyncio.sleep(GDPR_DELETION_PAUSE_SECONDS)
+        
+        now = datetime.now(timezone.utc)
+        await db.gdpr_deletion_jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": "completed", "completed_at": now, "updated_at": now}, "$unset": {"error": ""}}
+        )
+        logger.info(f"GDPR deletion job {job_id} completed for user {job['user_id']}")
+    except Exception as e:
+        logger.error(f"GDPR deletion job {job_id} failed: {str(e)}", exc_info=True)
+        await db.gdpr_deletion_jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": "failed", "error": str(e), "updated_at": datetime.now(timezone.utc)}}
+        )
+    finally:
+        await release_lease(lease)
+
+# Set by the request path so a new job starts without waiting for the next poll
+gdpr_deletion_wakeup = asyncio.Event()
+
+async def process_gdpr_deletion_jobs():
+    """Run (or resume) every unfinished deletion job, oldest first"""
+    jobs = await db.gdpr_deletion_jobs.find(
+        {"status": {"$ne": "completed"}, "attempts": {"$lt": GDPR_DELETION_MAX_ATTEMPTS}},
+        {"_id": 0, "id": 1}
+    ).sort("requested_at", 1).to_list(100)
+    for job in jobs:
+        await run_gdpr_deletion_job(job["id"])
+
+async def run_gdpr_deletion_worker():
+    """Long-running loop; cancelling it mid-job is safe because jobs resume from their checkpoint"""
+    while True:
+        gdpr_deletion_wakeup.clear()
+        try:
+            await process_gdpr_deletion_jobs()
+        except Exception as e:
+            logger.error(f"GDPR deletion worker failed: {str(e)}", exc_info=True)
+        try:
+            await asyncio.wait_for(gdpr_deletion_wakeup.wait(), GDPR_DELETION_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+# Data Retention
+# Each policy works through its matching documents in fixed-size batches, one bulk_write per batch,
+# so every anonymized document gets its own id. Processed documents stop matching the policy's
+# filter, which makes an interrupted run safe to repeat. One worker runs it at a time (lease).
+RETENTION_LEASE = "retention"
+
+class OpsThrottle:
+    """Paces writes to at most `rate` operations per second"""
+    
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.waited = 0.0
+        self._ready_at = time.monotonic()
+    
+    async def consume(self, ops: int):
+        now = time.monotonic()
+        self._ready_at = max(self._ready_at, now) + ops / self.rate
+        delay = self._ready_at - now
+        if delay > 0:
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+async def retention_pass(collection: str, query: dict, make_operation, throttle: OpsThrottle, metrics: dict) -> int:
+    """Apply make_operation to every document matching query, batch by batch; returns documents changed"""
+    changed = 0
+    while True:
+        if not await acquire_lease(RETENTION_LEASE, RETENTION_LEASE_SECONDS):
+            raise RuntimeError("Retention lease lost to another worker")
+        
+        batch = await db[collection].find(query, {"_id": 1}).limit(RETENTION_BATCH_SIZE).to_list(RETENTION_BATCH_SIZE)
+        if not batch:
+            return changed
+        
+        result = await db[collection].bulk_write([make_operation(doc) for doc in batch], ordered=False)
+        done = result.modified_count + result.deleted_count
+        changed += done
+        metrics["batches"] += 1
+        metrics["operations"] += len(batch)
+        if done == 0:
+            # Nothing in the batch could be changed, so the same documents would match again
+            logger.warning(f"Retention pass on {collection} made no progress; stopping")
+            return changed
+        await throttle.consume(len(batch))
+
+async def anonymize_old_transactions(now: datetime, throttle: OpsThrottle, metrics: dict) -> int:
+    return await retention_pass(
+        "token_transactions",
+        {
+            **datetime_filter("created_at", "$lt", now - timedelta(days=RETENTION_TRANSACTION_DAYS)),
+            "user_id": {"$not": {"$regex": "^(DELETED|ANONYMIZED)-"}}
+        },
+        lambda doc: UpdateOne({"_id": doc["_id"]}, {"$set": {
+            "user_id": f"ANONYMIZED-{uuid.uuid4()}",
+            "description": "Anonymized after retention period"
+        }}),
+        throttle, metrics
+    )
+
+async def anonymize_inactive_user_prompts(now: datetime, throttle: OpsThrottle, metrics: dict) -> int:
+    """Anonymize prompts of users without a login for RETENTION_INACTIVE_USER_DAYS, walking users by _id"""
+    query = {
+        **datetime_filter("last_login_at", "$lt", now - timedelta(days=RETENTION_INACTIVE_USER_DAYS)),
+        "is_admin": False
+    }
+    anonymized = 0
+    last_id = None
+    while True:
+        page = dict(query, _id={"$gt": last_id}) if last_id is not None else query
+        users = await db.users.find(page, {"_id": 1, "id": 1}).sort("_id", 1).limit(RETENTION_BATCH_SIZE).to_list(RETENTION_BATCH_SIZE)
+        if not users:
+            return anonymized
+        metrics["inactive_users"] += len(users)
+        last_id = users[-1]["_id"]
+        owners = await db.generated_prompts.distinct("user_id", {"user_id": {"$in": [user["id"] for user in users]}})
+        if not owners:
+            continue
+        anonymized += await retention_pass(
+            "generated_prompts",
+            {"user_id": {"$in": owners}},
+            lambda doc: UpdateOne({"_id": doc["_id"]}, {"$set": {
+                "user_id": f"INACTIVE-{uuid.uuid4()}",
+                "conversation_summary": "Anonymized - user inactive"
+            }}),
+            throttle, metrics
+        )
+        # The prompts no longer count as theirs (recounted, so a retried run stays correct)
+        await recount_agents(owners)
+
+RETENTION_POLICIES = (
+    ("anonymized_transactions", anonymize_old_transactions),
+    ("anonymized_prompts", anonymize_inactive_user_prompts),
+)
+
+async def run_retention(force: bool = False) -> Optional[dict]:
+    """
+    Apply every retention policy and record the run in retention_runs.
+    Skipped (None) if another worker holds the lease or, unless forced, the last run is recent.
+    """
+    if not force:
+        last = await db.retention_runs.find_one({}, {"_id": 0, "started_at": 1}, sort=[("started_at", -1)])
+        if last and as_datetime(last["started_at"]) > datetime.now(timezone.utc) - timedelta(seconds=RETENTION_INTERVAL_SECONDS):
+            return None
+    if not await acquire_lease(RETENTION_LEASE, RETENTION_LEASE_SECONDS):
+        return None
+    
+    now = datetime.now(timezone.utc)
+    run = {
+        "id": str(uuid.uuid4()),
+        "status": "running",
+        "worker": WORKER_ID,
+        "started_at": now,
+        "max_ops_per_second": RETENTION_MAX_OPS_PER_SECOND,
+        "batch_size": RETENTION_BATCH_SIZE,
+        "results": {name: 0 for name, _ in RETENTION_POLICIES},
+        "metrics": {"batches": 0, "operations": 0, "inactive_users": 0}
+    }
+    await db.retention_runs.insert_one(dict(run))
+    throttle = OpsThrottle(RETENTION_MAX_OPS_PER_SECOND)
+    started = time.monotonic()
+    try:
+        for name, policy in RETENTION_POLICIES:
+            run["results"][name] = await policy(now, throttle, run["metrics"])
+            await db.retention_runs.update_one(
+                {"id": run["id"]},
+                {"$set": {"results": run["results"], "metrics": run["metrics"]}}
+            )
+        run["status"] = "completed"
+        logger.info(f"Retention run {run['id']} completed: {run['results']}")
+    except Exception as e:
+        run["status"] = "failed"
+        run["error"] = str(e)
+        logger.error(f"Retention run {run['id']} failed: {str(e)}", exc_info=True)
+    finally:
+        run["finished_at"] = datetime.now(timezone.utc)
+        run["metrics"]["duration_seconds"] = round(time.monotonic() - started, 3)
+        run["metrics"]["throttled_seconds"] = round(throttle.waited, 3)
+        await db.retention_runs.update_one(
+            {"id": run["id"]},
+            {"$set": {key: run[key] for key in ("status", "results", "metrics", "finished_at", "error") if key in run}}
+        )
+        await release_lease(RETENTION_LEASE)
+    return run
+
 # GDPR Endpoints
 @api_router.get("/gdpr/export")
-async def export_user_data(request: Request):
+async def export_user_data(request: Request, format: Literal["ndjson", "zip"] = "ndjson"):
     """
     Export all user personal data (GDPR Art. 15 - Right to Access).
-    Returns complete data package in JSON format.
+    Streams NDJSON, or a zip with one NDJSON file per dataset, straight from the database.
     Requires authentication.
     """
     user = await require_auth(request)
@@ -1945,68 +5398,121 @@ async def export_user_data(request: Request):
             action="export",
             resource_type="all_data",
             request=request,
-            details={"export_type": "full"}
+            details={"export_type": "full", "format": format}
         )
         
-        # Gather all user data
-        # 1. User profile
-        user_profile = {
-            "id": user["id"],
-            "email": user["email"],
-            "name": user["name"],
-            "picture": user.get("picture"),
-            "is_admin": user.get("is_admin", False),
-            "omega_tokens_balance": user["omega_tokens_balance"],
-            "created_at": user["created_at"],
-            "last_login_at": user.get("last_login_at")
-        }
+        if format == "zip":
+            return StreamingResponse(
+                stream_gdpr_zip(user),
+                media_type="application/zip",
+                headers={"Content-Disposition": f"attachment; filename={gdpr_export_filename(user_id, 'zip')}"}
+            )
+        return StreamingResponse(
+            stream_gdpr_ndjson(user),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": f"attachment; filename={gdpr_export_filename(user_id, 'ndjson')}"}
+        )
         
-        # 2. Generated prompts
-        prompts = await db.generated_prompts.find(
-            {"user_id": user_id},
+    except Exception as e:
+        logger.error(f"Error exporting user data: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.post("/gdpr/export/jobs")
+async def create_export_job(request: Request):
+    """
+    Start a background export that writes a zip archive to disk (for very large accounts).
+    Returns the user's unfinished job instead if there is one; poll the job, then download it.
+    Requires authentication.
+    """
+    user = await require_auth(request)
+    user_id = user["id"]
+    
+    try:
+        job = await db.gdpr_export_jobs.find_one(
+            {"user_id": user_id, "status": {"$in": ["pending", "running"]}},
             {"_id": 0}
-        ).to_list(1000)
+        )
+        if job:
+            return gdpr_export_job_view(job)
         
-        # 3. Token transactions
-        transactions = await db.token_transactions.find(
-            {"user_id": user_id},
-            {"_id": 0}
-        ).to_list(10000)
+        await log_audit(
+            user_id=user_id,
+            action="export",
+            resource_type="all_data",
+            request=request,
+            details={"export_type": "full", "format": "zip", "mode": "job"}
+        )
         
-        # 4. Audit logs
-        audit_logs = await db.audit_logs.find(
-            {"user_id": user_id},
-            {"_id": 0}
-        ).to_list(10000)
-        
-        # Prepare export package
-        export_data = {
-            "user_profile": user_profile,
-            "generated_prompts": prompts,
-            "token_transactions": transactions,
-            "audit_logs": audit_logs,
-            "export_date": datetime.now(timezone.utc).isoformat(),
-            "gdpr_notice": "This export contains all personal data processed by Omega-Aurora Codex platform. You have the right to rectify, delete, or restrict processing of this data under GDPR Articles 16-18."
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "status": "pending",
+            "created_at": now,
+            "updated_at": now
         }
+        await db.gdpr_export_jobs.insert_one(dict(job))
+        spawn_job(run_gdpr_export_job(job["id"]))
+        return gdpr_export_job_view(job)
         
-        # Return as downloadable JSON
-        from fastapi.responses import JSONResponse
+    except Exception as e:
+        logger.error(f"Error creating export job: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.get("/gdpr/export/jobs/{job_id}")
+async def get_export_job(job_id: str, request: Request):
+    """
+    Status of a background export job.
+    Requires authentication; only the owner can see it.
+    """
+    user = await require_auth(request)
+    
+    try:
+        job = await db.gdpr_export_jobs.find_one({"id": job_id, "user_id": user["id"]}, {"_id": 0})
+        if not job:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        return gdpr_export_job_view(job)
         
-        return JSONResponse(
-            content=export_data,
-            headers={
-                "Content-Disposition": f"attachment; filename=omega-codex-data-{user_id[:8]}-{datetime.now().strftime('%Y%m%d')}.json"
-            }
-        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting export job: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.get("/gdpr/export/jobs/{job_id}/download")
+async def download_export_job(job_id: str, request: Request):
+    """
+    Download the archive of a completed export job.
+    Requires authentication; only the owner can download it.
+    """
+    user = await require_auth(request)
+    
+    try:
+        job = await db.gdpr_export_jobs.find_one({"id": job_id, "user_id": user["id"]}, {"_id": 0})
+        if not job:
+            raise HTTPException(status_code=404, detail="Export job not found")
+        if job["status"] != "completed":
+            raise HTTPException(status_code=409, detail=f"Export is {job['status']}")
+        
+        path = Path(job["path"])
+        if not path.exists():
+            raise HTTPException(status_code=404, detail="Export file is not available on this server")
+        
+        return FileResponse(path, media_type="application/zip", filename=gdpr_export_filename(user["id"], "zip"))
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error exporting user data: {str(e)}", exc_info=True)
+        logger.error(f"Error downloading export: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @api_router.delete("/gdpr/delete")
 async def delete_user_account(request: Request):
     """
     Delete user account and all associated data (GDPR Art. 17 - Right to Erasure).
+    Marks the account as pending deletion and returns at once; a background job does the
+    deletion in resumable batches. Poll status_url (GET /api/gdpr/delete/{job_id}?token=...)
+    for its progress.
     Preserves accounting records as required by law (7 years retention).
     Requires authentication.
     """
@@ -2021,54 +5527,48 @@ async def delete_user_account(request: Request):
         )
     
     try:
-        # Log audit trail BEFORE deletion
-        await log_audit(
-            user_id=user_id,
-            action="delete",
-            resource_type="account",
-            request=request,
-            details={"reason": "user_request_gdpr_art17"}
-        )
-        
-        # Delete user data with exceptions for legal retention
-        # 1. Delete user profile
-        await db.users.delete_one({"id": user_id})
-        
-        # 2. Delete generated prompts
-        await db.generated_prompts.delete_many({"user_id": user_id})
-        
-        # 3. Anonymize token transactions (keep for accounting, but remove PII)
-        # Note: We keep transaction records with anonymized user_id for 7 years per accounting law
-        await db.token_transactions.update_many(
-            {"user_id": user_id},
-            {"$set": {
-                "user_id": f"DELETED-{uuid.uuid4()}",
-                "description": "User account deleted - GDPR Art. 17"
-            }}
-        )
-        
-        # 4. Anonymize audit logs older than 30 days, delete recent ones
-        thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
-        
-        # Delete recent audit logs
-        await db.audit_logs.delete_many({
-            "user_id": user_id,
-            "timestamp": {"$gte": thirty_days_ago.isoformat()}
-        })
-        
-        # Anonymize old audit logs (keep for security monitoring)
-        await db.audit_logs.update_many(
-            {
+        job = await db.gdpr_deletion_jobs.find_one({"user_id": user_id, "status": {"$ne": "completed"}}, {"_id": 0})
+        if job and gdpr_deletion_job_exhausted(job):
+            job = await requeue_gdpr_deletion_job(job["id"]) or job
+        if not job:
+            # Log audit trail BEFORE deletion - written directly, so the job's audit step sees it
+            await log_audit(
+                user_id=user_id,
+                action="delete",
+                resource_type="account",
+                request=request,
+                details={"reason": "user_request_gdpr_art17"},
+                durable=True
+            )
+            
+            now = datetime.now(timezone.utc)
+            job = {
+                "id": str(uuid.uuid4()),
                 "user_id": user_id,
-                "timestamp": {"$lt": thirty_days_ago.isoformat()}
-            },
-            {"$set": {"user_id": f"ANONYMIZED-{uuid.uuid4()}"}}
-        )
+                "status": "pending",
+                "step": 0,
+                "processed": {},
+                "attempts": 0,
+                "transaction_alias": f"DELETED-{uuid.uuid4()}",
+                "audit_alias": f"ANONYMIZED-{uuid.uuid4()}",
+                "requested_at": now,
+                "updated_at": now
+            }
+            # The job is recorded first: if marking the account fails, the deletion still happens
+            await db.gdpr_deletion_jobs.insert_one(dict(job))
         
-        logger.info(f"User account deleted successfully: {user_id}")
+        await db.users.update_one({"id": user_id}, {"$set": {"deletion_requested_at": job["requested_at"]}})
+        user_cache.invalidate(user_id)
+        gdpr_deletion_wakeup.set()
         
+        logger.info(f"User account deletion requested: {user_id} (job {job['id']})")
+        
+        token = create_deletion_job_token(job["id"])
         return {
-            "message": "Your account and personal data have been deleted successfully.",
+            "message": "Your account is being deleted. You have been signed out.",
+            "job": gdpr_deletion_job_view(job),
+            "status_token": token,
+            "status_url": f"/api/gdpr/delete/{job['id']}?token={token}",
             "legal_notice": "Some anonymized records may be retained for legal compliance (accounting: 7 years).",
             "gdpr_reference": "Art. 17 GDPR - Right to Erasure"
         }
@@ -2077,70 +5577,84 @@ async def delete_user_account(request: Request):
         logger.error(f"Error deleting user account: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@api_router.post("/gdpr/anonymize-old-data")
-async def anonymize_old_data(request: Request):
+@api_router.get("/gdpr/delete/{job_id}")
+async def get_deletion_job(job_id: str, token: Optional[str] = None):
+    """
+    Progress of an account deletion job. The account can no longer sign in once deletion was
+    requested, so the status_token returned by DELETE /api/gdpr/delete authorizes this instead.
+    """
+    require_deletion_job_token(job_id, token)
+    
+    try:
+        job = await db.gdpr_deletion_jobs.find_one({"id": job_id}, {"_id": 0})
+        if not job:
+            raise HTTPException(status_code=404, detail="Deletion job not found")
+        return gdpr_deletion_job_view(job)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting deletion job: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.post("/gdpr/delete/{job_id}/retry")
+async def retry_deletion_job(job_id: str, token: Optional[str] = None):
+    """
+    Requeue a deletion job that failed GDPR_DELETION_MAX_ATTEMPTS times (retry_required in its
+    status). The account stays locked while it is pending deletion; authorized by the job's
+    status_token like GET /api/gdpr/delete/{job_id}.
+    """
+    require_deletion_job_token(job_id, token)
+    
+    try:
+        job = await requeue_gdpr_deletion_job(job_id)
+        if not job:
+            job = await db.gdpr_deletion_jobs.find_one({"id": job_id}, {"_id": 0})
+            if not job:
+                raise HTTPException(status_code=404, detail="Deletion job not found")
+            raise HTTPException(status_code=409, detail=f"Deletion job is {job['status']} and does not need a retry")
+        return gdpr_deletion_job_view(job)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrying deletion job: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.post("/admin/retention/run")
+async def start_retention_run(request: Request):
     """
-    Admin endpoint to run data retention and anonymization policies.
+    Run the data retention policies now instead of waiting for the schedule
+    (audit logs expire on their own - audit_logs is a time-series collection with a 1 year TTL):
     - Anonymize transactions older than 7 years (after accounting retention)
-    - Delete audit logs older than 1 year
-    - Anonymize prompts older than 2 years from inactive accounts
+    - Anonymize prompts of accounts inactive for 2+ years
+    Runs in the background; see GET /api/admin/retention/runs for the result.
     Requires admin authentication.
     """
     await require_admin(request)
     
     try:
-        now = datetime.now(timezone.utc)
-        
-        # 1. Delete audit logs older than 1 year
-        one_year_ago = now - timedelta(days=365)
-        audit_result = await db.audit_logs.delete_many({
-            "timestamp": {"$lt": one_year_ago.isoformat()}
-        })
-        
-        # 2. Anonymize transactions older than 7 years
-        seven_years_ago = now - timedelta(days=365 * 7)
-        transaction_result = await db.token_transactions.update_many(
-            {
-                "created_at": {"$lt": seven_years_ago.isoformat()},
-                "user_id": {"$not": {"$regex": "^(DELETED|ANONYMIZED)-"}}
-            },
-            {"$set": {
-                "user_id": lambda: f"ANONYMIZED-{uuid.uuid4()}",
-                "description": "Anonymized after retention period"
-            }}
-        )
+        spawn_job(run_retention(force=True))
+        return {"message": "Retention run started"}
         
-        # 3. Find inactive users (no login in 2+ years)
-        two_years_ago = now - timedelta(days=365 * 2)
-        inactive_users = await db.users.find({
-            "last_login_at": {"$lt": two_years_ago.isoformat()},
-            "is_admin": False
-        }, {"_id": 0, "id": 1}).to_list(1000)
-        
-        inactive_user_ids = [u["id"] for u in inactive_users]
-        
-        # Anonymize prompts from inactive users
-        prompt_result = await db.generated_prompts.update_many(
-            {"user_id": {"$in": inactive_user_ids}},
-            {"$set": {
-                "user_id": lambda: f"INACTIVE-{uuid.uuid4()}",
-                "conversation_summary": "Anonymized - user inactive"
-            }}
-        )
-        
-        logger.info(f"Data anonymization completed: {audit_result.deleted_count} audit logs, "
-                   f"{transaction_result.modified_count} transactions, {prompt_result.modified_count} prompts")
-        
-        return {
-            "message": "Data retention policies applied successfully",
-            "deleted_audit_logs": audit_result.deleted_count,
-            "anonymized_transactions": transaction_result.modified_count,
-            "anonymized_prompts": prompt_result.modified_count,
-            "inactive_users_found": len(inactive_user_ids)
-        }
+    except Exception as e:
+        logger.error(f"Error starting retention run: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@api_router.get("/admin/retention/runs")
+async def get_retention_runs(request: Request, limit: int = 20):
+    """
+    Most recent retention runs with their per-policy results and metrics (newest first).
+    Requires admin authentication.
+    """
+    await require_admin(request)
+    
+    try:
+        limit = max(1, min(limit, 100))
+        return await db.retention_runs.find({}, {"_id": 0}).sort("started_at", -1).to_list(limit)
         
     except Exception as e:
-        logger.error(f"Error anonymizing old data: {str(e)}", exc_info=True)
+        logger.error(f"Error getting retention runs: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 # Include the router in the main app
@@ -2161,6 +5675,91 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def warm_up_llm_routes():
+    """Warm up pooled clients for every distinct route configured in platform settings"""
+    routes = {}
+    for stage in LLM_ROUTE_STAGES:
+        route = await resolve_llm_route(stage)
+        routes.setdefault((route.provider, route.model, route.api_key), route)
+    await llm_pool.warm_up(list(routes.values()))
+
+async def run_periodically(job, interval_seconds: float, name: str):
+    """Run an async job forever at a fixed interval, logging (not propagating) failures"""
+    while True:
+        try:
+            await job()
+        except Exception as e:
+            logger.error(f"Periodic job '{name}' failed: {str(e)}", exc_info=True)
+        await asyncio.sleep(interval_seconds)
+
+# Long-running workers started at startup and cancelled on shutdown
+periodic_tasks: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def start_background_workers():
+    # Open LLM connections before the first user request pays for it
+    spawn_job(warm_up_llm_routes())
+    
+    # Idempotent; also available as `python db_indexes.py` (--report / --explain)
+    try:
+        result = await ensure_indexes(db)
+        logger.info(f"Ensured {result['ensured']} indexes ({len(result['failed'])} failed)")
+    except Exception as e:
+        logger.error(f"Failed to ensure indexes: {str(e)}", exc_info=True)
+    
+    spawn_job(run_datetime_migration())
+    spawn_job(run_prompt_body_migration())
+    spawn_job(run_prompt_body_terms_migration())
+    spawn_job(run_audit_log_migration())
+    spawn_job(backfill_user_sequence_ids())
+    spawn_job(backfill_admin_user_listing())
+    spawn_job(backfill_token_rollups())
+    spawn_job(active_users.backfill_from_logins())
+    
+    periodic_tasks.append(asyncio.create_task(
+        run_periodically(reclaim_expired_token_holds, TOKEN_HOLD_SWEEP_INTERVAL_SECONDS, "token hold sweeper")
+    ))
+    periodic_tasks.append(asyncio.create_task(
+        run_periodically(settings_service.poll_version, SETTINGS_VERSION_POLL_SECONDS, "settings version poll")
+    ))
+    periodic_tasks.append(asyncio.create_task(overview_snapshot.run()))
+    periodic_tasks.append(asyncio.create_task(
+        run_periodically(active_users.flush, ACTIVE_USERS_FLUSH_INTERVAL_SECONDS, "active user sketch flush")
+    ))
+    # First run loads the stored clarify corpus, later runs pick up other workers' entries
+    periodic_tasks.append(asyncio.create_task(
+        run_periodically(clarify_index.sync, CLARIFY_INDEX_SYNC_INTERVAL_SECONDS, "clarify index sync")
+    ))
+    periodic_tasks.append(asyncio.create_task(
+        run_periodically(sweep_gdpr_export_jobs, GDPR_EXPORT_SWEEP_INTERVAL_SECONDS, "GDPR export sweeper")
+    ))
+    periodic_tasks.append(asyncio.create_task(run_gdpr_deletion_worker()))
+    periodic_tasks.append(asyncio.create_task(audit_writer.run()))
+    periodic_tasks.append(asyncio.create_task(
+        run_periodically(run_retention, RETENTION_CHECK_INTERVAL_SECONDS, "data retention")
+    ))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    cancelled = [*periodic_tasks, *job_tasks]
+    for task in cancelled:
+        task.cancel()
+    # Let pending background writes (e.g. transaction records) finish, and cancelled jobs run their
+    # cleanup, but never long enough for the supervisor to kill us before the flushes below
+    pending = [*background_tasks, *cancelled]
+    if pending:
+        _, unfinished = await asyncio.wait(pending, timeout=SHUTDOWN_DRAIN_TIMEOUT_SECONDS)
+        if unfinished:
+            for task in unfinished:
+                task.cancel()
+            logger.warning(f"Shutdown drain timed out after {SHUTDOWN_DRAIN_TIMEOUT_SECONDS}s; cancelled {len(unfinished)} background tasks")
+    try:
+        await active_users.flush()
+    except Exception as e:
+        logger.error(f"Failed to flush active-user sketches on shutdown: {str(e)}", exc_info=True)
+    try:
+        await audit_writer.close()
+    except Exception as e:
+        logger.error(f"Failed to flush audit log entries on shutdown: {str(e)}", exc_info=True)
+    await llm_pool.close()
     client.close()
\ No newline at end of file
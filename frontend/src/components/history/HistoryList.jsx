@@ -3,9 +3,35 @@ import { motion } from 'framer-motion';
 import { Card } from '@/components/ui/card';
 import { ScrollArea } from '@/components/ui/scroll-area';
 import { Separator } from '@/components/ui/separator';
+import { Button } from '@/components/ui/button';
 import { Loader2 } from 'lucide-react';
 
-export default function HistoryList({ prompts, onSelectPrompt, isLoading }) {
+const HIGHLIGHT_FIELD_LABELS = {
+  'name': 'Název',
+  'description.general_function': 'Obecná funkce',
+  'description.specialization': 'Specializace',
+  'description.output': 'Výstup',
+  'master_prompt': 'Prompt'
+};
+
+// Renders a search snippet with its [start, end) match ranges marked
+function HighlightSnippet({ snippet, matches }) {
+  const parts = [];
+  let last = 0;
+  matches.forEach(([start, end], i) => {
+    if (start > last) parts.push(snippet.slice(last, start));
+    parts.push(
+      <mark key={i} className="bg-[rgb(6,214,160)]/20 text-[rgb(6,214,160)] rounded px-0.5">
+        {snippet.slice(start, end)}
+      </mark>
+    );
+    last = end;
+  });
+  parts.push(snippet.slice(last));
+  return <>{parts}</>;
+}
+
+export default function HistoryList({ prompts, onSelectPrompt, isLoading, isSearch, hasMore, isLoadingMore, onLoadMore }) {
   if (isLoading) {
     return (
       <div className="flex items-center justify-center h-[400px]" data-testid="history-loading">
@@ -17,8 +43,10 @@ export default function HistoryList({ prompts, onSelectPrompt, isLoading }) {
   if (!prompts || prompts.length === 0) {
     return (
       <div className="flex flex-col items-center justify-center h-[400px] text-center" data-testid="history-empty">
-        <p className="text-slate-400 mb-2">Žádná historie</p>
-        <p className="text-sm text-slate-500">Vygenerované prompty se zobrazí zde</p>
+        <p className="text-slate-400 mb-2">{isSearch ? 'Žádné výsledky' : 'Žádná historie'}</p>
+        <p className="text-sm text-slate-500">
+          {isSearch ? 'Zkuste jiná slova' : 'Vygenerované prompty se zobrazí zde'}
+        </p>
       </div>
     );
   }
@@ -31,7 +59,7 @@ export default function HistoryList({ prompts, onSelectPrompt, isLoading }) {
             key={prompt.id}
             initial={{ opacity: 0, y: 8 }}
             animate={{ opacity: 1, y: 0 }}
-            transition={{ duration: 0.22, delay: index * 0.05, ease: [0.22, 1, 0.36, 1] }}
+            transition={{ duration: 0.22, delay: Math.min(index, 10) * 0.05, ease: [0.22, 1, 0.36, 1] }}
           >
             <Card
               className="bg-[rgb(15,23,42)]/60 border-slate-800/50 hover:border-[rgb(6,214,160)]/30 transition-all duration-200 cursor-pointer group"
@@ -45,6 +73,20 @@ export default function HistoryList({ prompts, onSelectPrompt, isLoading }) {
                   {prompt.name}
                 </h3>
 
+                {/* Search highlights */}
+                {prompt.highlights && prompt.highlights.length > 0 && (
+                  <div className="space-y-1" data-testid="history-item-highlights">
+                    {prompt.highlights.map((highlight) => (
+                      <p key={highlight.field} className="text-sm text-slate-400 leading-relaxed">
+                        <span className="text-xs font-medium text-slate-500 uppercase tracking-wider mr-2">
+                          {HIGHLIGHT_FIELD_LABELS[highlight.field] || highlight.field}
+                        </span>
+                        <HighlightSnippet snippet={highlight.snippet} matches={highlight.matches} />
+                      </p>
+                    ))}
+                  </div>
+                )}
+
                 {/* Description Card with 3 vertical sections */}
                 <div className="bg-[rgb(10,15,29)]/40 border border-slate-800/30 rounded-lg p-4 space-y-3">
                   {/* Obecná funkce */}
@@ -82,20 +124,40 @@ export default function HistoryList({ prompts, onSelectPrompt, isLoading }) {
                   </div>
                 </div>
 
-                {/* Timestamp */}
-                <div className="text-xs text-slate-500">
-                  {new Date(prompt.created_at).toLocaleString('cs-CZ', {
-                    year: 'numeric',
-                    month: 'long',
-                    day: 'numeric',
-                    hour: '2-digit',
-                    minute: '2-digit'
-                  })}
+                {/* Timestamp and prompt size */}
+                <div className="flex items-center justify-between text-xs text-slate-500">
+                  <span>
+                    {new Date(prompt.created_at).toLocaleString('cs-CZ', {
+                      year: 'numeric',
+                      month: 'long',
+                      day: 'numeric',
+                      hour: '2-digit',
+                      minute: '2-digit'
+                    })}
+                  </span>
+                  <span data-testid="history-item-size">
+                    {(prompt.master_prompt_size || 0).toLocaleString('cs-CZ')} znaků
+                  </span>
                 </div>
               </div>
             </Card>
           </motion.div>
         ))}
+
+        {hasMore && (
+          <div className="flex justify-center pt-2">
+            <Button
+              onClick={onLoadMore}
+              disabled={isLoadingMore}
+              variant="outline"
+              className="border-slate-700 text-slate-300 hover:text-[rgb(6,214,160)]"
+              data-testid="history-load-more"
+            >
+              {isLoadingMore && <Loader2 className="h-4 w-4 mr-2 animate-spin" />}
+              Načíst další
+            </Button>
+          </div>
+        )}
       </div>
     </ScrollArea>
   );
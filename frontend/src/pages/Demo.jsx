@@ -5,13 +5,14 @@ import { ScrollArea } from '@/components/ui/scroll-area';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import { Textarea } from '@/components/ui/textarea';
+import { Input } from '@/components/ui/input';
 import { Badge } from '@/components/ui/badge';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs';
 import { Progress } from '@/components/ui/progress';
 import { Separator } from '@/components/ui/separator';
 import { Collapsible, CollapsibleContent, CollapsibleTrigger } from '@/components/ui/collapsible';
 import { toast } from 'sonner';
-import { Send, Copy, Loader2, Sparkles, Settings, ChevronDown, History, Coins, Phone, Shield } from 'lucide-react';
+import { Send, Copy, Loader2, Sparkles, Settings, ChevronDown, History, Coins, Phone, Shield, Search } from 'lucide-react';
 import ReactMarkdown from 'react-markdown';
 import remarkGfm from 'remark-gfm';
 import rehypeHighlight from 'rehype-highlight';
@@ -86,7 +87,10 @@ export default function Demo() {
   
   // History state
   const [prompts, setPrompts] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null);
+  const [historyQuery, setHistoryQuery] = useState('');
   const [isLoadingHistory, setIsLoadingHistory] = useState(false);
+  const [isLoadingMoreHistory, setIsLoadingMoreHistory] = useState(false);
   const [selectedPrompt, setSelectedPrompt] = useState(null);
   
   // Generate view state
@@ -154,28 +158,46 @@ export default function Demo() {
     }
   }, [input]);
   
-  // Load history when switching to history view
+  // Load history when switching to history view or after the search query settles
   useEffect(() => {
-    if (view === 'history') {
-      loadHistory();
-    }
-  }, [view]);
+    if (view !== 'history') return;
+    const timer = setTimeout(() => loadHistory(), historyQuery ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [view, historyQuery]);
   
-  const loadHistory = async () => {
-    setIsLoadingHistory(true);
+  // Both endpoints return lightweight summaries in keyset pages; the full prompt is fetched on open.
+  // With a query, items are full-text search hits ranked by relevance and carry highlights.
+  const loadHistory = async (cursor = null) => {
+    const query = historyQuery.trim();
+    if (cursor) {
+      setIsLoadingMoreHistory(true);
+    } else {
+      setIsLoadingHistory(true);
+    }
     try {
-      const response = await axios.get(`${API}/prompts`);
-      setPrompts(response.data);
+      const params = {};
+      if (query) params.q = query;
+      if (cursor) params.cursor = cursor;
+      const response = await axios.get(query ? `${API}/prompts/search` : `${API}/prompts`, { params });
+      setPrompts(prev => cursor ? [...prev, ...response.data.items] : response.data.items);
+      setHistoryCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error loading history:', error);
       toast.error('Failed to load history');
     } finally {
       setIsLoadingHistory(false);
+      setIsLoadingMoreHistory(false);
     }
   };
   
-  const handleSelectPrompt = (prompt) => {
-    setSelectedPrompt(prompt);
+  const handleSelectPrompt = async (prompt) => {
+    try {
+      const response = await axios.get(`${API}/prompts/${prompt.id}`);
+      setSelectedPrompt(response.data);
+    } catch (error) {
+      console.error('Error loading prompt:', error);
+      toast.error('Failed to load prompt');
+    }
   };
   
   const handleBackToList = () => {
@@ -184,16 +206,11 @@ export default function Demo() {
   
   const handleUpdateName = async (promptId, newName) => {
     try {
-      await axios.patch(`${API}/prompts/${promptId}`, { name: newName });
+      const response = await axios.patch(`${API}/prompts/${promptId}`, { name: newName });
       toast.success('Název byl aktualizován');
-      // Reload history to get updated data
-      await loadHistory();
-      // Update selected prompt if it's the one being edited
+      setPrompts(prev => prev.map(p => p.id === promptId ? { ...p, name: response.data.name } : p));
       if (selectedPrompt && selectedPrompt.id === promptId) {
-        const updatedPrompt = prompts.find(p => p.id === promptId);
-        if (updatedPrompt) {
-          setSelectedPrompt({...selectedPrompt, name: newName});
-        }
+        setSelectedPrompt(response.data);
       }
     } catch (error) {
       console.error('Error updating name:', error);
@@ -707,13 +724,29 @@ export default function Demo() {
               />
             ) : (
               <div>
-                <h2 className="text-2xl font-bold text-[rgb(6,214,160)] mb-6">
-                  Historie vygenerovaných promptů
-                </h2>
+                <div className="flex flex-col sm:flex-row sm:items-center sm:justify-between gap-3 mb-6">
+                  <h2 className="text-2xl font-bold text-[rgb(6,214,160)]">
+                    Historie vygenerovaných promptů
+                  </h2>
+                  <div className="relative w-full sm:w-72">
+                    <Search className="absolute left-3 top-1/2 -translate-y-1/2 h-4 w-4 text-slate-500" />
+                    <Input
+                      placeholder="Hledat v promptech"
+                      value={historyQuery}
+                      onChange={(e) => setHistoryQuery(e.target.value)}
+                      data-testid="history-search-input"
+                      className="pl-9 bg-[rgb(10,15,29)] border-slate-700 text-slate-100 placeholder:text-slate-500"
+                    />
+                  </div>
+                </div>
                 <HistoryList
                   prompts={prompts}
+                  isSearch={!!historyQuery.trim()}
                   onSelectPrompt={handleSelectPrompt}
                   isLoading={isLoadingHistory}
+                  hasMore={!!historyCursor}
+                  isLoadingMore={isLoadingMoreHistory}
+                  onLoadMore={() => loadHistory(historyCursor)}
                 />
               </div>
             )}
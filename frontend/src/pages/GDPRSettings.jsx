@@ -25,6 +25,7 @@ const GDPRSettings = () => {
   });
   const [showDeleteDialog, setShowDeleteDialog] = useState(false);
   const [isExporting, setIsExporting] = useState(false);
+  const [exportJob, setExportJob] = useState(null);
   const [isDeleting, setIsDeleting] = useState(false);
 
   useEffect(() => {
@@ -59,39 +60,102 @@ const GDPRSettings = () => {
     toast.success(`Nastavení ${category === 'analytics' ? 'analytických' : 'marketingových'} cookies bylo aktualizováno`);
   };
 
+  const authHeaders = () => ({
+    'Authorization': `Bearer ${localStorage.getItem('token')}`
+  });
+
+  const downloadFrom = async (path) => {
+    const response = await fetch(`${BACKEND_URL}${path}`, {
+      credentials: 'include',
+      headers: authHeaders()
+    });
+
+    if (!response.ok) {
+      throw new Error('Export failed');
+    }
+
+    const blob = await response.blob();
+    const url = window.URL.createObjectURL(blob);
+    const a = document.createElement('a');
+    a.href = url;
+    a.download = `my-data-${new Date().toISOString().split('T')[0]}.zip`;
+    document.body.appendChild(a);
+    a.click();
+    window.URL.revokeObjectURL(url);
+    document.body.removeChild(a);
+  };
+
+  // The server streams a zip with one NDJSON file per dataset
   const handleExportData = async () => {
     setIsExporting(true);
     try {
-      const response = await fetch(`${BACKEND_URL}/api/gdpr/export`, {
+      await downloadFrom('/api/gdpr/export?format=zip');
+      toast.success('Vaše data byla úspěšně stažena');
+    } catch (error) {
+      console.error('Export error:', error);
+      toast.error('Chyba při exportu dat. Zkuste to prosím znovu.');
+    } finally {
+      setIsExporting(false);
+    }
+  };
+
+  // For very large accounts: the archive is prepared on the server, then downloaded when ready
+  const handleStartExportJob = async () => {
+    try {
+      const response = await fetch(`${BACKEND_URL}/api/gdpr/export/jobs`, {
+        method: 'POST',
         credentials: 'include',
-        headers: {
-          'Authorization': `Bearer ${localStorage.getItem('token')}`
-        }
+        headers: authHeaders()
       });
-
       if (!response.ok) {
-        throw new Error('Export failed');
+        throw new Error('Export job failed');
       }
+      setExportJob(await response.json());
+    } catch (error) {
+      console.error('Export job error:', error);
+      toast.error('Chyba při exportu dat. Zkuste to prosím znovu.');
+    }
+  };
 
-      const blob = await response.blob();
-      const url = window.URL.createObjectURL(blob);
-      const a = document.createElement('a');
-      a.href = url;
-      a.download = `my-data-${new Date().toISOString().split('T')[0]}.json`;
-      document.body.appendChild(a);
-      a.click();
-      window.URL.revokeObjectURL(url);
-      document.body.removeChild(a);
+  useEffect(() => {
+    if (!exportJob || !['pending', 'running'].includes(exportJob.status)) return;
+    const timer = setTimeout(async () => {
+      try {
+        const response = await fetch(`${BACKEND_URL}/api/gdpr/export/jobs/${exportJob.id}`, {
+          credentials: 'include',
+          headers: authHeaders()
+        });
+        if (!response.ok) {
+          throw new Error('Export job status failed');
+        }
+        const job = await response.json();
+        setExportJob(job);
+        if (job.status === 'completed') {
+          toast.success('Archiv je připraven ke stažení');
+        } else if (job.status === 'failed') {
+          toast.error('Chyba při exportu dat. Zkuste to prosím znovu.');
+        }
+      } catch (error) {
+        console.error('Export job error:', error);
+        setExportJob(null);
+        toast.error('Chyba při exportu dat. Zkuste to prosím znovu.');
+      }
+    }, 3000);
+    return () => clearTimeout(timer);
+  }, [exportJob]);
 
+  const handleDownloadExportJob = async () => {
+    try {
+      await downloadFrom(exportJob.download_url);
       toast.success('Vaše data byla úspěšně stažena');
     } catch (error) {
-      console.error('Export error:', error);
+      console.error('Export download error:', error);
       toast.error('Chyba při exportu dat. Zkuste to prosím znovu.');
-    } finally {
-      setIsExporting(false);
     }
   };
 
+  const exportJobRunning = exportJob && ['pending', 'running'].includes(exportJob.status);
+
   const handleDeleteAccount = async () => {
     setIsDeleting(true);
     try {
@@ -107,7 +171,8 @@ const GDPRSettings = () => {
         throw new Error('Deletion failed');
       }
 
-      toast.success('Váš účet byl smazán. Budete přesměrováni...');
+      // The account is locked at once; the data itself is removed by a background job
+      toast.success('Váš účet se maže. Budete přesměrováni...');
       
       // Clear local storage and redirect
       setTimeout(() => {
@@ -240,7 +305,8 @@ const GDPRSettings = () => {
           </div>
           
           <p className="text-slate-300 mb-4">
-            Stáhněte si kopii všech svých osobních údajů ve formátu JSON. Zahrnuje profil, transakce a historii agentů.
+            Stáhněte si kopii všech svých osobních údajů jako ZIP archiv (soubory NDJSON). Zahrnuje profil, transakce, historii agentů a auditní záznamy.
+            U velmi rozsáhlých účtů můžete archiv nechat připravit na pozadí a stáhnout jej, až bude hotový.
           </p>
           
           <Alert className="mb-4 bg-[#06d6a0]/10 border-[#06d6a0]/30">
@@ -267,6 +333,35 @@ const GDPRSettings = () => {
               </>
             )}
           </Button>
+
+          {exportJob && exportJob.status === 'completed' ? (
+            <Button
+              onClick={handleDownloadExportJob}
+              variant="outline"
+              className="ml-3 border-[#06d6a0]/50 text-[#06d6a0] hover:bg-[#06d6a0]/10"
+              data-testid="export-job-download-button"
+            >
+              <Download className="h-4 w-4 mr-2" />
+              Stáhnout připravený archiv
+            </Button>
+          ) : (
+            <Button
+              onClick={handleStartExportJob}
+              disabled={exportJobRunning}
+              variant="outline"
+              className="ml-3 border-slate-700 text-slate-300 hover:text-[#06d6a0]"
+              data-testid="export-job-button"
+            >
+              {exportJobRunning ? (
+                <>
+                  <RefreshCw className="h-4 w-4 mr-2 animate-spin" />
+                  Připravuji archiv...
+                </>
+              ) : (
+                'Připravit archiv na pozadí'
+              )}
+            </Button>
+          )}
         </div>
 
         {/* Account Deletion */}
@@ -2,7 +2,8 @@ import React, { useState, useEffect } from 'react';
 import { Card, CardHeader, CardTitle, CardContent } from '@/components/ui/card';
 import { Tooltip, TooltipContent, TooltipProvider, TooltipTrigger } from '@/components/ui/tooltip';
 import { AreaChart, Area, XAxis, YAxis, Tooltip as RTooltip, ResponsiveContainer, CartesianGrid } from 'recharts';
-import { DollarSign, Users, TrendingUp, Activity } from 'lucide-react';
+import { Button } from '@/components/ui/button';
+import { DollarSign, Users, TrendingUp, Activity, RefreshCw } from 'lucide-react';
 import axios from 'axios';
 import { toast } from 'sonner';
 
@@ -11,14 +12,16 @@ const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 export default function Overview() {
   const [data, setData] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [refreshing, setRefreshing] = useState(false);
   
   useEffect(() => {
     loadOverview();
   }, []);
   
-  const loadOverview = async () => {
+  // The backend serves a periodically refreshed snapshot; fresh forces recomputation
+  const loadOverview = async (fresh = false) => {
     try {
-      const response = await axios.get(`${API}/admin/overview`);
+      const response = await axios.get(`${API}/admin/overview`, { params: fresh ? { fresh: 1 } : {} });
       setData(response.data);
     } catch (error) {
       console.error('Error loading overview:', error);
@@ -28,6 +31,12 @@ export default function Overview() {
     }
   };
   
+  const handleRefresh = async () => {
+    setRefreshing(true);
+    await loadOverview(true);
+    setRefreshing(false);
+  };
+  
   if (loading) {
     return (
       <div className="flex items-center justify-center h-96">
@@ -48,9 +57,26 @@ export default function Overview() {
     <div className="space-y-6 px-4 sm:px-6 lg:px-8 py-6">
       <header className="relative p-6 border-b border-slate-800/50 overflow-hidden">
         <div className="absolute inset-0 bg-gradient-to-r from-[rgb(6,214,160)]/5 to-transparent" />
-        <div className="relative">
-          <h1 className="text-2xl font-semibold tracking-tight text-slate-100">Přehled</h1>
-          <p className="text-slate-400 text-sm mt-1">Klíčové metriky a spotřeba tokenů</p>
+        <div className="relative flex items-start justify-between gap-4">
+          <div>
+            <h1 className="text-2xl font-semibold tracking-tight text-slate-100">Přehled</h1>
+            <p className="text-slate-400 text-sm mt-1">Klíčové metriky a spotřeba tokenů</p>
+            {data.generated_at && (
+              <p className="text-slate-500 text-xs mt-1" data-testid="overview-generated-at">
+                Aktualizováno: {new Date(data.generated_at).toLocaleString('cs-CZ')}
+              </p>
+            )}
+          </div>
+          <Button
+            onClick={handleRefresh}
+            disabled={refreshing}
+            variant="outline"
+            className="border-slate-700 text-slate-300 hover:text-[rgb(6,214,160)]"
+            data-testid="overview-refresh-button"
+          >
+            <RefreshCw className={`h-4 w-4 mr-2 ${refreshing ? 'animate-spin' : ''}`} />
+            Obnovit
+          </Button>
         </div>
       </header>
       
@@ -1,4 +1,4 @@
-import React, { useMemo, useState, useEffect } from 'react';
+import React, { useState, useEffect } from 'react';
 import { Card, CardHeader, CardTitle, CardContent } from '@/components/ui/card';
 import { Input } from '@/components/ui/input';
 import { Table, TableHeader, TableRow, TableHead, TableBody, TableCell } from '@/components/ui/table';
@@ -11,10 +11,14 @@ import axios from 'axios';
 import { toast } from 'sonner';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+// Columns the backend can sort on; the other columns are not sortable
+const SERVER_SORT_KEYS = ['sequence_id', 'name', 'omega_tokens_balance', 'agents_count', 'total_tokens_consumed', 'last_login_at'];
 
 export default function Users() {
   const [users, setUsers] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [q, setQ] = useState('');
   const [sortKey, setSortKey] = useState('sequence_id');
   const [sortDir, setSortDir] = useState('desc');
@@ -22,13 +26,23 @@ export default function Users() {
   const [tokenDelta, setTokenDelta] = useState(0);
   
   useEffect(() => {
-    loadUsers();
-  }, []);
+    const timer = setTimeout(() => loadUsers(), 300);
+    return () => clearTimeout(timer);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [q, sortKey, sortDir]);
   
-  const loadUsers = async () => {
+  const loadUsers = async (cursor = null) => {
     try {
-      const response = await axios.get(`${API}/admin/users`);
-      setUsers(response.data);
+      const response = await axios.get(`${API}/admin/users`, {
+        params: {
+          search: q || undefined,
+          sort_by: sortKey,
+          sort_dir: sortDir,
+          cursor: cursor || undefined
+        }
+      });
+      setUsers(prev => (cursor ? [...prev, ...response.data.items] : response.data.items));
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error loading users:', error);
       toast.error('Failed to load users');
@@ -37,6 +51,13 @@ export default function Users() {
     }
   };
   
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    await loadUsers(nextCursor);
+    setLoadingMore(false);
+  };
+  
   const loadUserDetail = async (userId) => {
     try {
       const response = await axios.get(`${API}/admin/users/${userId}`);
@@ -90,20 +111,8 @@ export default function Users() {
     }
   };
   
-  const filtered = useMemo(() => {
-    const term = q.toLowerCase();
-    const base = users.filter(u => u.name?.toLowerCase().includes(term) || u.email?.toLowerCase().includes(term));
-    return base.sort((a, b) => {
-      const m = sortDir === 'asc' ? 1 : -1;
-      const aVal = a[sortKey] ?? '';
-      const bVal = b[sortKey] ?? '';
-      if (aVal > bVal) return m;
-      if (aVal < bVal) return -m;
-      return 0;
-    });
-  }, [q, users, sortKey, sortDir]);
-  
   const toggleSort = (key) => {
+    if (!SERVER_SORT_KEYS.includes(key)) return;
     if (key === sortKey) setSortDir(sortDir === 'asc' ? 'desc' : 'asc');
     else { setSortKey(key); setSortDir('asc'); }
   };
@@ -134,7 +143,7 @@ export default function Users() {
     <div className="px-4 sm:px-6 lg:px-8 py-6 space-y-6">
       <Card className="bg-[rgb(15,23,42)]/60 border-slate-800/50">
         <CardHeader className="flex flex-col sm:flex-row sm:items-center sm:justify-between gap-3">
-          <CardTitle className="text-slate-100">Uživatelé ({users.length})</CardTitle>
+          <CardTitle className="text-slate-100">Uživatelé ({users.length}{nextCursor ? '+' : ''})</CardTitle>
           <div className="relative w-full sm:w-64">
             <Search className="absolute left-3 top-1/2 -translate-y-1/2 h-4 w-4 text-slate-500" />
             <Input
@@ -163,7 +172,9 @@ export default function Users() {
                     <TableHead
                       key={key}
                       onClick={() => toggleSort(key)}
-                      className="cursor-pointer select-none text-slate-300 hover:text-[rgb(6,214,160)] transition-colors"
+                      className={SERVER_SORT_KEYS.includes(key)
+                        ? "cursor-pointer select-none text-slate-300 hover:text-[rgb(6,214,160)] transition-colors"
+                        : "select-none text-slate-300"}
                       data-testid="users-header-sort"
                     >
                       {label}
@@ -173,7 +184,7 @@ export default function Users() {
                 </TableRow>
               </TableHeader>
               <TableBody>
-                {filtered.map((u) => (
+                {users.map((u) => (
                   <TableRow
                     key={u.id}
                     data-testid="users-row"
@@ -199,6 +210,19 @@ export default function Users() {
               </TableBody>
             </Table>
           </div>
+          {nextCursor && (
+            <div className="flex justify-center pt-4">
+              <Button
+                onClick={loadMore}
+                disabled={loadingMore}
+                variant="outline"
+                className="border-slate-700 text-slate-300 hover:text-[rgb(6,214,160)]"
+                data-testid="users-load-more-button"
+              >
+                {loadingMore ? 'Načítání...' : 'Načíst další'}
+              </Button>
+            </div>
+          )}
         </CardContent>
       </Card>
       
@@ -0,0 +1,23 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "omega_test")
+os.environ.setdefault("EMERGENT_LLM_KEY", "test-key")
+
+
+@pytest.fixture
+def server():
+    """The backend module with its db swapped for a fresh in-memory mongomock database"""
+    pytest.importorskip("emergentintegrations")
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import server as module
+
+    original = module.db
+    module.db = mongomock_motor.AsyncMongoMockClient()["omega_test"]
+    yield module
+    module.db = original
@@ -0,0 +1,53 @@
+import asyncio
+
+from starlette.requests import Request
+
+
+async def _seed(server, count: int) -> Request:
+    await server.db.users.insert_one({"id": "admin", "email": "admin@example.com", "name": "Admin", "is_admin": True, "omega_tokens_balance": 0})
+    for i in range(count):
+        name, email = f"Uživatel {i}", f"user{i}@example.com"
+        await server.db.users.insert_one({
+            "id": f"user-{i:02d}", "name": name, "email": email, "omega_tokens_balance": i,
+            "search_keys": server.user_search_keys(name, email)
+        })
+        await server.db.user_stats.insert_one({"user_id": f"user-{i:02d}", "agents_count": (i * 7) % 5, "total_tokens_consumed": i})
+    token = server.create_jwt_token("admin", "admin@example.com", True)
+    return Request({
+        "type": "http", "method": "GET", "path": "/api/admin/users", "query_string": b"",
+        "headers": [(b"authorization", f"Bearer {token}".encode())], "client": ("127.0.0.1", 0)
+    })
+
+
+async def _walk(server, request: Request, **params) -> list:
+    rows, cursor = [], None
+    while True:
+        page = await server.get_admin_users(request, limit=4, cursor=cursor, **params)
+        rows += page["items"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return rows
+
+
+def test_stats_sort_pages_in_global_order(server):
+    async def scenario():
+        request = await _seed(server, 12)
+        rows = await _walk(server, request, sort_by="agents_count", sort_dir="desc")
+
+        # Every user once (the admin has no stats row yet, so it is not listed)
+        assert len(rows) == 12
+        keys = [(row["agents_count"], row["id"]) for row in rows]
+        assert keys == sorted(keys, reverse=True)
+
+    asyncio.run(scenario())
+
+
+def test_search_matches_folded_word_prefixes(server):
+    async def scenario():
+        request = await _seed(server, 12)
+        rows = await _walk(server, request, search="UZIV 1", sort_by="total_tokens_consumed", sort_dir="asc")
+
+        assert [row["id"] for row in rows] == ["user-01", "user-10", "user-11"]
+        assert [row["email"] for row in await _walk(server, request, search="user1@")] == ["user1@example.com"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,35 @@
+import asyncio
+import json
+import os
+import uuid
+
+import pytest
+
+
+def test_hot_queries_use_indexes():
+    """Every HOT_QUERIES entry is answered by an IXSCAN once ensure_indexes has run (needs a mongod)"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pymongo.errors import PyMongoError
+    import db_indexes
+
+    async def scenario():
+        client = AsyncIOMotorClient(os.environ["MONGO_URL"], serverSelectionTimeoutMS=1000)
+        try:
+            await client.admin.command("ping")
+        except PyMongoError:
+            client.close()
+            pytest.skip(f"no mongod reachable at {os.environ['MONGO_URL']}")
+
+        # Scratch database, so the check never touches real data
+        name = f"omega_index_test_{uuid.uuid4().hex[:8]}"
+        db = client[name]
+        try:
+            result = await db_indexes.ensure_indexes(db)
+            assert result["failed"] == []
+            slow = [row for row in await db_indexes.explain_hot_queries(db) if not row["ixscan"]]
+            assert not slow, "hot queries without an index: " + json.dumps(slow, default=str)
+        finally:
+            await client.drop_database(name)
+            client.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+
+async def _create_user(server, balance: int) -> str:
+    await server.db.users.insert_one({"id": "user-1", "omega_tokens_balance": balance, "is_admin": False})
+    # Unique ledger ids, as in production (db_indexes), so duplicate records would fail loudly
+    await server.db.token_transactions.create_index("id", unique=True)
+    return "user-1"
+
+
+async def _balance(server, user_id: str) -> int:
+    return (await server.db.users.find_one({"id": user_id}))["omega_tokens_balance"]
+
+
+def test_concurrent_deductions_apply_exactly_once(server):
+    async def scenario():
+        user_id = await _create_user(server, 10_000)
+        results = await asyncio.gather(*[
+            server.deduct_tokens(user_id, 7, f"call {i}") for i in range(50)
+        ])
+
+        assert await _balance(server, user_id) == 10_000 - 50 * 7
+        # Every call saw its own balance and left exactly one ledger row behind
+        assert sorted(results) == [10_000 - 7 * n for n in range(50, 0, -1)]
+        ledger = await server.db.token_transactions.find({"user_id": user_id}).to_list(None)
+        assert len(ledger) == 50
+        assert sorted(row["balance_after"] for row in ledger) == sorted(results)
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_deductions_stop_when_funds_run_out(server):
+    async def scenario():
+        user_id = await _create_user(server, 1_000)
+        results = await asyncio.gather(*[
+            server.deduct_tokens(user_id, 100, f"call {i}", min_balance=0) for i in range(15)
+        ], return_exceptions=True)
+
+        succeeded = [result for result in results if isinstance(result, int)]
+        rejected = [result for result in results if isinstance(result, HTTPException)]
+        assert len(succeeded) == 10
+        assert len(rejected) == 5 and all(error.status_code == 402 for error in rejected)
+        assert await _balance(server, user_id) == 0
+
+        with pytest.raises(HTTPException) as error:
+            await server.deduct_tokens(user_id, 1, "after funds ran out", min_balance=0)
+        assert error.value.status_code == 402
+        assert await _balance(server, user_id) == 0
+        assert await server.db.token_transactions.count_documents({"user_id": user_id}) == 10
+
+    asyncio.run(scenario())
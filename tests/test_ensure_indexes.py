@@ -0,0 +1,140 @@
+import asyncio
+import logging
+
+import pytest
+
+
+class _Cursor:
+    def __init__(self, docs: list):
+        self.docs = docs
+
+    async def to_list(self, length=None):
+        return self.docs[:length]
+
+
+class _Collection:
+    """mongomock collection whose index errors carry the codes a mongod reports"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def create_indexes(self, models):
+        from pymongo.errors import OperationFailure
+        try:
+            return await self.collection.create_indexes(models)
+        except OperationFailure as e:
+            raise OperationFailure(str(e), code=85) if "different options" in str(e) else e
+
+    async def drop_index(self, name):
+        from pymongo.errors import OperationFailure
+        try:
+            return await self.collection.drop_index(name)
+        except OperationFailure as e:
+            raise OperationFailure(str(e), code=27) if "not found" in str(e) else e
+
+
+class _Database:
+    """
+    mongomock database with what ensure_indexes needs beyond it: list_collections with
+    collection types, time-series create_collection and collMod (recorded in `commands`)
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.options = {}
+        self.commands = []
+
+    def __getitem__(self, name):
+        return _Collection(self.db[name])
+
+    async def list_collection_names(self):
+        return await self.db.list_collection_names()
+
+    async def list_collections(self, filter):
+        names = await self.db.list_collection_names()
+        return _Cursor([
+            {
+                "name": name,
+                "type": "timeseries" if "timeseries" in self.options.get(name, {}) else "collection",
+                "options": self.options.get(name, {})
+            }
+            for name in names if name == filter["name"]
+        ])
+
+    async def create_collection(self, name, **options):
+        await self.db.create_collection(name)
+        self.options[name] = dict(options)
+
+    async def command(self, name, collection, **kwargs):
+        self.commands.append((name, collection, kwargs))
+
+
+@pytest.fixture
+def database():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return _Database(mongomock_motor.AsyncMongoMockClient()["omega_index_test"])
+
+
+def test_ensure_indexes_is_idempotent(database):
+    import db_indexes
+
+    async def scenario():
+        defined = sum(len(models) for models in db_indexes.INDEXES.values())
+        for _ in range(2):
+            result = await db_indexes.ensure_indexes(database)
+            assert result == {"ensured": defined, "failed": []}
+
+        for collection, models in db_indexes.INDEXES.items():
+            existing = await database[collection].index_information()
+            assert {model.document["name"] for model in models} <= set(existing)
+        # audit_logs was created as a time-series collection once, with nothing to adjust afterwards
+        assert database.options["audit_logs"] == db_indexes.TIME_SERIES_COLLECTIONS["audit_logs"]
+        assert database.commands == []
+
+    asyncio.run(scenario())
+
+
+def test_retired_indexes_are_dropped_quietly(database, caplog):
+    import db_indexes
+    from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+    async def scenario():
+        await database["generated_prompts"].create_indexes([IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)])])
+        await database["prompt_bodies"].create_indexes([IndexModel([("terms", TEXT)], name="prompt_body_search")])
+
+        with caplog.at_level(logging.INFO, logger="db_indexes"):
+            result = await db_indexes.ensure_indexes(database)
+
+        assert result["failed"] == []
+        for collection, names in db_indexes.RETIRED_INDEXES.items():
+            assert not set(names) & set(await database[collection].index_information())
+        dropped = [r.getMessage() for r in caplog.records if r.getMessage().startswith("Dropped retired index")]
+        assert dropped == [
+            "Dropped retired index generated_prompts.user_id_1_created_at_-1",
+            "Dropped retired index prompt_bodies.prompt_body_search"
+        ]
+        # Retired indexes that were never there are not errors
+        assert not [r for r in caplog.records if r.levelno >= logging.ERROR]
+
+    asyncio.run(scenario())
+
+
+def test_changed_ttl_is_adjusted_with_collmod(database):
+    import db_indexes
+    from pymongo import ASCENDING, IndexModel
+
+    async def scenario():
+        # Created by an older release with a different TTL than RESPONSE_CACHE_TTL_SECONDS
+        await database["llm_response_cache"].create_indexes([IndexModel([("created_at", ASCENDING)], expireAfterSeconds=60)])
+
+        result = await db_indexes.ensure_indexes(database)
+
+        assert result["failed"] == []
+        assert database.commands == [("collMod", "llm_response_cache", {
+            "index": {"keyPattern": {"created_at": 1}, "expireAfterSeconds": db_indexes.RESPONSE_CACHE_TTL_SECONDS}
+        })]
+
+    asyncio.run(scenario())
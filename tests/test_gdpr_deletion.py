@@ -0,0 +1,65 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from starlette.requests import Request
+
+
+async def _create_user(server) -> dict:
+    user = {"id": "user-1", "email": "user@example.com", "name": "User", "omega_tokens_balance": 100, "is_admin": False}
+    await server.db.users.insert_one(dict(user))
+    return user
+
+
+def _request(server, user: dict) -> Request:
+    token = server.create_jwt_token(user["id"], user["email"], False)
+    return Request({
+        "type": "http", "method": "DELETE", "path": "/api/gdpr/delete", "query_string": b"",
+        "headers": [(b"authorization", f"Bearer {token}".encode())], "client": ("127.0.0.1", 0)
+    })
+
+
+def test_job_status_needs_the_job_token(server, monkeypatch):
+    # The background audit writer is running, as in the API: the delete entry must not wait in its queue
+    monkeypatch.setattr(server.audit_writer, "_running", True)
+
+    async def scenario():
+        user = await _create_user(server)
+        reply = await server.delete_user_account(_request(server, user))
+        job_id = reply["job"]["id"]
+
+        assert await server.db.audit_logs.find_one({"meta.user_id": user["id"], "meta.action": "delete"})
+        assert (await server.get_deletion_job(job_id, token=reply["status_token"]))["id"] == job_id
+        for token in (None, server.create_jwt_token(user["id"], user["email"], False), server.create_deletion_job_token("other")):
+            with pytest.raises(server.HTTPException) as error:
+                await server.get_deletion_job(job_id, token=token)
+            assert error.value.status_code == 403
+        with pytest.raises(server.HTTPException) as error:
+            await server.retry_deletion_job(job_id)
+        assert error.value.status_code == 403
+
+    asyncio.run(scenario())
+
+
+def test_account_step_sweeps_prompts_created_after_their_step(server, monkeypatch):
+    monkeypatch.setattr(server, "USER_CACHE_TTL_SECONDS", 0)
+
+    async def plain_audit_collections():
+        return ["audit_logs"]  # mongomock has no list_collections; its audit_logs is a plain collection
+
+    monkeypatch.setattr(server, "plain_audit_collections", plain_audit_collections)
+
+    async def scenario():
+        user = await _create_user(server)
+        job = {"id": "job-1", "user_id": user["id"], "transaction_alias": "DELETED-1", "audit_alias": "ANONYMIZED-1",
+               "requested_at": datetime.now(timezone.utc)}
+        # Created by a worker that still had the user cached after the prompts step finished
+        await server.db.generated_prompts.insert_one({"id": "late", "user_id": user["id"]})
+
+        assert await server.delete_account_records(job) == 1
+        assert await server.db.users.find_one({"id": user["id"]})
+        assert await server.delete_account_records(job) == 0
+        assert not await server.db.generated_prompts.find_one({"user_id": user["id"]})
+        assert not await server.db.users.find_one({"id": user["id"]})
+
+    asyncio.run(scenario())
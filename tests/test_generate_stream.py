@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+from starlette.requests import Request
+
+
+async def _create_user(server, balance: int) -> dict:
+    user = {"id": "user-1", "email": "user@example.com", "name": "User", "omega_tokens_balance": balance, "is_admin": False}
+    await server.db.users.insert_one(dict(user))
+    return user
+
+
+def _request(server, user: dict) -> Request:
+    token = server.create_jwt_token(user["id"], user["email"], False)
+    return Request({
+        "type": "http", "method": "POST", "path": "/api/generate/stream", "query_string": b"",
+        "headers": [(b"authorization", f"Bearer {token}".encode())], "client": ("127.0.0.1", 0)
+    })
+
+
+def _fake_llm(monkeypatch, server, chunks: list, error: Exception = None):
+    """Replace the pooled LLM client with one that streams `chunks`, then raises `error` if given"""
+    async def stream(route, system_message, user_text, session_id, temperature, timeout):
+        for chunk in chunks:
+            yield chunk
+        if error:
+            raise error
+
+    monkeypatch.setattr(server.llm_pool, "client", lambda route: object())
+    monkeypatch.setattr(server.llm_pool, "stream", stream)
+
+
+async def _events(server, user: dict, stage: str, user_input: str) -> list:
+    request = server.GenerateRequest(stage=stage, messages=[], user_input=user_input)
+    response = await server.generate_omega_prompt_stream(request, _request(server, user))
+    events = []
+    async for raw in response.body_iterator:
+        name, data = raw.strip().split("\n")
+        events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+async def _balance(server, user_id: str) -> int:
+    return (await server.db.users.find_one({"id": user_id}))["omega_tokens_balance"]
+
+
+def test_timed_out_stream_charges_the_streamed_part(server, monkeypatch):
+    streamed = ["# Prompt\n", "x" * 395]
+    _fake_llm(monkeypatch, server, streamed, asyncio.TimeoutError())
+
+    async def scenario():
+        user = await _create_user(server, 10_000)
+        events = await _events(server, user, "final", "Timed out stream")
+
+        assert [name for name, _ in events] == ["delta", "delta", "error"]
+        assert events[-1][1]["status_code"] == 504
+        charged = len("".join(streamed)) // 4
+        assert await _balance(server, user["id"]) == 10_000 - charged
+        user_doc = await server.db.users.find_one({"id": user["id"]})
+        assert not user_doc.get("token_holds")  # The rest of the hold was released
+        ledger = await server.db.token_transactions.find({"user_id": user["id"]}).to_list(None)
+        assert [row["amount"] for row in ledger] == [-charged]
+
+    asyncio.run(scenario())
+
+
+def test_malformed_array_does_not_resend_streamed_items(server, monkeypatch):
+    _fake_llm(monkeypatch, server, ['["Kdo jsou zákazníci?", ', '"Jaký je cíl?", ', 'oops, "Proč?"'])
+
+    async def scenario():
+        user = await _create_user(server, 10_000)
+        events = await _events(server, user, "clarify", "Malformed array")
+
+        items = [data for name, data in events if name == "item"]
+        assert [item["index"] for item in items] == [0, 1]
+        assert events[-1] == ("done", {
+            "stage": "clarify",
+            "questions": ["Kdo jsou zákazníci?", "Jaký je cíl?"],
+            "usage": {"tokens": len('["Kdo jsou zákazníci?", "Jaký je cíl?", oops, "Proč?"') // 4}
+        })
+
+    asyncio.run(scenario())
@@ -0,0 +1,30 @@
+import pytest
+
+
+def _parse(server, chunks: list):
+    parser = server.JsonArrayStreamParser()
+    emitted = [item for chunk in chunks for item in parser.feed(chunk)]
+    return emitted, parser.result()
+
+
+def test_elements_are_emitted_as_soon_as_they_close(server):
+    emitted, result = _parse(server, ['```json\n["Kdo jsou', ' zákazníci?", "Jaký', ' je cíl?"]\n```'])
+    assert emitted == result == ["Kdo jsou zákazníci?", "Jaký je cíl?"]
+
+
+@pytest.mark.parametrize("reply", [
+    '["Who?", "What?", "Wh',  # Truncated mid-element
+    '["Who?", "What?", oops, "Why?"]',  # Malformed element
+])
+def test_broken_array_keeps_the_elements_already_emitted(server, reply):
+    emitted, result = _parse(server, [reply])
+    assert emitted == result == ["Who?", "What?"]
+
+
+@pytest.mark.parametrize("reply, expected", [
+    ("Who?\nWhat?", None),  # Not an array - the caller falls back to splitting lines
+    ('["Wh', None),  # Broke off before the first element
+    ("[]", []),
+])
+def test_result_without_emitted_elements(server, reply, expected):
+    assert _parse(server, [reply])[1] == expected